@@ -1,29 +1,65 @@
-import serial
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import os
+import sys
 
-def read_serial(port, baudrate, name):
+# 共通モジュール(analyze_common)を読み込むためのパス設定
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from analyze_common.async_ingest import AsyncIngest
+from analyze_common.proc_ingest import ProcessIngest
+
+WORKERS = 0  # 0: 1プロセスで受信 / 1以上: ポートをワーカープロセスに分散して受信・パース
+
+async def print_port(ingest, name):
     count = 0
+    async for batch in ingest.stream(name):
+        for timestamp, x, y, z in batch.values:
+            count += 1
+            if count % 10 == 0:
+                print(f"[{name}] t={timestamp:.2f} x={x:.6f} y={y:.6f} z={z:.6f}")
+        if count % 10 == 0:
+            for line in batch.raw:
+                print(f"[{name}] {line}")
+    error = ingest.streams[name].error
+    if error:
+        print(f"[{name}] Error: {error}")
+
+async def main(ports):
+    # 全ポートを1つのイベントループで受信する（ポートごとのスレッドは使わない）
+    ingest = AsyncIngest()
+    tasks = []
+    for p in ports:
+        try:
+            ingest.add_serial(p["name"], p["port"], p["baudrate"])
+        except Exception as e:
+            print(f"[{p['name']}] Error: {e}")
+            continue
+        print(f"[{p['name']}] Opened {p['port']}")
+        tasks.append(asyncio.create_task(print_port(ingest, p["name"])))
     try:
-        with serial.Serial(port, baudrate, timeout=1) as ser:
-            print(f"[{name}] Opened {port}")
-            while True:
-                line = ser.readline().decode(errors='ignore').strip()
-                if line:
-                    try:
-                        parts = line.split(',')
-                        if len(parts) == 4:
-                            timestamp, x, y, z = map(float, parts)
-                            count += 1
-                            if count % 10 == 0:
-                                print(f"[{name}] t={timestamp:.2f} x={x:.6f} y={y:.6f} z={z:.6f}")
-                        else:
-                            if count % 10 == 0:
-                                print(f"[{name}] {line}")
-                    except Exception:
-                        if count % 10 == 0:
-                            print(f"[{name}] {line}")
-    except Exception as e:
-        print(f"[{name}] Error: {e}")
+        await asyncio.gather(*tasks)  # 通常は無限に受信し続けるのでCtrl+Cまで待機
+    finally:
+        ingest.close()
+
+def run_processes(ports, workers):
+    # ボードが多い場合: 受信とパースをワーカープロセスに任せ、配列のまとまりで受け取る
+    counts = {p["name"]: 0 for p in ports}
+    with ProcessIngest(ports, workers=workers) as ingest:
+        while True:
+            item = ingest.get(timeout=1.0)
+            for name, error in ingest.errors.items():
+                print(f"[{name}] Error: {error}")
+            ingest.errors.clear()
+            for name, lines in ingest.raw.items():
+                for line in lines:
+                    print(f"[{name}] {line}")
+            ingest.raw.clear()
+            if item is None:
+                continue
+            name, values = item
+            for timestamp, x, y, z in values:
+                counts[name] += 1
+                if counts[name] % 10 == 0:
+                    print(f"[{name}] t={timestamp:.2f} x={x:.6f} y={y:.6f} z={z:.6f}")
 
 if __name__ == "__main__":
     ports = [
@@ -33,12 +69,9 @@ if __name__ == "__main__":
 
     print("両方のCOMポートからの受信を開始しました。Ctrl+Cで終了します。")
     try:
-        with ThreadPoolExecutor(max_workers=len(ports)) as executor:
-            futures = [
-                executor.submit(read_serial, p["port"], p["baudrate"], p["name"])
-                for p in ports
-            ]
-            for f in futures:
-                f.result()  # ここで各スレッドの終了を待つ（通常は無限ループなのでCtrl+Cまで待機）
+        if WORKERS:
+            run_processes(ports, WORKERS)
+        else:
+            asyncio.run(main(ports))
     except KeyboardInterrupt:
         print("終了します。")
\ No newline at end of file
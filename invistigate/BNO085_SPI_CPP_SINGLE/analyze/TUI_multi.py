@@ -1,37 +1,65 @@
-import serial
-from concurrent.futures import ThreadPoolExecutor
-from queue import Queue
+import asyncio
+import os
+import sys
 from rich.live import Live
 from rich.table import Table
-import time
+
+# 共通モジュール(analyze_common)を読み込むためのパス設定
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from analyze_common.async_ingest import AsyncIngest
+from analyze_common.records import ImuSample
 
 # 複数のBNO08xセンサー（Arduino等）からのCSVデータを受信し、区別して表示する
 # 各センサーは milisec,x,y,z の形式で出力することを想定
+# 全ポートを1つのイベントループで受信する（ポートごとのスレッドは使わない）
+
+async def read_port(ingest, name, latest_data):
+    """ポートから届いたバッチの最新の値を保持する"""
+    async for batch in ingest.stream(name):
+        if len(batch.values):
+            latest_data[name] = ImuSample(*batch.values[-1].tolist())
+        elif batch.raw:
+            latest_data[name] = batch.raw[-1]
+    error = ingest.streams[name].error
+    if error:
+        latest_data[name] = error
+
+def make_table(ports, latest_data):
+    table = Table(title="BNO08x Sensors Live Data")
+    table.add_column("Sensor", style="cyan", no_wrap=True)
+    table.add_column("Time(ms)", justify="right")
+    table.add_column("X", justify="right")
+    table.add_column("Y", justify="right")
+    table.add_column("Z", justify="right")
+    for p in ports:
+        d = latest_data.get(p["name"])
+        if isinstance(d, ImuSample):
+            table.add_row(p["name"], f"{d.milisec:.0f}", f"{d.x:.6f}", f"{d.y:.6f}", f"{d.z:.6f}")
+        elif d is not None:
+            # 数値以外の行やエラーメッセージ
+            table.add_row(p["name"], d, '-', '-', '-')
+        else:
+            table.add_row(p["name"], '-', '-', '-', '-')
+    return table
 
-def read_serial(port, baudrate, name, data_queue):
+async def main(ports):
+    latest_data = {}
+    ingest = AsyncIngest()
+    tasks = []
+    for p in ports:
+        try:
+            ingest.add_serial(p["name"], p["port"], p["baudrate"])
+        except Exception as e:
+            latest_data[p["name"]] = str(e)
+            continue
+        tasks.append(asyncio.create_task(read_port(ingest, p["name"], latest_data)))
     try:
-        with serial.Serial(port, baudrate, timeout=1) as ser:
+        with Live(make_table(ports, latest_data), refresh_per_second=10) as live:
             while True:
-                line = ser.readline().decode(errors='ignore').strip()
-                if line:
-                    try:
-                        parts = line.split(',')
-                        # milisec,x,y,z 形式のデータをパース
-                        if len(parts) == 4:
-                            milisec, x, y, z = map(float, parts)
-                            data_queue.put({
-                                'name': name,
-                                'milisec': milisec,
-                                'x': x,
-                                'y': y,
-                                'z': z
-                            })
-                        else:
-                            data_queue.put({'name': name, 'raw': line})
-                    except Exception:
-                        data_queue.put({'name': name, 'raw': line})
-    except Exception as e:
-        data_queue.put({'name': name, 'error': str(e)})
+                live.update(make_table(ports, latest_data))
+                await asyncio.sleep(0.05)
+    finally:
+        ingest.close()
 
 if __name__ == "__main__":
     # ここで各COMポート・センサー名を指定
@@ -41,40 +69,8 @@ if __name__ == "__main__":
         # 必要に応じて追加
     ]
 
-    from collections import defaultdict
-    latest_data = defaultdict(dict)
-    data_queue = Queue()
-
-    def make_table():
-        table = Table(title="BNO08x Sensors Live Data")
-        table.add_column("Sensor", style="cyan", no_wrap=True)
-        table.add_column("Time(ms)", justify="right")
-        table.add_column("X", justify="right")
-        table.add_column("Y", justify="right")
-        table.add_column("Z", justify="right")
-        for p in ports:
-            d = latest_data.get(p["name"], {})
-            if 'error' in d:
-                table.add_row(p["name"], d['error'], '-', '-', '-')
-            elif 'milisec' in d:
-                table.add_row(p["name"], f"{d['milisec']:.0f}", f"{d['x']:.6f}", f"{d['y']:.6f}", f"{d['z']:.6f}")
-            elif 'raw' in d:
-                table.add_row(p["name"], d['raw'], '-', '-', '-')
-            else:
-                table.add_row(p["name"], '-', '-', '-', '-')
-        return table
-
     print("複数BNO08xセンサーからの受信をTUIで開始しました。Ctrl+Cで終了します。")
     try:
-        with ThreadPoolExecutor(max_workers=len(ports)) as executor:
-            for p in ports:
-                executor.submit(read_serial, p["port"], p["baudrate"], p["name"], data_queue)
-            with Live(make_table(), refresh_per_second=10) as live:
-                while True:
-                    while not data_queue.empty():
-                        d = data_queue.get()
-                        latest_data[d['name']] = d
-                    live.update(make_table())
-                    time.sleep(0.05)
+        asyncio.run(main(ports))
     except KeyboardInterrupt:
         print("終了します。")
\ No newline at end of file
@@ -2,20 +2,21 @@ import serial
 from rich.live import Live
 from rich.table import Table
 import time
+import numpy as np
+import os
+import sys
 
-def read_serial(ser):
+# 共通モジュール(analyze_common)を読み込むためのパス設定
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from analyze_common.records import ImuSample
+from analyze_common.text_parse import ChunkedReader
+
+def read_serial(reader):
+    """受信済みの行をまとめて読み、(milisec,x,y,z の (n, 4) 配列, その他の行やエラー) を返す"""
     try:
-        line = ser.readline().decode(errors='ignore').strip()
-        if line:
-            parts = line.split(',')
-            if len(parts) == 4:
-                milisec, x, y, z = map(float, parts)
-                return {'milisec': milisec, 'x': x, 'y': y, 'z': z}
-            else:
-                return {'raw': line}
+        return reader.read()
     except Exception as e:
-        return {'error': str(e)}
-    return {}
+        return np.empty((0, 4)), [str(e)]
 
 def make_table(data, sampling_rate=None):
     table = Table(title="BNO08x Sensor Live Data")
@@ -24,13 +25,11 @@ def make_table(data, sampling_rate=None):
     table.add_column("Y", justify="right")
     table.add_column("Z", justify="right")
     table.add_column("Sampling Rate(Hz)", justify="right")
-    if 'error' in data:
-        table.add_row(data['error'], '-', '-', '-', '-')
-    elif 'milisec' in data:
+    if isinstance(data, ImuSample):
         sr_str = f"{sampling_rate:.2f}" if sampling_rate is not None else '-'
-        table.add_row(f"{data['milisec']:.0f}", f"{data['x']:.6f}", f"{data['y']:.6f}", f"{data['z']:.6f}", sr_str)
-    elif 'raw' in data:
-        table.add_row(data['raw'], '-', '-', '-', '-')
+        table.add_row(f"{data.milisec:.0f}", f"{data.x:.6f}", f"{data.y:.6f}", f"{data.z:.6f}", sr_str)
+    elif data:
+        table.add_row(data, '-', '-', '-', '-')
     else:
         table.add_row('-', '-', '-', '-', '-')
     return table
@@ -42,31 +41,26 @@ if __name__ == "__main__":
     print(f"{port} からの受信をTUIで開始します。Ctrl+Cで終了します。")
     try:
         with serial.Serial(port, baudrate, timeout=1) as ser:
-            latest_data = {}
+            reader = ChunkedReader(ser, 4)
+            latest_data = None
             prev_milisec = None  # 前回のmilisec値（センサタイムスタンプ）
             sampling_rate = None
             with Live(make_table(latest_data, sampling_rate), refresh_per_second=250) as live:
                 while True:
-                    # バッファ内のデータを全て読み捨てて最新だけ取得
-                    latest_valid = None
-                    for _ in range(20):  # 1ループで最大20件までスキップ
-                        d = read_serial(ser)
-                        if d and 'milisec' in d:
-                            latest_valid = d
-                    if latest_valid:
-                        d = latest_valid
-                    else:
-                        d = read_serial(ser)
-                    if d and 'milisec' in d:
-                        # milisec値（センサタイムスタンプ）でサンプリングレートを計算
+                    # バッファ内のデータをまとめて読み、最新だけ表示
+                    values, others = read_serial(reader)
+                    if len(values):
+                        # milisec値（センサタイムスタンプ）の直近2点でサンプリングレートを計算
+                        if len(values) > 1:
+                            prev_milisec = values[-2, 0]
                         if prev_milisec is not None:
-                            dt = (d['milisec'] - prev_milisec) / 1000.0
+                            dt = (values[-1, 0] - prev_milisec) / 1000.0
                             if dt > 0:  # 負のdt（タイムスタンプ巻き戻り）は無視
                                 sampling_rate = 1.0 / dt
-                        prev_milisec = d['milisec']
-                        latest_data = d
-                    elif d:
-                        latest_data = d
+                        prev_milisec = values[-1, 0]
+                        latest_data = ImuSample(*values[-1].tolist())
+                    elif others:
+                        latest_data = others[-1]
                     live.update(make_table(latest_data, sampling_rate))
                     time.sleep(0.005)
     except KeyboardInterrupt:
@@ -1,30 +1,41 @@
-import serial
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import os
+import sys
+
+# 共通モジュール(analyze_common)を読み込むためのパス設定
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from analyze_common.async_ingest import AsyncIngest
 
 # 複数のBNO08xセンサー（Arduino等）からのCSVデータを受信し、区別して表示する
 # 各センサーは milisec,x,y,z の形式で出力することを想定
+# 全ポートを1つのイベントループで受信する（ポートごとのスレッドは使わない）
+
+async def print_port(ingest, name):
+    # すべての行を出力する
+    async for batch in ingest.stream(name):
+        for milisec, x, y, z in batch.values:
+            print(f"[{name}] t={milisec:.0f} x={x:.6f} y={y:.6f} z={z:.6f}")
+        for line in batch.raw:
+            print(f"[{name}] {line}")
+    error = ingest.streams[name].error
+    if error:
+        print(f"[{name}] Error: {error}")
 
-def read_serial(port, baudrate, name):
-    # すべての行を出力するように変更
+async def main(ports):
+    ingest = AsyncIngest()
+    tasks = []
+    for p in ports:
+        try:
+            ingest.add_serial(p["name"], p["port"], p["baudrate"])
+        except Exception as e:
+            print(f"[{p['name']}] Error: {e}")
+            continue
+        print(f"[{p['name']}] Opened {p['port']}")
+        tasks.append(asyncio.create_task(print_port(ingest, p["name"])))
     try:
-        
-        with serial.Serial(port, baudrate, timeout=1) as ser:
-            print(f"[{name}] Opened {port}")
-            while True:
-                line = ser.readline().decode(errors='ignore').strip()
-                if line:
-                    try:
-                        parts = line.split(',')
-                        # milisec,x,y,z 形式のデータをパース
-                        if len(parts) == 4:
-                            milisec, x, y, z = map(float, parts)
-                            print(f"[{name}] t={milisec:.0f} x={x:.6f} y={y:.6f} z={z:.6f}")
-                        else:
-                            print(f"[{name}] {line}")
-                    except Exception:
-                        print(f"[{name}] {line}")
-    except Exception as e:
-        print(f"[{name}] Error: {e}")
+        await asyncio.gather(*tasks)  # 通常は無限に受信し続けるのでCtrl+Cまで待機
+    finally:
+        ingest.close()
 
 if __name__ == "__main__":
     # ここで各COMポート・センサー名を指定
@@ -36,12 +47,6 @@ if __name__ == "__main__":
 
     print("複数BNO08xセンサーからの受信を開始しました。Ctrl+Cで終了します。")
     try:
-        with ThreadPoolExecutor(max_workers=len(ports)) as executor:
-            futures = [
-                executor.submit(read_serial, p["port"], p["baudrate"], p["name"])
-                for p in ports
-            ]
-            for f in futures:
-                f.result()  # 各スレッドの終了を待つ（通常は無限ループなのでCtrl+Cまで待機）
+        asyncio.run(main(ports))
     except KeyboardInterrupt:
         print("終了します。")
\ No newline at end of file
@@ -1,27 +1,28 @@
 import serial
 import threading
+import os
+import sys
+
+# 共通モジュール(analyze_common)を読み込むためのパス設定
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from analyze_common.text_parse import ChunkedReader
 
 def read_serial(port, baudrate, name):
     count = 0
     try:
         with serial.Serial(port, baudrate, timeout=1) as ser:
             print(f"[{name}] Opened {port}")
+            reader = ChunkedReader(ser, 4)
             while True:
-                line = ser.readline().decode(errors='ignore').strip()
-                if line:
-                    try:
-                        parts = line.split(',')
-                        if len(parts) == 4:
-                            timestamp, x, y, z = map(float, parts)
-                            count += 1
-                            if count % 10 == 0:  # 10行に1回だけ表示
-                                print(f"[{name}] t={timestamp:.2f} x={x:.6f} y={y:.6f} z={z:.6f}")
-                        else:
-                            if count % 10 == 0:
-                                print(f"[{name}] {line}")
-                    except Exception:
-                        if count % 10 == 0:
-                            print(f"[{name}] {line}")
+                # 受信済みの行をまとめて読み、数値行は一括パース
+                values, others = reader.read()
+                start = (9 - count) % 10  # 10行に1回だけ表示（通し番号が10の倍数の行）
+                for milisec, x, y, z in values[start::10].tolist():
+                    print(f"[{name}] t={milisec:.2f} x={x:.6f} y={y:.6f} z={z:.6f}")
+                count += len(values)
+                for line in others:
+                    if count % 10 == 0:
+                        print(f"[{name}] {line}")
     except Exception as e:
         print(f"[{name}] Error: {e}")
 
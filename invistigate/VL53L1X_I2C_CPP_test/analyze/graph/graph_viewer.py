@@ -1,47 +1,33 @@
 import os
-import pandas as pd
+import sys
 import matplotlib.pyplot as plt
-from scipy.signal import butter, filtfilt
-from numpy.fft import rfft, rfftfreq
+
+# 共通モジュール(analyze_common)を読み込むためのパス設定
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+from analyze_common.sensor_pipeline import analyze, load_sensors
+from analyze_common.spectral import recording_psd
 
 # --- ユーザー設定 ---
 CUTOFF_HZ = 0.2      # カットオフ周波数[Hz]
 ORDER = 1           # フィルタ次数
+NPERSEG = 256       # Welch の区間長[サンプル]
+RESAMPLE = True     # ms の揺らぎ・欠測を均一な格子に揃えてからフィルタ・スペクトルを計算する（欠測は NaN）
 # ---
 
-# CSVファイルを読み込み
-csv_path = os.path.join(os.path.dirname(__file__), 'log.csv')
-df = pd.read_csv(csv_path, encoding='utf-8', usecols=["sensor_id", "ms", "distance"])
-
-# ローパスフィルタ関数
-def lowpass_filter(data, cutoff, fs, order=2):
-    nyq = 0.5 * fs
-    normal_cutoff = min(cutoff / nyq, 0.99)  # 正常化カットオフは1未満
-    b, a = butter(order, normal_cutoff, btype='low', analog=False)
-    y = filtfilt(b, a, data)
-    return y
+# 記録を読み込み（log.vlrec / log.vlz / log.csv のうち最後に書かれたもの）、センサーごとの周期・フィルタ・スペクトルは1回だけ計算する
+sensors = load_sensors(os.path.dirname(__file__))
+results = analyze(sensors, CUTOFF_HZ, ORDER, resample=RESAMPLE)
 
 plt.figure(figsize=(10, 6))
 sampling_freqs = []
-for sid in df['sensor_id'].unique():
-    sdf = df[df['sensor_id'] == sid].sort_values('ms')
+for sid, r in results.items():
     # サンプリング周期・周波数計算
-    if len(sdf) > 1:
-        delta_ms = sdf['ms'].diff().dropna()
-        mean_delta = delta_ms.mean()
-        freq = 1000.0 / mean_delta if mean_delta > 0 else 0
-        sampling_freqs.append((sid, freq))
-        # ローパスフィルタ適用
-        cutoff = min(CUTOFF_HZ, freq/2)  # ユーザー指定 or ナイキスト未満
-        try:
-            filtered = lowpass_filter(sdf['distance'].astype(float), cutoff, freq, order=ORDER)
-            plt.plot(sdf['ms'], sdf['distance'], label=f'Sensor {sid} (raw)', alpha=0.4, linestyle='dotted')
-            plt.plot(sdf['ms'], filtered, label=f'Sensor {sid} (LPF, cutoff={cutoff:.1f}Hz, order={ORDER})')
-        except Exception as e:
-            plt.plot(sdf['ms'], sdf['distance'], label=f'Sensor {sid} (raw)')
+    sampling_freqs.append((sid, r.freq))
+    if r.filtered is not None:
+        plt.plot(r.ms, r.distance, label=f'Sensor {sid} (raw)', alpha=0.4, linestyle='dotted')
+        plt.plot(r.ms, r.filtered, label=f'Sensor {sid} (LPF, cutoff={r.cutoff:.1f}Hz, order={ORDER})')
     else:
-        sampling_freqs.append((sid, 0))
-        plt.plot(sdf['ms'], sdf['distance'], label=f'Sensor {sid} (raw)')
+        plt.plot(r.ms, r.distance, label=f'Sensor {sid} (raw)')
 
 plt.xlabel('ms')
 plt.ylabel('Distance [mm]')
@@ -52,32 +38,21 @@ plt.grid(True)
 plt.tight_layout()
 plt.show()
 
-# --- 追加: フィルタ前後の周波数特性（パワースペクトル）を表示 ---
+# --- 追加: フィルタ前後の周波数特性（Welch のパワースペクトル密度）を表示 ---
+# 全センサーのフィルタ前後をまとめて計算し、結果は log.psd.npz にキャッシュする
+psd = recording_psd(os.path.dirname(__file__), NPERSEG, cutoff=CUTOFF_HZ, order=ORDER, resample=RESAMPLE,
+                    results=results)
 plt.figure(figsize=(10, 6))
-for sid in df['sensor_id'].unique():
-    sdf = df[df['sensor_id'] == sid].sort_values('ms')
-    if len(sdf) > 1:
-        delta_ms = sdf['ms'].diff().dropna()
-        mean_delta = delta_ms.mean()
-        freq = 1000.0 / mean_delta if mean_delta > 0 else 0
-        if freq > 0:
-            # フィルタ前
-            raw = sdf['distance'].astype(float).values
-            N = len(raw)
-            yf_raw = abs(rfft(raw - raw.mean()))
-            xf = rfftfreq(N, d=mean_delta/1000.0)
-            # フィルタ後
-            cutoff = min(CUTOFF_HZ, freq/2)
-            try:
-                filtered = lowpass_filter(raw, cutoff, freq, order=ORDER)
-                yf_filt = abs(rfft(filtered - filtered.mean()))
-                plt.plot(xf, yf_raw, label=f'S{sid} Raw', alpha=0.4, linestyle='dotted')
-                plt.plot(xf, yf_filt, label=f'S{sid} LPF', alpha=0.8)
-            except Exception as e:
-                plt.plot(xf, yf_raw, label=f'S{sid} Raw', alpha=0.4, linestyle='dotted')
+for sid in results:
+    if ('raw', sid) in psd:
+        f, p = psd[('raw', sid)]
+        plt.semilogy(f, p, label=f'S{sid} Raw', alpha=0.4, linestyle='dotted')
+    if ('lpf', sid) in psd:
+        f, p = psd[('lpf', sid)]
+        plt.semilogy(f, p, label=f'S{sid} LPF', alpha=0.8)
 plt.xlabel('Frequency [Hz]')
-plt.ylabel('Amplitude (FFT)')
-plt.title('Frequency Spectrum (Raw vs Lowpass)')
+plt.ylabel('PSD [mm^2/Hz]')
+plt.title(f'Power Spectral Density (Raw vs Lowpass, Welch nperseg={NPERSEG})')
 plt.legend()
 plt.grid(True)
 plt.tight_layout()
@@ -0,0 +1,35 @@
+import os
+import sys
+import matplotlib.pyplot as plt
+
+# 共通モジュール(analyze_common)を読み込むためのパス設定
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+from analyze_common.lod import LodPlot, open_lod, recording_for_lod
+
+# --- ユーザー設定 ---
+MAX_POINTS = 4000   # 1センサーあたりの描画点数の目安（ズームに応じてピラミッドのレベルを選ぶ）
+# ---
+
+# 長時間の記録を min/max の帯と平均の線で表示する（ズーム・パンで細かいレベルを読み直す）
+# log.vlrec / log.vlz / log.csv のうち最後に書かれた記録を使う（csv / vlz は .vlrec に変換して開く）
+base_dir = os.path.dirname(__file__)
+lod = open_lod(recording_for_lod(base_dir))
+
+fig, ax = plt.subplots(figsize=(10, 6))
+view = LodPlot(ax, lod, MAX_POINTS)
+ax.set_xlabel('ms')
+ax.set_ylabel('Distance [mm]')
+ax.set_title('Distance by Sensor (min/max band & mean)')
+ax.legend()
+ax.grid(True)
+
+
+def show_level(ax):
+    # 表示中のレベルと描き直しにかかった時間をタイトルに出す（LodPlot の描き直しの後に呼ばれる）
+    levels = ', '.join(f'S{sid}: {"raw" if lv < 0 else f"L{lv}"}' for sid, lv in view.levels.items())
+    ax.set_title(f'Distance by Sensor (min/max band & mean)\n{levels} ({view.elapsed * 1000:.1f} ms)')
+
+
+ax.callbacks.connect('xlim_changed', show_level)
+plt.tight_layout()
+plt.show()
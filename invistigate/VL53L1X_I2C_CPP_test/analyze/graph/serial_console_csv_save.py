@@ -1,13 +1,38 @@
 import serial
 import time
-import csv
 import os
 from rich.live import Live
 from rich.table import Table
 from rich.console import Console
+import sys
+
+# 共通モジュール(analyze_common)を読み込むためのパス設定
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+from analyze_common.vl53_binary import make_sample_reader
+from analyze_common.csv_logger import CsvLogger
+from analyze_common.recording import RecordingWriter
+from analyze_common.session_log import SessionLogger
+from analyze_common.varint_codec import VlzWriter
 
 PORT = 'COM6'
 BAUD = 115200
+LINK_MODE = 'text'  # 受信形式: 'text' (id,ms,dist) / 'binary' (WIP_main_bin.cpp_ の7バイトレコード)
+RECORD_FORMAT = 'csv'  # 保存形式: 'csv' (log.csv) / 'vlrec' (log.vlrec, graph_viewer が memmap で開く)
+                       #          / 'session' (session/ に1時間か256MBごとに分割した CSV と index.csv)
+                       #          / 'vlz' (log.vlz, 差分+varint+zlib で CSV の数十分の1のサイズ)
+
+
+def open_logger():
+    """RECORD_FORMAT に応じたロガーを開く（いずれも (time.time(), sensor_id, ms, distance) の行を受け取る）"""
+    base_dir = os.path.dirname(__file__)
+    if RECORD_FORMAT == 'vlrec':
+        return RecordingWriter(os.path.join(base_dir, "log.vlrec"))
+    if RECORD_FORMAT == 'session':
+        return SessionLogger(os.path.join(base_dir, "session"), ["timestamp", "sensor_id", "ms", "distance"])
+    if RECORD_FORMAT == 'vlz':
+        return VlzWriter(os.path.join(base_dir, "log.vlz"))
+    # CSV は別スレッドでまとめて書き込む（1秒ごとに flush）
+    return CsvLogger(os.path.join(base_dir, "log.csv"), ["timestamp", "sensor_id", "ms", "distance"])
 
 
 def main():
@@ -28,49 +53,36 @@ def main():
         time.sleep(4)
 
     # --- データ受信 ---
-    with serial.Serial(PORT, BAUD, timeout=0.1) as ser, \
-         open(os.path.join(os.path.dirname(__file__), "log.csv"), "w", newline="", encoding="utf-8") as csvfile:
+    with serial.Serial(PORT, BAUD, timeout=0.1) as ser, open_logger() as logger:
         ser.reset_input_buffer()
         ser.reset_output_buffer()
+        read_samples = make_sample_reader(ser, LINK_MODE)
         console.print("[cyan]シリアルポートからのデータ受信開始...（Ctrl+Cで終了）[/cyan]")
-        writer = csv.writer(csvfile)
-        writer.writerow(["timestamp", "sensor_id", "ms", "distance"])
         def make_table():
             table = Table(title="センサーデータ", show_lines=True)
             table.add_column("Sensor ID", justify="center")
             table.add_column("ms", justify="right")
             table.add_column("Distance", justify="right")
-            for sid, (ms, dist) in sensor_data.items():
-                table.add_row(sid, ms, dist)
+            for sid, sample in sensor_data.items():
+                dist = '[red]TIMEOUT[/red]' if sample.timeout else f"{sample.dist:.0f}"
+                table.add_row(sid, str(sample.ms), dist)
             return table
-        sensor_data = {}
+        sensor_data = {}  # センサーIDごとの最新の RangeSample
         try:
             start_time = time.time()  # 追加: 開始時刻を記録
             with Live(make_table(), refresh_per_second=20, console=console) as live:
                 while True:
                     if time.time() - start_time > 10:  # 追加: 10秒経過で終了
                         break
-                    line = ser.readline().decode().strip()
+                    samples = read_samples()
                     now = time.time()
-                    updated = False
-                    if line:
-                        parts = line.split(',')
-                        if len(parts) != 3:
-                            continue
-                        sensor_id, ms, dist = parts
-                        if dist == 'NULL':
-                            dist_disp = '[red]TIMEOUT[/red]'
-                        else:
-                            dist_disp = dist
-                        sensor_data[sensor_id] = (ms, dist_disp)
-                        # CSVに保存（そのまま）
-                        writer.writerow([
-                            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now)),
-                            sensor_id, ms, dist
-                        ])
-                        csvfile.flush()
-                        updated = True
-                    if updated:
+                    for sample in samples:
+                        sensor_data[sample.sensor_id] = sample
+                    # 保存（タイムアウトは従来どおり NULL、CSV の時刻の文字列化は書き込みスレッド側）
+                    logger.writerows([
+                        (now, s.sensor_id, s.ms, 'NULL' if s.timeout else f"{s.dist:.0f}") for s in samples
+                    ])
+                    if samples:
                         live.update(make_table())
         except KeyboardInterrupt:
             console.print("[yellow]終了します[/yellow]")
@@ -1,9 +1,19 @@
 import serial
 import time
 import math
-from rich.live import Live
-from rich.table import Table
 from rich.console import Console
+import os
+import sys
+import threading
+import numpy as np
+
+# 共通モジュール(analyze_common)を読み込むためのパス設定
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from analyze_common.vl53_binary import make_sample_reader
+from analyze_common.live_render import LiveView, start_reader
+from analyze_common.rolling_stats import RollingStats
+from analyze_common.stream_align import StreamAligner
+from analyze_common.angle import pair_angles, sensor_order
 
 # --- 設定ここから ---
 PORT = 'COM6'  # シリアルポート名
@@ -13,8 +23,82 @@ SENSOR_CMD_TIMING = 20000  # 測定タイミングバジェット[us]（例: 330
 SENSOR_CMD_INTERVAL = 20  # 連続測定間隔[ms]（例: 5, 33, 100 など）
 SAMPLE_FREQ = int(1000 / SENSOR_CMD_INTERVAL)  # サンプリング周波数(Hz)（自動計算）
 BASE_MM = 150  # センサー間の基準距離（mm）
+NUM_SENSORS = 2  # センサーの数（main.cpp の NUM_SENSORS。ID 0..NUM_SENSORS-1 の全員が届いてから揃え始める）
+RENDER_FPS = 20  # 表示の更新頻度（受信とは別スレッドで、変わった行だけ描き直す）
+STATS_WINDOW_MS = 1000  # 平均・標準偏差・P-P（ノイズ）を出す窓の長さ[ms]
+ANGLE_AVERAGE_SAMPLES = 5  # 角度に使う移動平均のサンプル数（1 なら生データ）
+MAX_WAIT_MS = SENSOR_CMD_INTERVAL * 3  # 全センサーの値がそろうのを待つ上限[ms]（デバイスの ms）
+MAX_GAP_MS = SENSOR_CMD_INTERVAL * 3  # ms の間隔がこれより開いたら欠測として補間しない
 # --- 設定ここまで ---
 
+COLUMNS = [("Sensor ID", "center"), ("ms", "right"), ("Distance", "right"), ("Mean", "right"), ("Std", "right"),
+           ("P-P", "right"), ("Rate(Hz)", "right"), ("Angle(deg)", "right"), ("Skew(ms)", "right")]
+
+
+def format_row(sid, sample, rate, angle, stats, skew):
+    dist = '[red]TIMEOUT[/red]' if sample.timeout else f"{sample.dist:.0f}"
+    count, mean, std, lo, hi = stats
+    if count:
+        mean, std, pp = f"{mean:.1f}", f"{std:.2f}", f"{hi - lo:.0f}"
+    else:
+        mean = std = pp = "-"
+    skew = "-" if math.isnan(skew) else f"{skew:.0f}"
+    return sid, str(sample.ms), dist, mean, std, pp, str(rate), str(angle), skew
+
+
+def ingest(read_samples, view, stop):
+    """受信スレッド: サンプルを読み、履歴・角度を更新して、変わった行を view に渡す"""
+    sensor_data = {}  # センサーIDごとの最新の RangeSample
+    noise = {}  # センサーIDごとの直近 STATS_WINDOW_MS の統計（履歴を読み直さずに更新）
+    averages = {}  # センサーIDごとの直近 ANGLE_AVERAGE_SAMPLES 個の移動平均（共通の時刻に揃えた値）
+    # 全センサーを SENSOR_CMD_INTERVAL の格子の同じ時刻に補間して揃える（待ちは MAX_WAIT_MS まで）
+    aligner = StreamAligner(SENSOR_CMD_INTERVAL, MAX_WAIT_MS, MAX_GAP_MS, keys=[str(i) for i in range(NUM_SENSORS)])
+    skew = math.nan  # 最後に揃えた時刻の、補間に使った各センサーのサンプルの ms の開き
+    freq_dict = {}
+    count_dict = {}
+    last_time = time.time()
+    angle_dict = {}
+    while not stop.is_set():
+        samples = read_samples()
+        now = time.time()
+        updated = set()
+        for sample in samples:
+            sensor_id = sample.sensor_id
+            dist_val = sample.dist
+            sensor_data[sensor_id] = sample
+            if sensor_id not in noise:
+                noise[sensor_id] = RollingStats(STATS_WINDOW_MS // SENSOR_CMD_INTERVAL * 2, STATS_WINDOW_MS)
+            noise[sensor_id].push(sample.ms, dist_val)
+            aligner.push(sensor_id, sample.ms, dist_val)
+            count_dict[sensor_id] = count_dict.get(sensor_id, 0) + 1
+            updated.add(sensor_id)
+        # 揃った時刻ごとに移動平均を更新し、隣り合うセンサーの角度を計算（センサーの数は問わない）
+        grid, aligned, grid_skew = aligner.poll()
+        if len(grid):
+            for i, t in enumerate(grid.tolist()):
+                for sid, values in aligned.items():
+                    if sid not in averages:
+                        # 時間でも区切り、タイムアウトが続いたセンサーの古い値は使わない
+                        averages[sid] = RollingStats(ANGLE_AVERAGE_SAMPLES, ANGLE_AVERAGE_SAMPLES * SENSOR_CMD_INTERVAL)
+                    averages[sid].push(t, values[i])
+            ids = sorted(aligned, key=sensor_order)  # ID は数値順 ("2" < "10")
+            angles = pair_angles({sid: averages[sid].mean for sid in ids}, BASE_MM)  # 値のないセンサーの組は NaN
+            angle_dict.update({sid: "-" if math.isnan(angle) else round(angle, 2) for sid, angle in angles.items()})
+            observed = grid_skew[~np.isnan(grid_skew)]
+            if len(observed):
+                skew = float(observed[-1])
+            updated.update(sid for sid in ids if sid in sensor_data)  # まだ届いていないセンサーの行は出さない
+        # 周波数更新は1秒ごと
+        if now - last_time >= 1.0:
+            for sid in count_dict:
+                freq_dict[sid] = count_dict[sid]
+            count_dict = {}
+            last_time = now
+            updated.update(sensor_data)
+        for sid in updated:
+            view.mark(sid, sensor_data[sid], freq_dict.get(sid, 0), angle_dict.get(sid, "-"), noise[sid].summary(), skew)
+
+
 def main():
     console = Console()
     # --- センサ設定コマンド送信 ---
@@ -37,75 +121,19 @@ def main():
     with serial.Serial(PORT, BAUD, timeout=0.1) as ser:
         ser.reset_input_buffer()
         ser.reset_output_buffer()
+        read_samples = make_sample_reader(ser)  # 受信済みの行をまとめて読み一括パース
         console.print("[cyan]シリアルポートからのデータ受信開始...（Ctrl+Cで終了）[/cyan]")
-        sensor_data = {}
-        freq_dict = {}
-        count_dict = {}
-        last_time = time.time()
-        angle_dict = {}
-        def make_table():
-            table = Table(title="センサーデータ", show_lines=True)
-            table.add_column("Sensor ID", justify="center")
-            table.add_column("ms", justify="right")
-            table.add_column("Distance", justify="right")
-            table.add_column("Rate(Hz)", justify="right")
-            table.add_column("Angle(deg)", justify="right")
-            for sid, (ms, dist) in sensor_data.items():
-                rate = freq_dict.get(sid, 0)
-                angle = angle_dict.get(sid, "-")
-                table.add_row(sid, ms, dist, str(rate), str(angle))
-            return table
+        view = LiveView(COLUMNS, format_row, title="センサーデータ", show_lines=True, order=sensor_order)
+        stop = threading.Event()
+        reader = start_reader(ingest, read_samples, view, stop, stop=stop)
         try:
-            with Live(make_table(), refresh_per_second=20, console=console) as live:
-                while True:
-                    line = ser.readline().decode().strip()
-                    now = time.time()
-                    updated = False
-                    if line:
-                        parts = line.split(',')
-                        if len(parts) != 3:
-                            continue
-                        sensor_id, ms, dist = parts
-                        if dist == 'NULL':
-                            dist_disp = '[red]TIMEOUT[/red]'
-                            dist_val = None
-                        else:
-                            dist_disp = dist
-                            try:
-                                dist_val = float(dist)
-                            except ValueError:
-                                dist_val = None
-                        sensor_data[sensor_id] = (ms, dist_disp)
-                        count_dict[sensor_id] = count_dict.get(sensor_id, 0) + 1
-                        # 差分と角度計算（センサーが2つの場合を想定、生データで計算）
-                        if dist_val is not None:
-                            if len(sensor_data) == 2:
-                                ids = sorted(sensor_data.keys())
-                                try:
-                                    d1 = float(sensor_data[ids[0]][1])
-                                    d2 = float(sensor_data[ids[1]][1])
-                                    diff = d1 - d2
-                                    angle_rad = math.atan(diff / BASE_MM)
-                                    angle_deg = round(math.degrees(angle_rad), 2)
-                                    angle_dict[ids[0]] = angle_deg
-                                    angle_dict[ids[1]] = -angle_deg
-                                except Exception:
-                                    angle_dict[ids[0]] = "-"
-                                    angle_dict[ids[1]] = "-"
-                            else:
-                                angle_dict[sensor_id] = "-"
-                        updated = True
-                    # 周波数更新は1秒ごと
-                    if now - last_time >= 1.0:
-                        for sid in count_dict:
-                            freq_dict[sid] = count_dict[sid]
-                        count_dict = {}
-                        last_time = now
-                        updated = True
-                    if updated:
-                        live.update(make_table())
+            view.run(stop, RENDER_FPS, console)
         except KeyboardInterrupt:
             console.print("[yellow]終了します[/yellow]")
+        stop.set()
+        reader.join()
+        if reader.error is not None:
+            console.print(f"[red]受信エラー: {reader.error}[/red]")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,5 @@
+# analyze 系スクリプトで共有するホスト側モジュール
+#
+# 各スクリプトからは以下のようにパスを通して読み込む:
+#   sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+#   from analyze_common.crc16 import crc16_ccitt
@@ -0,0 +1,219 @@
+"""記録からの傾き角のまとめ計算 (2つの VL53L1X を ms で揃えてから atan((d1 - d2) / BASE_MM))
+
+TUI はどちらかのセンサーが届くたびに、その時点の両センサーの最新のローパス値で角度を出す。
+2つの値は数十ms ずれていることがあり、記録から同じ計算をするにも1行ずつのループが要る。
+ここでは記録全体を NumPy でまとめて計算する。揃え方は2通り:
+
+    'interp'  両センサーを resample の共通の均一格子に線形補間し、zero-phase の butter
+              (sensor_pipeline と同じ) をかけてから格子点ごとに角度を出す。ずれ (skew) は 0
+    'asof'    TUI と同じ。ms 順に並べた各受信時点で、それぞれのセンサーの最新の値
+              (TUI と同じ1次ローパス) を使う。skew はその2つの値の ms の差
+
+    python -m analyze_common.angle export VL53L1X_I2C_CPP_test/analyze/graph angle.csv --fc 1
+    python -m analyze_common.angle bench --rows 1000000
+"""
+import math
+
+import numpy as np
+from scipy.signal import lfilter
+
+BASE_MM = 150  # センサー間の基準距離 [mm]
+
+
+def lowpass_alpha(fc, ts):
+    """TUI の1次ローパスの係数 (fc [Hz]、ts: サンプル周期 [s])"""
+    return ts / (ts + 1 / (2 * math.pi * fc))
+
+
+def iir_lowpass(values, alpha):
+    """TUI と同じ1次ローパス y = alpha * x + (1 - alpha) * y_prev を系列全体に
+
+    初期値は最初の有効な値。NaN (タイムアウト) の点ではフィルタを進めず直前の出力を保つ
+    (最初の有効な値より前は NaN)。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(len(values), np.nan)
+    valid = np.flatnonzero(~np.isnan(values))
+    if not len(valid):
+        return out
+    x = values[valid]
+    out[valid] = lfilter([alpha], [1, alpha - 1], x, zi=[(1 - alpha) * x[0]])[0]
+    hold = np.where(np.isnan(out), -1, np.arange(len(out)))
+    np.maximum.accumulate(hold, out=hold)
+    return np.where(hold >= 0, out[np.maximum(hold, 0)], np.nan)
+
+
+def sensor_order(sid):
+    """センサーIDの並べ順のキー。数字の ID は数値順 ('2' < '10')、それ以外はその後に文字列順"""
+    sid = str(sid)
+    return (0, int(sid), '') if sid.isdecimal() else (1, 0, sid)
+
+
+def _two_sensors(sensors, ids):
+    if ids is None:
+        ids = sorted(sensors, key=sensor_order)[:2]  # TUI と同じく ID の小さい2つ
+    if len(ids) != 2 or any(sid not in sensors for sid in ids):
+        raise ValueError(f"need two sensors, got {sorted(sensors, key=sensor_order)}")
+    return ids
+
+
+def pair_angles(dists, base_mm=BASE_MM):
+    """センサーID → 距離 の dict から、ID 順 (sensor_order) で隣り合うセンサーの角度 [deg] を センサーID → 角度 で返す
+
+    各センサーは次のセンサーとの角度、最後のセンサーは前のセンサーとの角度の符号を反転したもの
+    (2つなら TUI と同じく atan((d1 - d2) / base_mm) と、その符号反転)。距離が NaN の組は NaN。
+    """
+    ids = sorted(dists, key=sensor_order)
+    angles = {}
+    for a, b in zip(ids, ids[1:]):
+        angles[a] = math.degrees(math.atan((dists[a] - dists[b]) / base_mm))
+    if len(ids) >= 2:
+        angles[ids[-1]] = -angles[ids[-2]]
+    return angles
+
+
+def angles_interp(sensors, base_mm=BASE_MM, cutoff=None, order=1, period=None, ids=None):
+    """共通の格子に揃えた角度 [deg]。(格子の ms, 角度, skew=0) を返す (欠測の格子点は NaN)"""
+    from analyze_common.resample import resample_sensors
+    from analyze_common.sensor_pipeline import lowpass_filter_gaps
+
+    a, b = _two_sensors(sensors, ids)
+    grid, values = resample_sensors({a: sensors[a], b: sensors[b]}, period)
+    d1, d2 = values[a], values[b]
+    if cutoff is not None and len(grid) > 1:
+        fs = 1000.0 / (grid[1] - grid[0])
+        fc = min(cutoff, fs / 2)
+        d1 = lowpass_filter_gaps(d1, fc, fs, order)
+        d2 = lowpass_filter_gaps(d2, fc, fs, order)
+    return grid, np.degrees(np.arctan((d1 - d2) / base_mm)), np.zeros(len(grid))
+
+
+def angles_asof(sensors, base_mm=BASE_MM, fc=None, ts=None, ids=None):
+    """TUI と同じ計算の角度 [deg]。(受信時点の ms, 角度, skew [ms]) を返す
+
+    fc を渡すと TUI と同じ1次ローパス (周期 ts [s]、省略時は ms の間隔の中央値) をかける。
+    受信した値がタイムアウトの時点と、まだ両方の値がそろっていない時点は返さない。
+    """
+    a, b = _two_sensors(sensors, ids)
+    ms_a, d_a = (np.asarray(v) for v in sensors[a])
+    ms_b, d_b = (np.asarray(v) for v in sensors[b])
+    if fc is not None:
+        if ts is None:
+            from analyze_common.resample import estimate_period
+
+            ts = estimate_period(ms_a) / 1000.0
+        alpha = lowpass_alpha(fc, ts)
+        lp_a, lp_b = iir_lowpass(d_a, alpha), iir_lowpass(d_b, alpha)
+    else:
+        lp_a, lp_b = iir_lowpass(d_a, 1.0), iir_lowpass(d_b, 1.0)  # 最新の有効な値
+    # 2センサーの受信を ms 順 (同じ ms は a が先) に並べ、各時点でのそれぞれの最新の行を引く
+    ms = np.concatenate((ms_a, ms_b))
+    src = np.concatenate((np.zeros(len(ms_a), dtype=np.int8), np.ones(len(ms_b), dtype=np.int8)))
+    row = np.concatenate((np.arange(len(ms_a)), np.arange(len(ms_b))))
+    reported = ~np.isnan(np.concatenate((np.asarray(d_a, dtype=float), np.asarray(d_b, dtype=float))))
+    order = np.lexsort((src, ms))
+    ms, src, row, reported = ms[order], src[order], row[order], reported[order]
+    last_a = np.maximum.accumulate(np.where(src == 0, row, -1))
+    last_b = np.maximum.accumulate(np.where(src == 1, row, -1))
+    ok = (last_a >= 0) & (last_b >= 0)
+    va = np.where(ok, lp_a[np.maximum(last_a, 0)], np.nan)
+    vb = np.where(ok, lp_b[np.maximum(last_b, 0)], np.nan)
+    keep = ok & reported & ~np.isnan(va) & ~np.isnan(vb)
+    skew = np.abs(ms_a[np.maximum(last_a, 0)] - ms_b[np.maximum(last_b, 0)])
+    return ms[keep], np.degrees(np.arctan((va - vb)[keep] / base_mm)), skew[keep]
+
+
+def reconstruct_angles(sensors, method='interp', base_mm=BASE_MM, fc=None, order=1, ids=None):
+    """method ('interp' / 'asof') で角度を計算し、(ms, 角度 [deg], skew [ms]) を返す"""
+    if method == 'interp':
+        return angles_interp(sensors, base_mm, fc, order, ids=ids)
+    if method == 'asof':
+        return angles_asof(sensors, base_mm, fc, ids=ids)
+    raise ValueError(f"unknown method: {method}")
+
+
+def export_angles(path, ms, angle, skew):
+    """角度の系列を CSV (ms,angle_deg,skew_ms) に書く。NaN は NULL"""
+    import pandas as pd
+
+    pd.DataFrame({'ms': ms, 'angle_deg': angle, 'skew_ms': skew}).to_csv(
+        path, index=False, na_rep='NULL', float_format='%.4f')
+
+
+def replay_tui(rows, base_mm=BASE_MM, alpha=1.0):
+    """比較用: TUI の ingest (受信したサンプルごとの1次ローパスと角度) と同じ計算を1行ずつ行う
+
+    rows は (sensor_id, ms, dist or None) の受信順。alpha=1 ならローパスなし (serial_console_TUI_angle)。
+    """
+    latest = {}
+    lp = {}
+    out_ms, out_angle, out_skew = [], [], []
+    for sid, ms, dist in rows:
+        latest[sid] = ms
+        if dist is None:
+            continue
+        lp[sid] = alpha * dist + (1 - alpha) * lp.get(sid, dist)
+        if len(latest) == 2 and len(lp) == 2:
+            ids = sorted(lp, key=sensor_order)
+            out_ms.append(ms)
+            out_angle.append(math.degrees(math.atan((lp[ids[0]] - lp[ids[1]]) / base_mm)))
+            out_skew.append(abs(latest[ids[0]] - latest[ids[1]]))
+    return np.array(out_ms), np.array(out_angle), np.array(out_skew)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="記録から傾き角をまとめて計算する")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_exp = sub.add_parser('export', help="記録 (log.vlrec / log.vlz / log.csv のあるディレクトリ) の角度を CSV に書く")
+    p_exp.add_argument('base_dir')
+    p_exp.add_argument('out')
+    p_exp.add_argument('--method', choices=['interp', 'asof'], default='interp')
+    p_exp.add_argument('--fc', type=float, help="ローパスのカットオフ周波数 [Hz] (省略時はフィルタなし)")
+    p_exp.add_argument('--order', type=int, default=1, help="interp の butter の次数")
+    p_exp.add_argument('--base-mm', type=float, default=BASE_MM)
+    p_bench = sub.add_parser('bench', help="TUI の計算を1行ずつ再生した場合と比べる")
+    p_bench.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == 'export':
+        from analyze_common.sensor_pipeline import load_sensors
+
+        ms, angle, skew = reconstruct_angles(load_sensors(args.base_dir), args.method, args.base_mm,
+                                             args.fc, args.order)
+        export_angles(args.out, ms, angle, skew)
+        print(f"{args.out}: {len(ms)} rows in {time.perf_counter() - start:.2f} s, "
+              f"skew median {np.median(skew):.1f} ms / max {np.max(skew, initial=0):.0f} ms")
+    else:
+        rng = np.random.default_rng(0)
+        n = args.rows // 2
+        t = np.arange(n) * 20.0
+        sensors = {}
+        rows = []
+        for k, sid in enumerate('01'):
+            ms = (t + 7 * k + rng.integers(-2, 3, n)).astype(np.int64)  # センサー1は7ms遅れて届く
+            dist = 480 + 20 * k + 30 * np.sin(ms / 3000) + rng.normal(0, 2, n)
+            dist[rng.random(n) < 0.01] = np.nan
+            sensors[sid] = (ms, dist)
+            rows += [(sid, m, None if math.isnan(d) else d) for m, d in zip(ms.tolist(), dist.tolist())]
+        rows.sort(key=lambda r: (r[1], r[0]))  # 受信順 = ms 順
+        alpha = lowpass_alpha(1.0, 0.02)
+
+        start = time.perf_counter()
+        ref = replay_tui(rows, alpha=alpha)
+        loop = time.perf_counter() - start
+        start = time.perf_counter()
+        got = angles_asof(sensors, fc=1.0, ts=0.02)
+        vec = time.perf_counter() - start
+        assert all(np.allclose(x, y) for x, y in zip(ref, got))
+        start = time.perf_counter()
+        grid, angle, _ = angles_interp(sensors, cutoff=1.0)
+        interp = time.perf_counter() - start
+        print(f"{args.rows} rows, 2 sensors")
+        print(f"TUI logic row by row : {loop:.2f} s")
+        print(f"asof (vectorized)    : {vec:.3f} s, {loop / vec:.0f}x faster, same angles; "
+              f"skew median {np.median(got[2]):.0f} ms, max {got[2].max():.0f} ms")
+        print(f"interp (common grid) : {interp:.3f} s, {len(grid)} grid points, skew 0 ms")
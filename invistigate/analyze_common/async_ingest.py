@@ -0,0 +1,274 @@
+"""asyncio による複数シリアルポートの一括受信
+
+ポートごとにスレッドを立てて readline() する代わりに、1つのイベントループで
+全ポートのファイルディスクリプタを監視し (loop.add_reader)、届いた分を
+まとめて行に分割・パースする。結果はポートごとの非同期ストリームとして
+`async for batch in ingest.stream(name)` で受け取れる。
+サンプルは batching.BlockBatcher でブロックにまとめてから渡すため、
+少量ずつ届く場合でもキュー操作はブロック単位 (サイズまたは時間で flush) になる。
+
+add_reader が使えない環境 (Windows の COM ポートなど) では、
+1つのタスクで全ポートを in_waiting でポーリングする。
+
+消費側が追いつかずにポートのキューが maxsize バッチまでたまったら、そのポートの読み出しを止め
+(add_reader を外す / ポーリングを飛ばす)、半分まで減ったら再開する。バッチは捨てず、
+止めている間のデータは OS のバッファに残る。
+"""
+import asyncio
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from analyze_common.batching import BLOCK_ROWS, MAX_LATENCY, BlockBatcher
+from analyze_common.text_parse import LineParser
+
+# name: ポート名, values: (n, 4) の milisec,x,y,z, raw: 数値4列でなかった行
+Batch = namedtuple('Batch', 'name values raw')
+
+READ_SIZE = 65536
+POLL_INTERVAL = 0.002  # ポーリング時の待ち時間[s]
+
+
+class PortStream:
+    """1ポート分の受信状態 (行の端数はパーサーが保持) と、パース済みバッチのキュー"""
+
+    def __init__(self, name, maxsize=1024, block_rows=BLOCK_ROWS, max_latency=MAX_LATENCY):
+        self.name = name
+        # 1回の feed で複数のバッチが出ることがあるのでキュー自体は無制限にし、
+        # maxsize は読み出しを止める目安にする
+        self.queue = asyncio.Queue()
+        self.maxsize = maxsize
+        self.batcher = BlockBatcher(4, self._emit, block_rows, max_latency)
+        self.parser = LineParser(4)
+        self.raw = []
+        self.samples = 0
+        self.paused = False
+        self.pauses = 0  # キューがたまって読み出しを止めた回数
+        self.error = None
+        self.closed = False
+
+    def feed(self, data):
+        """受信したバイト列を行に分割し、まとめてパースしてバッチャーに渡す"""
+        values, raw = self.parser.feed(data)
+        self.samples += len(values)
+        self.raw.extend(raw)
+        self.batcher.extend(values)
+        if self.raw and not len(self.batcher):
+            self._emit(values[:0])
+
+    def _emit(self, values):
+        raw, self.raw = self.raw, []
+        self.put(Batch(self.name, values, raw))
+
+    def flush(self):
+        self.batcher.flush()
+        if self.raw:
+            self._emit(np.empty((0, 4)))
+
+    def put(self, batch):
+        self.queue.put_nowait(batch)
+
+    def backlogged(self):
+        """キューが maxsize バッチまでたまったか (読み出しを止める)"""
+        return self.queue.qsize() >= self.maxsize
+
+    def drained(self):
+        """止めた読み出しを再開してよいか (キューが半分まで減った)"""
+        return self.queue.qsize() <= self.maxsize // 2
+
+    def close(self, error=None):
+        if not self.closed:
+            self.closed = True
+            if error is not None:
+                self.error = str(error)
+            self.flush()
+            self.put(None)  # ストリーム終端
+
+
+class AsyncIngest:
+    """複数ポートを1つのイベントループで受信する"""
+
+    def __init__(self, maxsize=1024, block_rows=BLOCK_ROWS, max_latency=MAX_LATENCY):
+        self.maxsize = maxsize
+        self.block_rows = block_rows
+        self.max_latency = max_latency
+        self.streams = {}
+        self._fds = {}
+        self._polled = {}
+        self._serials = []
+        self._poll_task = None
+        self._flush_task = None
+
+    def _new_stream(self, name):
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_due())
+        return PortStream(name, self.maxsize, self.block_rows, self.max_latency)
+
+    async def _flush_due(self):
+        """データが途切れても max_latency 以内にブロックを渡す"""
+        while True:
+            await asyncio.sleep(self.max_latency / 2)
+            for stream in self.streams.values():
+                if stream.batcher.due():
+                    stream.batcher.flush()
+
+    def add_fd(self, name, fd):
+        """非ブロッキングのファイルディスクリプタ (tty, pipe など) を登録する"""
+        os.set_blocking(fd, False)
+        stream = self._new_stream(name)
+        asyncio.get_running_loop().add_reader(fd, self._on_readable, stream, fd)
+        self.streams[name] = stream
+        self._fds[name] = fd
+        return stream
+
+    def add_serial(self, name, port, baudrate=115200):
+        """シリアルポートを開いて登録する (add_reader が使えなければポーリング)"""
+        import serial
+
+        ser = serial.Serial(port, baudrate, timeout=0)
+        self._serials.append(ser)
+        # Windows の COM ポートは fileno() が io.UnsupportedOperation (OSError / ValueError) になり、
+        # Proactor ループは add_reader 非対応なので、最初からポーリングにする
+        if os.name != 'nt':
+            try:
+                return self.add_fd(name, ser.fileno())
+            except (AttributeError, NotImplementedError, OSError, ValueError):
+                pass
+        stream = self.streams[name] = self._new_stream(name)
+        self._polled[name] = ser
+        if self._poll_task is None:
+            self._poll_task = asyncio.get_running_loop().create_task(self._poll())
+        return stream
+
+    def _on_readable(self, stream, fd):
+        try:
+            data = os.read(fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._remove_fd(stream.name)
+            stream.close(e)
+            return
+        if not data:
+            self._remove_fd(stream.name)
+            stream.close()
+            return
+        stream.feed(data)
+        if stream.backlogged():
+            self._pause(stream)
+
+    def _pause(self, stream):
+        stream.paused = True
+        stream.pauses += 1
+        fd = self._fds.get(stream.name)
+        if fd is not None:
+            asyncio.get_running_loop().remove_reader(fd)
+
+    def _resume(self, stream):
+        stream.paused = False
+        fd = self._fds.get(stream.name)
+        if fd is not None:
+            asyncio.get_running_loop().add_reader(fd, self._on_readable, stream, fd)
+
+    def _remove_fd(self, name):
+        fd = self._fds.pop(name, None)
+        if fd is not None and not self.streams[name].paused:
+            asyncio.get_running_loop().remove_reader(fd)
+
+    async def _poll(self):
+        while True:
+            for name, ser in list(self._polled.items()):
+                stream = self.streams[name]
+                if stream.paused:
+                    continue
+                try:
+                    n = ser.in_waiting
+                    if n:
+                        stream.feed(ser.read(n))
+                except Exception as e:
+                    del self._polled[name]
+                    stream.close(e)
+                    continue
+                if stream.backlogged():
+                    self._pause(stream)
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def stream(self, name):
+        """ポート name のバッチを順に返す非同期イテレータ
+
+        ポートが閉じられると終了する。エラーで閉じた場合は streams[name].error に理由が入る。
+        """
+        stream = self.streams[name]
+        while True:
+            batch = await stream.queue.get()
+            if batch is None:
+                return
+            if stream.paused and not stream.closed and stream.drained():
+                self._resume(stream)
+            yield batch
+
+    def close(self):
+        for name in list(self._fds):
+            self._remove_fd(name)
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        for ser in self._serials:
+            ser.close()
+        for stream in self.streams.values():
+            stream.close()
+
+
+if __name__ == "__main__":
+    # ベンチマーク: os.pipe() を疑似ポートとし、1〜32ポートで集計スループットを測る
+    import threading
+    import time
+
+    LINE = b"123456,0.123456,-0.654321,9.806650\n"
+    BLOCK = LINE * 200
+    DURATION = 2.0
+
+    def writer(fds, stop):
+        for fd in fds:
+            os.set_blocking(fd, False)
+        while not stop.is_set():
+            for fd in fds:
+                try:
+                    os.write(fd, BLOCK)
+                except BlockingIOError:
+                    pass
+            time.sleep(0)
+
+    async def consume(ingest, name, counts):
+        async for batch in ingest.stream(name):
+            counts[name] += len(batch.values)
+
+    async def run(n_ports):
+        ingest = AsyncIngest()
+        pipes = [os.pipe() for _ in range(n_ports)]
+        counts = {}
+        tasks = []
+        for i, (r, _) in enumerate(pipes):
+            name = f"port{i}"
+            counts[name] = 0
+            ingest.add_fd(name, r)
+            tasks.append(asyncio.create_task(consume(ingest, name, counts)))
+        stop = threading.Event()
+        t = threading.Thread(target=writer, args=([w for _, w in pipes], stop), daemon=True)
+        t.start()
+        await asyncio.sleep(DURATION)
+        stop.set()
+        t.join()
+        total = sum(counts.values())
+        ingest.close()
+        await asyncio.gather(*tasks)
+        for r, w in pipes:
+            os.close(r)
+            os.close(w)
+        return total / DURATION
+
+    print("ports  samples/s")
+    for n in (1, 2, 4, 8, 16, 32):
+        print(f"{n:5d}  {asyncio.run(run(n)):10.0f}")
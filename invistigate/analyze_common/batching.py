@@ -0,0 +1,152 @@
+"""サンプルをブロック単位でまとめて受け渡すためのバッチャー
+
+1サンプルごとに dict を作ってキューに put する代わりに、ポートごとに
+事前確保した array('d') ブロックへ書き込み、ブロックが埋まったとき
+(block_rows) か最初のサンプルから max_latency 秒経ったときに
+ブロック全体を (n, columns) の NumPy 配列として emit() に渡す。
+ブロックはそのまま受け渡すので、受け取った側でコピーする必要はない。
+"""
+import time
+from array import array
+
+import numpy as np
+
+BLOCK_ROWS = 1024
+MAX_LATENCY = 0.05  # [s]
+
+
+class BlockBatcher:
+    def __init__(self, columns, emit, block_rows=BLOCK_ROWS, max_latency=MAX_LATENCY):
+        """emit(values): (n, columns) の float64 配列を受け取る関数 (キューへの put など)"""
+        self.columns = columns
+        self.emit = emit
+        self.block_rows = block_rows
+        self.max_latency = max_latency
+        self.blocks_emitted = 0
+        self.samples_emitted = 0
+        self._new_block()
+
+    def _new_block(self):
+        self.block = array('d', bytes(8 * self.columns * self.block_rows))
+        self.view = np.frombuffer(self.block, dtype=np.float64).reshape(self.block_rows, self.columns)
+        self.n = 0
+        self.first_time = None
+
+    def __len__(self):
+        return self.n
+
+    def append(self, row):
+        """1サンプル (長さ columns のシーケンス) を追加する"""
+        if self.n == 0:
+            self.first_time = time.monotonic()
+        base = self.n * self.columns
+        self.block[base:base + self.columns] = array('d', row)
+        self.n += 1
+        if self.n == self.block_rows:
+            self.flush()
+        elif time.monotonic() - self.first_time >= self.max_latency:
+            self.flush()
+
+    def extend(self, values):
+        """(k, columns) の配列をまとめて追加する"""
+        values = np.asarray(values, dtype=np.float64)
+        while len(values):
+            if self.n == 0:
+                self.first_time = time.monotonic()
+            k = min(len(values), self.block_rows - self.n)
+            self.view[self.n:self.n + k] = values[:k]
+            self.n += k
+            values = values[k:]
+            if self.n == self.block_rows:
+                self.flush()
+        if self.n and time.monotonic() - self.first_time >= self.max_latency:
+            self.flush()
+
+    def due(self, now=None):
+        """時間による flush が必要かどうか"""
+        if self.n == 0:
+            return False
+        return (now if now is not None else time.monotonic()) - self.first_time >= self.max_latency
+
+    def flush(self):
+        """溜まっているサンプルをブロックごと emit() に渡す"""
+        if self.n == 0:
+            return
+        values = self.view[:self.n]
+        self.blocks_emitted += 1
+        self.samples_emitted += self.n
+        self._new_block()
+        self.emit(values)
+
+
+if __name__ == "__main__":
+    # 1サンプル1dict + Queue.put と、ブロック単位の受け渡しの比較
+    import threading
+    import tracemalloc
+    from queue import Queue
+
+    N = 200_000
+    rows = [(float(i), 0.1, 0.2, 0.3) for i in range(N)]
+
+    def per_sample():
+        q = Queue()
+
+        def consumer():
+            got = 0
+            while got < N:
+                d = q.get()
+                got += 1
+
+        t = threading.Thread(target=consumer)
+        t.start()
+        t0 = time.perf_counter()
+        for milisec, x, y, z in rows:
+            q.put({'name': 'BNO08x_1', 'milisec': milisec, 'x': x, 'y': y, 'z': z})
+        t.join()
+        return time.perf_counter() - t0, N
+
+    def batched():
+        q = Queue()
+        batcher = BlockBatcher(4, q.put)
+
+        def consumer():
+            got = 0
+            while got < N:
+                got += len(q.get())
+
+        t = threading.Thread(target=consumer)
+        t.start()
+        t0 = time.perf_counter()
+        for row in rows:
+            batcher.append(row)
+        batcher.flush()
+        t.join()
+        return time.perf_counter() - t0, batcher.blocks_emitted
+
+    def retained_bytes(fill):
+        # キューに N サンプル分を溜めたときに確保されているメモリ
+        tracemalloc.start()
+        q = fill()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del q
+        return current / N
+
+    def fill_dicts():
+        q = Queue()
+        for milisec, x, y, z in rows:
+            q.put({'name': 'BNO08x_1', 'milisec': milisec, 'x': x, 'y': y, 'z': z})
+        return q
+
+    def fill_blocks():
+        q = Queue()
+        batcher = BlockBatcher(4, q.put)
+        for row in rows:
+            batcher.append(row)
+        batcher.flush()
+        return q
+
+    for label, run, fill in (("dict per sample", per_sample, fill_dicts), ("array blocks", batched, fill_blocks)):
+        elapsed, queue_ops = run()
+        print(f"{label:16s}: {N / elapsed:10.0f} samples/s, {queue_ops / elapsed:10.0f} queue puts/s, "
+              f"{queue_ops / N:.4f} puts/sample, {retained_bytes(fill):6.1f} bytes/sample queued")
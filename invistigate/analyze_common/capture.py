@@ -0,0 +1,227 @@
+"""シリアルの生データの記録 (キャプチャ) と、擬似端末 (pty) を使った再生
+
+キャプチャファイルは MAGIC のあとに、読み書きしたまとまりごとに
+
+    <d: ホストの時刻 time.time()  c: 'R' (受信) / 'W' (送信)  I: バイト数>  データ
+
+を並べたもの。再生は pty を作り、受信データを記録時と同じ間隔
+(speed 倍、speed=0 なら待たずに最大速度) でマスター側に書き込む。
+スクリプト側は pty のスレーブをシリアルポートとして開くだけでよい。
+--link COM6 のようにすると、カレントディレクトリに COM6 という名前の
+シンボリックリンクを作るので、PORT = 'COM6' のままのスクリプトを
+そのディレクトリで実行すれば変更なしで再生データを受信できる
+(Linux の pyserial はポート名をパスとして開く)。
+serial.tools.list_ports.comports() の一覧から選ぶスクリプト (SC_Bin.py など) には
+pty もリンクも出てこないので、環境変数 SERIAL_PORT にスレーブ名を渡す
+(SC_Bin.py / SC_BIN01.py は SERIAL_PORT があればそれを開く)。
+
+    python -m analyze_common.capture record /dev/ttyACM0 session.cap --send 'short,20000,20\\n'
+    python -m analyze_common.capture replay session.cap --speed 10 --link COM6 --wait-input
+    SERIAL_PORT=/dev/pts/5 python SC_Bin.py     # replay が表示したスレーブ名
+    python -m analyze_common.capture bench session.cap --cols 3
+"""
+import os
+import select
+import struct
+import time
+
+MAGIC = b'SERCAP1\n'
+RECORD = struct.Struct('<dcI')
+RECEIVED = b'R'
+SENT = b'W'
+
+
+class CaptureWriter:
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.bytes = 0
+
+    def write(self, direction, data, t=None):
+        self.file.write(RECORD.pack(time.time() if t is None else t, direction, len(data)))
+        self.file.write(data)
+        self.bytes += len(data)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_capture(path):
+    """(ホスト時刻, 方向, データ) を記録順に返す"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            t, direction, n = RECORD.unpack(head)
+            data = f.read(n)
+            if len(data) < n:
+                return  # 記録中に止まった末尾
+            yield t, direction, data
+
+
+def record(port, baudrate, path, duration=None, send=None):
+    """ポートから受信したバイト列を、届いたまとまりごとに受信時刻付きで記録する"""
+    import serial
+
+    with serial.Serial(port, baudrate, timeout=0.05) as ser, CaptureWriter(path) as out:
+        if send:
+            ser.write(send)
+            out.write(SENT, send)
+        start = time.time()
+        try:
+            while duration is None or time.time() - start < duration:
+                data = ser.read(ser.in_waiting or 1)
+                if data:
+                    out.write(RECEIVED, data)
+        except KeyboardInterrupt:
+            pass
+        return out.bytes
+
+
+class Replayer:
+    """キャプチャの受信データを pty に流す。slave_name をシリアルポートとして開く"""
+
+    def __init__(self, path, speed=1.0, loop=False, wait_input=False, link=None):
+        import tty
+
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.wait_input = wait_input
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)  # エコーや改行変換をしない
+        self.slave_name = os.ttyname(self.slave)
+        self.link = link
+        if link:
+            if os.path.islink(link):
+                os.remove(link)
+            os.symlink(self.slave_name, link)
+        self.bytes = 0
+        self.elapsed = 0.0
+
+    def _wait_for_host(self):
+        """ホスト側が何か書き込む (設定コマンドなど) まで待つ"""
+        while True:
+            ready, _, _ = select.select([self.master], [], [], 0.5)
+            if ready:
+                os.read(self.master, 4096)
+                return
+
+    def _drain_host(self):
+        # ホストが書いたデータは読み捨てる (溜まるとホスト側の write が詰まる)
+        while select.select([self.master], [], [], 0)[0]:
+            os.read(self.master, 4096)
+
+    def run(self):
+        if self.wait_input:
+            self._wait_for_host()
+        start = time.perf_counter()
+        while True:
+            first = None
+            base = time.perf_counter()
+            for t, direction, data in read_capture(self.path):
+                if direction != RECEIVED:
+                    continue
+                if first is None:
+                    first = t
+                if self.speed > 0:
+                    delay = base + (t - first) / self.speed - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                view = memoryview(data)
+                while view:
+                    n = os.write(self.master, view)
+                    view = view[n:]
+                self.bytes += len(data)
+                self._drain_host()
+            if not self.loop:
+                break
+        self.elapsed = time.perf_counter() - start
+
+    def close(self):
+        if self.link and os.path.islink(self.link):
+            os.remove(self.link)
+        os.close(self.master)
+        os.close(self.slave)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_speed(text):
+    """'1', '10', '10x', 'max' を倍率にする (max は 0)"""
+    text = text.lower().rstrip('x')
+    return 0.0 if text == 'max' else float(text)
+
+
+if __name__ == "__main__":
+    import argparse
+    import threading
+
+    parser = argparse.ArgumentParser(description="シリアルの生データの記録と pty での再生")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_rec = sub.add_parser('record', help="ポートの受信データを記録する (Ctrl+C で終了)")
+    p_rec.add_argument('port')
+    p_rec.add_argument('path')
+    p_rec.add_argument('--baud', type=int, default=115200)
+    p_rec.add_argument('--duration', type=float)
+    p_rec.add_argument('--send', help="開始時に送るコマンド (\\n などのエスケープ可)")
+    p_play = sub.add_parser('replay', help="記録を pty に流す")
+    p_play.add_argument('path')
+    p_play.add_argument('--speed', default='1', help="再生速度の倍率 (1, 10, max)")
+    p_play.add_argument('--link', help="pty へのシンボリックリンクを作るパス (例: COM6)")
+    p_play.add_argument('--loop', action='store_true', help="最後まで流したら先頭から繰り返す")
+    p_play.add_argument('--wait-input', action='store_true', help="ホストが何か書き込んでから流し始める")
+    p_bench = sub.add_parser('bench', help="最大速度で再生し、pty 越しの受信・パースの速度を測る")
+    p_bench.add_argument('path')
+    p_bench.add_argument('--cols', type=int, default=4, help="CSV の列数 (text_parse.LineParser に渡す)")
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        send = args.send.encode().decode('unicode_escape').encode() if args.send else None
+        n = record(args.port, args.baud, args.path, args.duration, send)
+        print(f"{args.path}: {n} bytes")
+    elif args.command == 'replay':
+        import signal
+        import sys
+
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # kill でもリンクを消して終わる
+        with Replayer(args.path, parse_speed(args.speed), args.loop, args.wait_input, args.link) as player:
+            print(f"{player.slave_name}" + (f" ({args.link})" if args.link else "") + " に再生します。Ctrl+Cで終了します。")
+            try:
+                player.run()
+            except KeyboardInterrupt:
+                pass
+        print(f"{player.bytes} bytes")
+    else:
+        import serial
+
+        from analyze_common.text_parse import ChunkedReader
+
+        with Replayer(args.path, speed=0) as player:
+            with serial.Serial(player.slave_name, timeout=0.05) as ser:
+                reader = ChunkedReader(ser, args.cols)
+                rows = 0
+                side = 0
+                thread = threading.Thread(target=player.run, daemon=True)
+                thread.start()
+                start = time.perf_counter()
+                while thread.is_alive() or ser.in_waiting:
+                    values, others = reader.read()
+                    rows += len(values)
+                    side += len(others)
+                elapsed = time.perf_counter() - start
+        print(f"{player.bytes} bytes, {rows} rows (+{side} side lines) in {elapsed:.2f} s: "
+              f"{player.bytes / elapsed / 1e6:.1f} MB/s, {rows / elapsed:.0f} rows/s")
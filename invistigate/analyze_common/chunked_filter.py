@@ -0,0 +1,189 @@
+"""メモリに載らない長さの記録をブロックごとに読んでかける零位相ローパス
+
+graph_viewer の lowpass_filter() は系列全体を filtfilt するため、記録全体を
+メモリに読む必要がある。sosfiltfilt_chunked() は sosfiltfilt と同じ計算
+(両端の奇対称パディング → 前向き sosfilt → 後ろ向き sosfilt) を、
+CHUNK_ROWS 行ずつ sosfilt の状態 zi を引き継ぎながら行う。前向きの結果は
+一時ファイル (np.memmap) に置くので、使うメモリは記録の長さによらずブロック数行分になる。
+状態を引き継ぐのでブロックの継ぎ目でも一括計算と同じ値になる (重ねて読む必要もない)。
+
+    python -m analyze_common.chunked_filter filter log.vlrec log.lpf.vlrec --cutoff 0.2 --order 1
+    python -m analyze_common.chunked_filter check --rows 20000000
+"""
+import os
+import tempfile
+
+import numpy as np
+from scipy.signal import sosfilt, sosfilt_zi
+
+from analyze_common.sensor_pipeline import lowpass_sos
+
+CHUNK_ROWS = 1 << 20
+
+
+def default_padlen(sos):
+    """sosfiltfilt と同じ既定のパディング長"""
+    sos = np.asarray(sos)
+    ntaps = 2 * len(sos) + 1 - min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+    return 3 * int(ntaps)
+
+
+def _hold(seg, last):
+    """NaN を直前の有効な値で埋める (先頭の NaN は last で埋める)"""
+    seg = np.array(seg, dtype=np.float64)
+    nan = np.isnan(seg)
+    if nan.any():
+        idx = np.where(nan, 0, np.arange(1, len(seg) + 1))
+        np.maximum.accumulate(idx, out=idx)
+        seg = np.concatenate(([last], seg))[idx]
+    return seg
+
+
+def _first_valid(x, chunk_rows, reverse=False):
+    starts = range(0, len(x), chunk_rows)
+    for start in (reversed(starts) if reverse else starts):
+        seg = np.asarray(x[start:start + chunk_rows], dtype=np.float64)
+        valid = seg[~np.isnan(seg)]
+        if len(valid):
+            return valid[-1] if reverse else valid[0]
+    return np.nan
+
+
+def sosfiltfilt_chunked(sos, x, out=None, chunk_rows=CHUNK_ROWS, padlen=None, hold_nan=False, tmp_dir=None):
+    """sosfiltfilt(sos, x) をブロックごとに計算する
+
+    x はスライスできる1次元配列 (np.memmap など)。out を渡すとそこに書き込む
+    (np.memmap を渡せば結果もメモリに載せずに済む)。
+    hold_nan=True なら NaN (タイムアウト) を直前の値で埋めてフィルタし、結果の同じ位置を NaN に戻す。
+    """
+    sos = np.asarray(sos, dtype=np.float64)
+    n = len(x)
+    edge = default_padlen(sos) if padlen is None else padlen
+    if n <= edge:
+        raise ValueError(f"The length of the input vector x must be greater than padlen, which is {edge}.")
+    if out is None:
+        out = np.empty(n)
+    zi = sosfilt_zi(sos)
+
+    # 両端の奇対称パディング (scipy.signal の odd_ext と同じ)
+    head = np.asarray(x[:edge + 1], dtype=np.float64)
+    tail = np.asarray(x[n - edge - 1:], dtype=np.float64)
+    if hold_nan:
+        head = _hold(head, _first_valid(x, chunk_rows))
+        tail = _hold(tail, _first_valid(x[:n - edge - 1], chunk_rows, reverse=True) if n > edge + 1 else head[0])
+    ext_head = 2 * head[0] - head[edge:0:-1]
+    ext_tail = 2 * tail[-1] - tail[-2::-1]
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as d:
+        # 前向き: [ext_head, x, ext_tail] を順に流し、結果を一時ファイルに置く
+        fwd = np.memmap(os.path.join(d, 'forward.bin'), dtype=np.float64, mode='w+', shape=(n + 2 * edge,))
+        state = zi * ext_head[0]
+        fwd[:edge], state = sosfilt(sos, ext_head, zi=state)
+        last = head[0]
+        for start in range(0, n, chunk_rows):
+            seg = np.asarray(x[start:start + chunk_rows], dtype=np.float64)
+            if hold_nan:
+                seg = _hold(seg, last)
+                last = seg[-1]
+            fwd[edge + start:edge + start + len(seg)], state = sosfilt(sos, seg, zi=state)
+        fwd[edge + n:], state = sosfilt(sos, ext_tail, zi=state)
+
+        # 後ろ向き: 末尾から chunk_rows ずつ逆順に流し、パディングを除いた部分を out に書く
+        state = zi * fwd[-1]
+        total = n + 2 * edge
+        for stop in range(total, 0, -chunk_rows):
+            start = max(stop - chunk_rows, 0)
+            y, state = sosfilt(sos, fwd[start:stop][::-1], zi=state)
+            y = y[::-1]
+            a, b = max(start, edge), min(stop, edge + n)
+            if a < b:
+                out[a - edge:b - edge] = y[a - start:b - start]
+        del fwd
+
+    if hold_nan:
+        for start in range(0, n, chunk_rows):
+            nan = np.isnan(np.asarray(x[start:start + chunk_rows], dtype=np.float64))
+            if nan.any():
+                out[start:start + chunk_rows][nan] = np.nan
+    return out
+
+
+def filter_recording(src, dst, cutoff, order, chunk_rows=CHUNK_ROWS):
+    """.vlrec の各センサーの距離にローパスをかけ、同じ time/ms の .vlrec として dst に書く
+
+    周波数は sensor_pipeline と同じく平均のサンプリング周期から求める。
+    センサーIDごとの (周波数, 実際のカットオフ) を返す。
+    """
+    from analyze_common.recording import Recording, RecordingWriter
+
+    rec = Recording(src)
+    used = {}
+    with RecordingWriter(dst, block_rows=chunk_rows) as writer, tempfile.TemporaryDirectory(dir=dst) as d:
+        for sid in rec.sensors:
+            t, ms, dist = rec.sensor(sid)
+            if len(ms) < 2:
+                writer.append_columns(sid, t, ms, dist)
+                continue
+            freq = 1000.0 * (len(ms) - 1) / (ms[-1] - ms[0])  # np.diff(ms).mean() と同じ
+            fc = min(cutoff, freq / 2)
+            out = np.memmap(os.path.join(d, 'filtered.bin'), dtype=np.float32, mode='w+', shape=(len(dist),))
+            sosfiltfilt_chunked(lowpass_sos(order, float(fc), float(freq)), dist, out, chunk_rows,
+                                hold_nan=True, tmp_dir=d)
+            writer.append_columns(sid, t, ms, out)
+            del out
+            used[sid] = (freq, fc)
+    return used
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    import tracemalloc
+
+    parser = argparse.ArgumentParser(description="記録のブロックごとの零位相ローパス")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_filter = sub.add_parser('filter', help=".vlrec にローパスをかけて別の .vlrec に書く (log.csv は analyze_common.recording で変換)")
+    p_filter.add_argument('src')
+    p_filter.add_argument('dst', nargs='?', help="出力先 (省略時は拡張子の前に .lpf を付けたパス)")
+    p_filter.add_argument('--cutoff', type=float, default=0.2, help="カットオフ周波数 [Hz]")
+    p_filter.add_argument('--order', type=int, default=1)
+    p_filter.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    p_check = sub.add_parser('check', help="タイムアウトを含む合成データで一括計算 (lowpass_filter_gaps) との差とピークメモリを確かめる")
+    p_check.add_argument('--rows', type=int, default=5_000_000)
+    p_check.add_argument('--order', type=int, default=4)
+    p_check.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == 'filter':
+        root, ext = os.path.splitext(args.src.rstrip('/\\'))
+        dst = args.dst or f"{root}.lpf{ext}"
+        for sid, (freq, fc) in filter_recording(args.src, dst, args.cutoff, args.order, args.chunk_rows).items():
+            print(f"sensor {sid}: fs={freq:.2f}Hz cutoff={fc:.2f}Hz")
+        print(f"{args.src} -> {dst} in {time.perf_counter() - start:.2f} s")
+    else:
+        from analyze_common.sensor_pipeline import lowpass_filter_gaps
+
+        fs, fc = 50.0, 0.2
+        with tempfile.TemporaryDirectory() as d:
+            # 入力も出力もファイル上に置き、Python 側で確保したメモリだけを数える
+            x = np.memmap(os.path.join(d, 'x.bin'), dtype=np.float32, mode='w+', shape=(args.rows,))
+            rng = np.random.default_rng(0)
+            for i in range(0, args.rows, CHUNK_ROWS):
+                k = np.arange(i, min(i + CHUNK_ROWS, args.rows))
+                x[k] = 480 + 30 * np.sin(k / fs / 5) + rng.normal(0, 2, len(k))
+                x[k[rng.random(len(k)) < 0.01]] = np.nan  # タイムアウト
+            out = np.memmap(os.path.join(d, 'y.bin'), dtype=np.float64, mode='w+', shape=(args.rows,))
+            tracemalloc.start()
+            start = time.perf_counter()
+            sosfiltfilt_chunked(lowpass_sos(args.order, fc, fs), x, out, args.chunk_rows, hold_nan=True)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            start = time.perf_counter()
+            ref = lowpass_filter_gaps(np.asarray(x, dtype=float), fc, fs, order=args.order)
+            ref_time = time.perf_counter() - start
+            assert np.array_equal(np.isnan(out), np.isnan(ref))
+            err = float(np.nanmax(np.abs(out - ref)))
+        print(f"{args.rows} rows, order {args.order}: chunked {elapsed:.2f} s (peak {peak / 1e6:.1f} MB), "
+              f"in-memory filtfilt {ref_time:.2f} s (input alone {args.rows * 8 / 1e6:.0f} MB), max |diff| {err:.2e}")
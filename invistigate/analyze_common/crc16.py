@@ -0,0 +1,106 @@
+"""CRC16-CCITT (多項式0x1021, 初期値0xFFFF) のテーブル駆動実装
+
+デバイス側 (code6.py) の crc16_ccitt() と同じ値を返す。
+1フレームずつの検証は crc16_ccitt()、バッファに溜まった複数フレームは
+crc16_ccitt_batch() / verify_batch() でまとめて検証する。
+"""
+import binascii
+
+import numpy as np
+
+POLY = 0x1021
+INIT = 0xFFFF
+
+
+def _make_table(poly=POLY):
+    """上位バイトごとのCRC値テーブル(256要素)を作る"""
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = (crc << 1) ^ poly
+            else:
+                crc <<= 1
+            crc &= 0xFFFF
+        table.append(crc)
+    return table
+
+
+CRC16_TABLE = np.array(_make_table(), dtype=np.uint16)
+
+
+def crc16_ccitt(data, init=INIT) -> int:
+    """1フレーム分のCRC16-CCITTを計算する (binascii.crc_hqx はC実装のテーブル方式)"""
+    return binascii.crc_hqx(data, init)
+
+
+def crc16_ccitt_batch(frames, init=INIT):
+    """同じ長さのフレームをまとめて計算する
+
+    frames: (N, L) の uint8 配列 (またはそれに変換できるもの)
+    戻り値: 長さNの uint16 配列
+    バイト位置(L回)だけループし、N フレーム分はNumPyで一括処理する。
+    """
+    frames = np.asarray(frames, dtype=np.uint8)
+    if frames.ndim != 2:
+        raise ValueError(f"frames must be 2-D (N, L), got shape {frames.shape}")
+    crc = np.full(frames.shape[0], init, dtype=np.uint16)
+    # 列方向に連続したメモリにしておくとバイト位置ごとの取り出しが速い
+    columns = np.ascontiguousarray(frames.T)
+    for col in columns:
+        crc = (crc << 8) ^ CRC16_TABLE[(crc >> 8) ^ col]
+    return crc
+
+
+def verify_batch(payloads, received_crc, init=INIT):
+    """payloads (N, L) のCRCを計算し、受信CRC (長さN) と一致するかのbool配列を返す"""
+    return crc16_ccitt_batch(payloads, init) == np.asarray(received_crc, dtype=np.uint16)
+
+
+def _reference_crc16_ccitt(data: bytes, poly=POLY, init=INIT) -> int:
+    """従来のビットごとのループ実装 (既知解テスト用)"""
+    crc = init
+    for b in data:
+        crc ^= b << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = (crc << 1) ^ poly
+            else:
+                crc <<= 1
+            crc &= 0xFFFF
+    return crc
+
+
+if __name__ == "__main__":
+    import os
+    import time
+
+    # 既知解: CRC-16/CCITT-FALSE の "123456789" は 0x29B1
+    assert crc16_ccitt(b"123456789") == 0x29B1
+    assert _reference_crc16_ccitt(b"123456789") == 0x29B1
+    assert crc16_ccitt(b"") == INIT
+
+    # 従来実装との突き合わせ (56バイト = 14 floats のペイロード)
+    frames = np.frombuffer(os.urandom(2000 * 56), dtype=np.uint8).reshape(-1, 56)
+    expected = np.array([_reference_crc16_ccitt(f.tobytes()) for f in frames], dtype=np.uint16)
+    assert all(crc16_ccitt(f.tobytes()) == e for f, e in zip(frames, expected))
+    assert np.array_equal(crc16_ccitt_batch(frames), expected)
+    assert verify_batch(frames, expected).all()
+    print("known-answer tests: OK")
+
+    t0 = time.perf_counter()
+    for f in frames:
+        _reference_crc16_ccitt(f.tobytes())
+    t_ref = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for f in frames:
+        crc16_ccitt(f.tobytes())
+    t_one = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    crc16_ccitt_batch(frames)
+    t_batch = time.perf_counter() - t0
+    n = len(frames)
+    print(f"bitwise loop : {n / t_ref:12.0f} frames/s")
+    print(f"crc_hqx      : {n / t_one:12.0f} frames/s")
+    print(f"numpy batch  : {n / t_batch:12.0f} frames/s")
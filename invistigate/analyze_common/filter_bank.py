@@ -0,0 +1,159 @@
+"""N チャンネル分の SOS 係数と状態を持つ、受信ブロックごとのフィルタバンク
+
+TUI のローパスはセンサーごとに dict に状態を持ち、1サンプルずつ float で更新していた。
+SosFilterBank は状態 zi を (セクション数, 2, チャンネル数) の配列で持ち、
+受信したブロックを sosfilt(..., zi=zi) でまとめて処理して状態を引き継ぐ。
+係数は sensor_pipeline と同じ butter の設計 (butter_sos()) を使うので、
+ブロックに分けて流しても、記録全体に sosfilt をかけた結果と同じになる。
+
+各チャンネルの状態は最初の有効な値で定常状態に初期化する (TUI の prev_lp_dist と同じ)。
+NaN (タイムアウト・欠測) は直前の有効な値で埋めて状態を進め、出力の同じ位置は NaN にする。
+
+    bank = SosFilterBank(butter_sos(2, 1.0, 50.0), channels=['0', '1'])
+    y = bank.process(block)                     # (n, 2) の行がそろったブロック
+    y0 = bank.process_channel('0', values)      # 1チャンネル分だけ届いたとき
+"""
+import functools
+
+import numpy as np
+from scipy.signal import butter, sosfilt, sosfilt_zi
+
+
+@functools.lru_cache(maxsize=None)
+def butter_sos(order, cutoff, fs, btype='low'):
+    """butter の2次セクション。cutoff は Hz (band 系は (low, high) のタプル)
+
+    正規化カットオフは sensor_pipeline.lowpass_design() と同じく 0.99 で頭打ちにする。
+    """
+    nyq = 0.5 * fs
+    wn = tuple(min(c / nyq, 0.99) for c in cutoff) if isinstance(cutoff, tuple) else min(cutoff / nyq, 0.99)
+    return butter(order, wn, btype=btype, analog=False, output='sos')
+
+
+class SosFilterBank:
+    """同じ SOS 係数のフィルタをチャンネルごとの状態でかける (チャンネルは後から add() で増やせる)"""
+
+    def __init__(self, sos, channels=()):
+        self.sos = np.asarray(sos, dtype=np.float64)
+        self._zi_unit = sosfilt_zi(self.sos)[:, :, None]  # 入力1の定常状態
+        self.keys = []
+        self._index = {}
+        self.zi = np.zeros((len(self.sos), 2, 0))
+        self._started = np.zeros(0, dtype=bool)
+        self._last = np.zeros(0)  # チャンネルごとの直前の有効な入力
+        for key in channels:
+            self.add(key)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key):
+        """チャンネルを追加し、その番号を返す"""
+        if key in self._index:
+            return self._index[key]
+        self._index[key] = len(self.keys)
+        self.keys.append(key)
+        self.zi = np.concatenate((self.zi, np.zeros((len(self.sos), 2, 1))), axis=2)
+        self._started = np.append(self._started, False)
+        self._last = np.append(self._last, 0.0)
+        return self._index[key]
+
+    def reset(self, key=None):
+        """状態を捨てる (key を省略すると全チャンネル)。次の有効な値で初期化し直す"""
+        idx = slice(None) if key is None else self._index[key]
+        self.zi[:, :, idx] = 0
+        self._started[idx] = False
+
+    def _run(self, x, cols):
+        """x: (n, len(cols)) を cols のチャンネルの状態で処理する"""
+        x = np.asarray(x, dtype=np.float64)
+        if not len(x):
+            return np.empty(x.shape)
+        nan = np.isnan(x)
+        rows = np.arange(len(x))[:, None]
+        # まだ始まっていないチャンネルは、ブロック内の最初の有効な値で初期化する
+        has = ~nan.all(axis=0)
+        new = has & ~self._started[cols]
+        if new.any():
+            first = x[nan[:, new].argmin(axis=0), np.flatnonzero(new)]
+            self.zi[:, :, cols[new]] = self._zi_unit * first
+            self._last[cols[new]] = first
+            self._started[cols[new]] = True
+        # NaN は直前の有効な値で埋める (ブロックの先頭は前のブロックの値)
+        if nan.any():
+            src = np.where(nan, -1, rows)
+            np.maximum.accumulate(src, axis=0, out=src)
+            x = np.where(src >= 0, x[np.maximum(src, 0), np.arange(x.shape[1])], self._last[cols])
+        y, zi = sosfilt(self.sos, x, axis=0, zi=self.zi[:, :, cols])
+        started = self._started[cols]
+        self.zi[:, :, cols[started]] = zi[:, :, started]
+        self._last[cols[started]] = x[-1, started]
+        y[nan | ~started] = np.nan
+        return y
+
+    def process(self, values):
+        """全チャンネル分そろった (n, チャンネル数) のブロックを処理し、同じ形の出力を返す"""
+        values = np.asarray(values, dtype=np.float64).reshape(-1, len(self.keys))
+        return self._run(values, np.arange(len(self.keys)))
+
+    def process_channel(self, key, values):
+        """1チャンネル分の (n,) の値を処理する (チャンネルがなければ追加する)"""
+        col = self.add(key)
+        values = np.asarray(values, dtype=np.float64).reshape(-1, 1)
+        return self._run(values, np.array([col]))[:, 0]
+
+
+if __name__ == "__main__":
+    import argparse
+    import math
+    import time
+
+    parser = argparse.ArgumentParser(description="フィルタバンクを1サンプルずつの dict 実装・一括 sosfilt と比べる")
+    parser.add_argument('--rows', type=int, default=200_000, help="チャンネルあたりのサンプル数")
+    parser.add_argument('--channels', type=int, default=8)
+    parser.add_argument('--block', type=int, default=64)
+    parser.add_argument('--order', type=int, default=4)
+    args = parser.parse_args()
+
+    fs, fc = 50.0, 1.0
+    rng = np.random.default_rng(0)
+    x = 480 + rng.normal(0, 2, (args.rows, args.channels))
+    x[rng.random(x.shape) < 0.01] = np.nan
+    x[0] = 480  # 比較を簡単にするため先頭は全チャンネル有効
+
+    # 変更前の TUI: チャンネルごとの dict に状態を持ち、1サンプルずつ1次ローパス
+    ts = 1 / fs
+    alpha = ts / (ts + 1 / (2 * math.pi * fc))
+    start = time.perf_counter()
+    prev = {}
+    for row in x.tolist():
+        for ch, v in enumerate(row):
+            if v == v:
+                prev[ch] = alpha * v + (1 - alpha) * prev.get(ch, v)
+    loop = time.perf_counter() - start
+
+    bank = SosFilterBank(butter_sos(args.order, fc, fs), channels=range(args.channels))
+    start = time.perf_counter()
+    out = np.concatenate([bank.process(x[i:i + args.block]) for i in range(0, args.rows, args.block)])
+    blocked = time.perf_counter() - start
+
+    # 一括: NaN を直前の値で埋めて sosfilt (状態は先頭の値の定常状態)
+    sos = butter_sos(args.order, fc, fs)
+    import pandas as pd
+
+    filled = pd.DataFrame(x).ffill().to_numpy()
+    ref, _ = sosfilt(sos, filled, axis=0, zi=sosfilt_zi(sos)[:, :, None] * filled[0])
+    ref[np.isnan(x)] = np.nan
+    assert np.allclose(out, ref, equal_nan=True)
+
+    ch_bank = SosFilterBank(sos)
+    parts = [ch_bank.process_channel('a', x[i:i + 7, 0]) for i in range(0, args.rows, 7)]
+    assert np.allclose(np.concatenate(parts), ref[:, 0], equal_nan=True)
+
+    n = args.rows * args.channels
+    print(f"{args.channels} channels x {args.rows} samples, order {args.order}, {args.block} rows/block")
+    print(f"per-sample dict (1st order): {loop:.2f} s ({n / loop / 1e6:.2f} M samples/s)")
+    print(f"SosFilterBank              : {blocked:.2f} s ({n / blocked / 1e6:.2f} M samples/s), same as one sosfilt")
@@ -0,0 +1,225 @@
+"""rich の Live 表示を受信処理から切り離すための描画ヘルパー
+
+受信ループの中で1行ごとに make_table() と live.update() を呼ぶと、
+表示の作り直しに時間を取られてシリアルの読み出しが遅れる。
+ここでは受信側 (別スレッド) は LiveView.mark() で行ごとの最新値を置くだけにし、
+描画側は一定のフレームレート (fps) で、前回から変わった行だけを
+文字列に整形し直して Table を組み立てる。
+"""
+import threading
+import time
+
+from rich.live import Live
+from rich.table import Table
+
+RENDER_FPS = 20
+
+
+class LiveView:
+    """行ごとの最新値 (受信スレッドが更新) と整形済みセル (描画側が保持)"""
+
+    def __init__(self, columns, format_row, title=None, show_lines=False, order=None):
+        """columns: [(見出し, justify), ...]、format_row(key, *values): セル文字列のタプルを返す関数
+
+        order: 行の並べ順のキー関数 (sorted の key。省略時は key そのものの順)
+        """
+        self.columns = columns
+        self.format_row = format_row
+        self.order = order
+        self.title = title
+        self.show_lines = show_lines
+        self.lock = threading.Lock()
+        self.pending = {}  # key -> values (前回の描画以降に更新された行)
+        self.cells = {}  # key -> 整形済みのセル
+        self.version = 0
+        self.rendered_version = -1
+        self.frames = 0
+        self.rows_formatted = 0
+
+    def mark(self, key, *values):
+        """受信側から呼ぶ: 行 key の値を更新する (整形は描画時にまとめて行う)"""
+        with self.lock:
+            self.pending[key] = values
+            self.version += 1
+
+    def table(self):
+        """変わった行だけ整形し直して Table を作る"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.rendered_version = self.version
+        for key, values in pending.items():
+            self.cells[key] = self.format_row(key, *values)
+        self.rows_formatted += len(pending)
+        table = Table(title=self.title, show_lines=self.show_lines)
+        for name, justify in self.columns:
+            table.add_column(name, justify=justify)
+        for key in sorted(self.cells, key=self.order):
+            table.add_row(*self.cells[key])
+        self.frames += 1
+        return table
+
+    def changed(self):
+        return self.version != self.rendered_version
+
+    def run(self, stop, fps=RENDER_FPS, console=None):
+        """stop (threading.Event) がセットされるまで fps で描画する。更新がなければ描画しない"""
+        interval = 1.0 / fps
+        with Live(self.table(), console=console, auto_refresh=False) as live:
+            next_frame = time.perf_counter()
+            while not stop.is_set():
+                if self.changed():
+                    live.update(self.table(), refresh=True)
+                next_frame += interval
+                delay = next_frame - time.perf_counter()
+                if delay > 0:
+                    stop.wait(delay)
+                else:
+                    next_frame = time.perf_counter()  # 描画が間に合わなければフレームを飛ばす
+
+
+def start_reader(target, *args, stop=None):
+    """受信ループ target(*args) をデーモンスレッドで開始する
+
+    例外は thread.error に残す。stop を渡すと、ループが終わったとき (エラー含む) にセットする。
+    """
+    def run():
+        try:
+            target(*args)
+        except Exception as e:
+            thread.error = e
+        finally:
+            if stop is not None:
+                stop.set()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.error = None
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    # 計測: 疑似ポートに RATE_HZ x センサー数 の id,ms,dist 行を流し、
+    # 1行ごとに表示を作り直す従来方式と、受信スレッド + 一定fps描画を比べる。
+    # ポート側の受信バッファ (FIFO_BYTES) があふれた行を「欠落」、
+    # 送信から読み出しまで LATE_MS を超えた行を「遅延」として数え、
+    # 最大遅延と表示の作り直し回数、プロセスの CPU 使用率も出す。
+    import io
+    import math
+
+    from rich.console import Console
+
+    SENSORS = 2
+    FIFO_BYTES = 1024
+    LATE_MS = 50
+    DURATION = 3.0
+
+    class FakeSerial:
+        """送信スレッドが行を書き込む、容量に上限のある疑似ポート"""
+        def __init__(self):
+            self.buf = bytearray()
+            self.lock = threading.Lock()
+            self.dropped = 0
+
+        def write_line(self, line):
+            with self.lock:
+                if len(self.buf) + len(line) > FIFO_BYTES:
+                    self.dropped += 1
+                else:
+                    self.buf += line
+
+        @property
+        def in_waiting(self):
+            return len(self.buf)
+
+        def read(self, n):
+            with self.lock:
+                data = bytes(self.buf[:n])
+                del self.buf[:n]
+            if not data:
+                time.sleep(0.001)
+            return data
+
+    def device(ser, rate, stop, sent):
+        t0 = time.perf_counter()
+        i = 0
+        while not stop.is_set():
+            due = t0 + i / rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            ms = int((time.perf_counter() - t0) * 1000)
+            for sid in range(SENSORS):
+                ser.write_line(f"{sid},{ms},{400 + i % 50}\n".encode())
+                sent[0] += 1
+            i += 1
+
+    def format_row(sid, ms, dist, angle):
+        return sid, str(ms), f"{dist:.0f}", f"{angle:.2f}"
+
+    COLUMNS = [("Sensor ID", "center"), ("ms", "right"), ("Distance", "right"), ("Angle(deg)", "right")]
+
+    def run(mode, rate):
+        from analyze_common.vl53_binary import make_sample_reader
+
+        ser = FakeSerial()
+        stop = threading.Event()
+        sent = [0]
+        counts = {'received': 0, 'late': 0, 'max_ms': 0.0, 'tables': 0}
+        console = Console(file=io.StringIO(), force_terminal=True, width=100)
+        view = LiveView(COLUMNS, format_row, title="センサーデータ", show_lines=True)
+        latest = {}
+        t0 = time.perf_counter()
+
+        def ingest(update):
+            read_samples = make_sample_reader(ser)
+            while not stop.is_set():
+                for sample in read_samples():
+                    counts['received'] += 1
+                    delay_ms = (time.perf_counter() - t0) * 1000 - sample.ms
+                    counts['max_ms'] = max(counts['max_ms'], delay_ms)
+                    if delay_ms > LATE_MS:
+                        counts['late'] += 1
+                    latest[sample.sensor_id] = sample
+                    angle = 0.0
+                    if len(latest) == 2:
+                        d1, d2 = (latest[k].dist for k in sorted(latest))
+                        angle = math.degrees(math.atan((d1 - d2) / 150))
+                    update(sample, angle)
+
+        dev = threading.Thread(target=device, args=(ser, rate, stop, sent), daemon=True)
+        cpu0 = time.process_time()
+        if mode == 'per-line':
+            # 従来方式: 受信した行ごとに Table 全体を作り直して live.update()
+            def make_table():
+                counts['tables'] += 1
+                table = Table(title="センサーデータ", show_lines=True)
+                for name, justify in COLUMNS:
+                    table.add_column(name, justify=justify)
+                for sid, (s, a) in sorted(rows.items()):
+                    table.add_row(*format_row(sid, s.ms, s.dist, a))
+                return table
+            rows = {}
+            with Live(make_table(), refresh_per_second=20, console=console) as live:
+                def update(sample, angle):
+                    rows[sample.sensor_id] = (sample, angle)
+                    live.update(make_table())
+                dev.start()
+                timer = threading.Timer(DURATION, stop.set)
+                timer.start()
+                ingest(update)
+        else:
+            reader = start_reader(ingest, lambda s, a: view.mark(s.sensor_id, s.ms, s.dist, a))
+            dev.start()
+            threading.Timer(DURATION, stop.set).start()
+            view.run(stop, RENDER_FPS, console)
+            reader.join()
+            counts['tables'] = view.frames
+        dev.join()
+        cpu = (time.process_time() - cpu0) / DURATION * 100
+        return sent[0], ser.dropped, counts['late'], counts['max_ms'], counts['tables'], cpu
+
+    print(f"{'mode':9s} {'rate':>6s} {'lines':>7s} {'dropped':>8s} {'late':>6s} {'max(ms)':>8s} {'tables':>7s} {'cpu':>5s}")
+    for rate in (100, 500, 2000):
+        for mode in ('per-line', 'fps'):
+            sent, dropped, late, max_ms, tables, cpu = run(mode, rate)
+            print(f"{mode:9s} {rate:4d}Hz {sent:7d} {dropped:8d} {late:6d} {max_ms:8.1f} {tables:7d} {cpu:4.0f}%")
@@ -0,0 +1,277 @@
+""".vlrec の描画用の多段解像度ピラミッド (min/max/mean)
+
+数百万点を超える系列をそのまま plt.plot に渡すと描画が止まるので、
+センサーごとに BASE 点ずつの区間の (最初の ms, 最後の ms, min, max, mean, 有効数) を
+レベル0とし、そこから FACTOR 区間ずつまとめたレベルを区間数が TOP_BUCKETS 以下になるまで作る。
+各レベルは記録と同じディレクトリに s{n}.lod{k}.bin として置く (lod.json に構成)。
+RecordingWriter は開くときに *.bin と lod.json を消すので、記録を書き直せば古いピラミッドも消える。
+open_lod() は lod.json が記録 (header.json / index.bin) より古いか、レベルのファイルが欠けていれば作り直す。
+
+Lod.query() は表示範囲の点数が max_points 以下になる最も細かいレベルを選び、
+memmap の二分探索で範囲を切り出す。範囲の大きさによらず返す点数は max_points 程度なので、
+どの範囲でも描画は一定時間で済む。LodPlot は matplotlib の軸に付けて、ズーム・パンのたびに描き直す。
+
+    python -m analyze_common.lod build log.vlrec
+    python -m analyze_common.lod bench --rows 50000000
+"""
+import bisect
+import json
+import os
+import time
+
+import numpy as np
+
+from analyze_common.recording import Recording
+
+LOD_DTYPE = np.dtype([
+    ('ms_first', '<i8'),
+    ('ms_last', '<i8'),
+    ('min', '<f4'),
+    ('max', '<f4'),
+    ('mean', '<f4'),
+    ('count', '<u4'),  # 区間内の有効な (タイムアウトでない) 点の数
+])
+BASE = 16  # レベル0の1区間の点数
+FACTOR = 8  # 1つ上のレベルでまとめる区間数
+TOP_BUCKETS = 1024  # 最上位レベルの区間数の上限
+MAX_POINTS = 4000  # query() が返す点数の目安
+CHUNK_BUCKETS = 1 << 16  # 作成時に一度に読む区間数
+
+
+def _lod_path(path, sensor, level):
+    return os.path.join(path, f"s{sensor}.lod{level}.bin")
+
+
+def _reduce(src, group):
+    """LOD_DTYPE の配列を group 個ずつまとめる"""
+    starts = np.arange(0, len(src), group)
+    ends = np.minimum(starts + group, len(src)) - 1
+    out = np.empty(len(starts), dtype=LOD_DTYPE)
+    out['ms_first'] = src['ms_first'][starts]
+    out['ms_last'] = src['ms_last'][ends]
+    out['min'] = np.fmin.reduceat(src['min'], starts)  # NaN (全部タイムアウト) は無視
+    out['max'] = np.fmax.reduceat(src['max'], starts)
+    count = np.add.reduceat(src['count'].astype(np.int64), starts)
+    total = np.add.reduceat(np.where(src['count'] > 0, src['mean'] * src['count'].astype(np.float64), 0), starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out['mean'] = total / count
+    out['count'] = count
+    return out
+
+
+def _raw_buckets(ms, dist):
+    """生の系列を1点1区間の LOD_DTYPE にする"""
+    src = np.empty(len(ms), dtype=LOD_DTYPE)
+    src['ms_first'] = ms
+    src['ms_last'] = ms
+    src['min'] = dist
+    src['max'] = dist
+    src['mean'] = dist
+    src['count'] = ~np.isnan(dist)
+    return src
+
+
+def build_lod(path, base=BASE, factor=FACTOR, top_buckets=TOP_BUCKETS):
+    """記録 path の全センサーのピラミッドを作る (ブロックごとに読むので記録の大きさによらない)"""
+    rec = Recording(path)
+    levels = {}
+    for n, sid in enumerate(rec.sensors):
+        rows = rec.rows[sid]
+        ms = rec.column(sid, 'ms')
+        dist = rec.column(sid, 'dist')
+        chunk = base * CHUNK_BUCKETS
+        with open(_lod_path(path, n, 0), 'wb') as f:
+            for start in range(0, rows, chunk):
+                f.write(_reduce(_raw_buckets(ms[start:start + chunk], dist[start:start + chunk]), base).tobytes())
+        size = -(-rows // base)
+        level = 0
+        while size > top_buckets:
+            src = np.memmap(_lod_path(path, n, level), dtype=LOD_DTYPE, mode='r')
+            chunk = factor * CHUNK_BUCKETS
+            with open(_lod_path(path, n, level + 1), 'wb') as f:
+                for start in range(0, len(src), chunk):
+                    f.write(_reduce(src[start:start + chunk], factor).tobytes())
+            del src
+            size = -(-size // factor)
+            level += 1
+        levels[sid] = {'levels': level + 1 if rows else 0, 'rows': rows}
+    with open(os.path.join(path, 'lod.json'), 'w', encoding='utf-8') as f:
+        json.dump({'base': base, 'factor': factor, 'sensors': levels}, f)
+    return levels
+
+
+class Lod:
+    """記録とそのピラミッドを開き、範囲ごとに適したレベルを返す"""
+
+    def __init__(self, path):
+        self.rec = Recording(path)
+        self.path = path
+        self.sensors = self.rec.sensors
+        with open(os.path.join(path, 'lod.json'), encoding='utf-8') as f:
+            info = json.load(f)
+        self.base = info['base']
+        self.factor = info['factor']
+        self.info = info['sensors']
+        self._levels = {}
+        for n, sid in enumerate(self.sensors):
+            levels = self.info.get(sid, {}).get('levels', 0)
+            self._levels[sid] = [np.memmap(_lod_path(path, n, k), dtype=LOD_DTYPE, mode='r') for k in range(levels)]
+
+    def is_stale(self):
+        """ピラミッドを作った後に記録が伸びたか"""
+        return any(self.info.get(sid, {}).get('rows') != self.rec.rows[sid] for sid in self.sensors)
+
+    def query(self, sensor_id, ms_start=None, ms_end=None, max_points=MAX_POINTS):
+        """範囲の (ms, min, max, mean, level) を返す (level=-1 は生データ)
+
+        範囲に重なる区間をすべて返すので、両端が少し範囲の外まで伸びる。
+        区間の ms は最初と最後の点の中点にする。
+        """
+        ms = self.rec.column(sensor_id, 'ms')
+        # matplotlib の範囲は float なので、searchsorted だと int64 の列全体が float に変換される。
+        # bisect なら要素を1つずつ比べるだけで済む
+        lo = 0 if ms_start is None else bisect.bisect_left(ms, ms_start)
+        hi = len(ms) if ms_end is None else bisect.bisect_right(ms, ms_end)
+        if hi - lo <= max_points:
+            lo, hi = max(lo - 1, 0), min(hi + 1, len(ms))  # 端の線が範囲の外までつながるように
+            dist = self.rec.column(sensor_id, 'dist')[lo:hi]
+            return ms[lo:hi], dist, dist, dist, -1
+        levels = self._levels[sensor_id]
+        for level, buckets in enumerate(levels):
+            a = 0 if ms_start is None else bisect.bisect_left(buckets['ms_last'], ms_start)
+            b = len(buckets) if ms_end is None else bisect.bisect_right(buckets['ms_first'], ms_end)
+            if b - a <= max_points or level == len(levels) - 1:
+                part = np.asarray(buckets[a:b])
+                mid = (part['ms_first'] + part['ms_last']) / 2
+                return mid, part['min'], part['max'], part['mean'], level
+        raise ValueError(f"no lod for sensor {sensor_id}")
+
+
+def _lod_is_current(path):
+    """lod.json があり、記録の header.json / index.bin より新しいか"""
+    info_path = os.path.join(path, 'lod.json')
+    if not os.path.exists(info_path):
+        return False
+    built = os.path.getmtime(info_path)
+    for name in ('header.json', 'index.bin'):
+        source = os.path.join(path, name)
+        if os.path.exists(source) and os.path.getmtime(source) > built:
+            return False
+    return True
+
+
+def open_lod(path):
+    """ピラミッドがないか古ければ (記録より古い・行数が違う・レベルのファイルが欠けている) 作ってから開く"""
+    if _lod_is_current(path):
+        try:
+            lod = Lod(path)
+        except FileNotFoundError:
+            lod = None
+        if lod is not None and not lod.is_stale():
+            return lod
+    build_lod(path)
+    return Lod(path)
+
+
+def recording_for_lod(base_dir):
+    """base_dir の最新の記録 (sensor_pipeline.find_recording()) の .vlrec のパスを返す
+
+    log.csv / log.vlz が最新なら、隣の log.csv.vlrec / log.vlz.vlrec に変換して使う
+    (元の記録より古ければ変換し直す。log.vlrec は上書きしない)。
+    """
+    from analyze_common.recording import RecordingWriter, convert_csv
+    from analyze_common.sensor_pipeline import find_recording
+    from analyze_common.varint_codec import read_vlz
+
+    name, path, mtime = find_recording(base_dir)
+    if name == 'log.vlrec':
+        return path
+    rec_path = path + '.vlrec'
+    index = os.path.join(rec_path, 'index.bin')
+    if not os.path.exists(index) or os.path.getmtime(index) < mtime:
+        if name == 'log.csv':
+            convert_csv(path, rec_path)
+        else:
+            with RecordingWriter(rec_path) as writer:
+                for sid, (t, ms, dist) in read_vlz(path).items():
+                    writer.append_columns(sid, t, ms, dist)
+    return rec_path
+
+
+class LodPlot:
+    """matplotlib の軸に各センサーの min-max の帯と平均の線を描き、x 範囲が変わるたびに描き直す"""
+
+    def __init__(self, ax, lod, max_points=MAX_POINTS):
+        self.ax = ax
+        self.lod = lod
+        self.max_points = max_points
+        self.lines = {sid: ax.plot([], [], label=f'Sensor {sid}')[0] for sid in lod.sensors}
+        self.bands = {}
+        self.levels = {}
+        self.elapsed = 0.0  # 直近の描き直しでデータの取得と Artist の更新にかかった時間 [s]
+        self.draw(None, None)
+        ax.relim()
+        ax.autoscale_view()
+        ax.callbacks.connect('xlim_changed', self._on_xlim)
+
+    def draw(self, ms_start, ms_end):
+        start = time.perf_counter()
+        for sid, line in self.lines.items():
+            ms, lo, hi, mean, level = self.lod.query(sid, ms_start, ms_end, self.max_points)
+            if sid in self.bands:
+                self.bands[sid].remove()
+            self.bands[sid] = self.ax.fill_between(ms, lo, hi, color=line.get_color(), alpha=0.3, linewidth=0)
+            line.set_data(ms, mean)
+            self.levels[sid] = level
+        self.elapsed = time.perf_counter() - start
+
+    def _on_xlim(self, ax):
+        self.draw(*ax.get_xlim())
+        ax.figure.canvas.draw_idle()
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description=".vlrec の描画用ピラミッドの作成と性能確認")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_build = sub.add_parser('build', help="記録のピラミッドを作る")
+    p_build.add_argument('path')
+    p_bench = sub.add_parser('bench', help="合成記録でピラミッドを作り、ランダムな範囲の取得時間を測る")
+    p_bench.add_argument('--rows', type=int, default=20_000_000)
+    p_bench.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == 'build':
+        for sid, info in build_lod(args.path).items():
+            print(f"sensor {sid}: {info['rows']} rows, {info['levels']} levels")
+        print(f"{time.perf_counter() - start:.2f} s")
+    else:
+        from analyze_common.recording import RecordingWriter
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'log.vlrec')
+            rng = np.random.default_rng(0)
+            with RecordingWriter(path, block_rows=1 << 20) as writer:
+                for start in range(0, args.rows, 1 << 22):
+                    k = np.arange(start, min(start + (1 << 22), args.rows))
+                    dist = (480 + 30 * np.sin(k / 5000) + rng.normal(0, 2, len(k))).astype(np.float32)
+                    dist[rng.random(len(k)) < 0.005] = np.nan
+                    writer.append_columns('0', 1.75e9 + k * 0.02, k * 20, dist)
+            start = time.perf_counter()
+            lod = open_lod(path)
+            print(f"{args.rows} rows: build {time.perf_counter() - start:.2f} s, "
+                  f"{lod.info['0']['levels']} levels")
+            times = []
+            total = args.rows * 20
+            for _ in range(args.queries):
+                width = total * 10 ** rng.uniform(-6, 0)
+                a = rng.uniform(0, total - width)
+                start = time.perf_counter()
+                ms, lo, hi, mean, level = lod.query('0', a, a + width)
+                times.append(time.perf_counter() - start)
+                assert len(ms) <= 2 * MAX_POINTS
+            times = np.array(times) * 1000
+            print(f"query: median {np.median(times):.2f} ms, max {times.max():.2f} ms ({args.queries} random ranges)")
@@ -0,0 +1,229 @@
+"""ポートを複数プロセスに分散して受信・パースする (多数ボード向け)
+
+各ワーカープロセスは担当ポートを async_ingest.AsyncIngest で受信してパースし、
+結果を共有メモリ上のスロット (slot_rows x 4 の float64 配列) に書き込む。
+メインプロセスへはキュー経由で (ワーカー番号, ポート名, スロット番号, 行数) だけを送り、
+dict や数値行の文字列はプロセス間でやり取りしない。数値にならない行 (`[SP]` ステータス行など) だけは
+(ワーカー番号, ポート名, RAW, 行のリスト) としてそのまま送る。
+
+メイン側がスロットを返さずにワーカーの保持分がポートごとにスロット全部の行数を超えたら、
+そのポートのバッチを受け取るのを止める (async_ingest がポートの読み出しを止める)。
+"""
+import asyncio
+import multiprocessing as mp
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from analyze_common.async_ingest import AsyncIngest
+
+SLOT_ROWS = 4096  # 1スロットの最大サンプル数
+N_SLOTS = 16  # ワーカーごとのスロット数
+FLUSH_INTERVAL = 0.02  # スロットが埋まらなくても送る間隔[s]
+COLUMNS = 4  # milisec, x, y, z
+ERROR = -1  # スロット番号の代わりに送る印: エラーの文字列
+RAW = -2  # スロット番号の代わりに送る印: 数値にならなかった行のリスト
+
+
+def _slots(shm, n_slots, slot_rows):
+    return np.ndarray((n_slots, slot_rows, COLUMNS), dtype=np.float64, buffer=shm.buf)
+
+
+async def _worker_loop(worker_id, specs, slots, free_q, ready_q, stop):
+    ingest = AsyncIngest()
+    pending = {}
+    slot_rows = slots.shape[1]
+    max_pending = slots.shape[0] * slot_rows  # ポートごとに保持する最大行数
+
+    def flush(name):
+        blocks = pending[name]
+        while blocks:
+            try:
+                slot = free_q.get_nowait()
+            except queue.Empty:
+                return  # メイン側が追いつくまで保持する
+            data = np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+            n = min(len(data), slot_rows)
+            slots[slot, :n] = data[:n]
+            ready_q.put((worker_id, name, slot, n))
+            blocks[:] = [data[n:]] if n < len(data) else []
+
+    async def pump(name):
+        rows = 0
+        async for batch in ingest.stream(name):
+            if batch.raw:
+                ready_q.put((worker_id, name, RAW, batch.raw))
+            if len(batch.values):
+                pending[name].append(batch.values)
+                rows += len(batch.values)
+                if rows >= slot_rows:
+                    flush(name)
+                    rows = sum(len(b) for b in pending[name])
+                # メイン側が追いつくまで次のバッチを受け取らない (定期の flush で減るのを待つ)
+                while rows >= max_pending and not stop.is_set():
+                    await asyncio.sleep(FLUSH_INTERVAL)
+                    rows = sum(len(b) for b in pending[name])
+        error = ingest.streams[name].error
+        if error:
+            ready_q.put((worker_id, name, ERROR, error))
+
+    tasks = []
+    for spec in specs:
+        name = spec["name"]
+        pending[name] = []
+        try:
+            if "fd" in spec:
+                ingest.add_fd(name, spec["fd"])
+            else:
+                ingest.add_serial(name, spec["port"], spec.get("baudrate", 115200))
+        except Exception as e:
+            ready_q.put((worker_id, name, ERROR, str(e)))
+            continue
+        tasks.append(asyncio.create_task(pump(name)))
+    try:
+        while not stop.is_set():
+            await asyncio.sleep(FLUSH_INTERVAL)
+            for name in pending:
+                flush(name)
+    finally:
+        ingest.close()
+
+
+def _worker_main(worker_id, specs, shm_name, n_slots, slot_rows, free_q, ready_q, stop):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        asyncio.run(_worker_loop(worker_id, specs, _slots(shm, n_slots, slot_rows), free_q, ready_q, stop))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shm.close()
+
+
+class ProcessIngest:
+    """ポート群をワーカープロセスに分散して受信する
+
+    ports: {"port", "baudrate", "name"} の辞書のリスト (POSIX では {"fd", "name"} も可、fork 時のみ)
+    """
+
+    def __init__(self, ports, workers=None, slot_rows=SLOT_ROWS, n_slots=N_SLOTS):
+        workers = min(workers or os.cpu_count() or 1, len(ports))
+        self.shards = [ports[i::workers] for i in range(workers)]
+        self.slot_rows = slot_rows
+        self.n_slots = n_slots
+        self.errors = {}
+        self.raw = {}  # ポート名 → まだ取り出していない数値にならなかった行
+        self._procs = []
+        self._shms = []
+        self._slots = []
+        self._free_qs = []
+        self._ready_q = mp.Queue()
+        self._stop = mp.Event()
+
+    def start(self):
+        for worker_id, specs in enumerate(self.shards):
+            size = self.n_slots * self.slot_rows * COLUMNS * 8
+            shm = shared_memory.SharedMemory(create=True, size=size)
+            free_q = mp.Queue()
+            for slot in range(self.n_slots):
+                free_q.put(slot)
+            proc = mp.Process(
+                target=_worker_main,
+                args=(worker_id, specs, shm.name, self.n_slots, self.slot_rows, free_q, self._ready_q, self._stop),
+                daemon=True,
+            )
+            proc.start()
+            self._shms.append(shm)
+            self._slots.append(_slots(shm, self.n_slots, self.slot_rows))
+            self._free_qs.append(free_q)
+            self._procs.append(proc)
+        return self
+
+    def get(self, timeout=None):
+        """(ポート名, (n, 4) 配列) を1つ返す。timeout までに何も来なければ None
+
+        数値にならなかった行が届いたときは self.raw[ポート名] に足して、0行の配列を返す。
+        """
+        while True:
+            try:
+                worker_id, name, slot, n = self._ready_q.get(timeout=timeout)
+            except queue.Empty:
+                return None
+            if slot == ERROR:
+                self.errors[name] = n
+                continue
+            if slot == RAW:
+                self.raw.setdefault(name, []).extend(n)
+                return name, np.empty((0, COLUMNS))
+            values = self._slots[worker_id][slot, :n].copy()
+            self._free_qs[worker_id].put(slot)
+            return name, values
+
+    def batches(self, timeout=None):
+        """get() を繰り返す。timeout 内に何も届かなければ終了する"""
+        while True:
+            item = self.get(timeout)
+            if item is None:
+                return
+            yield item
+
+    def close(self):
+        self._stop.set()
+        for proc in self._procs:
+            proc.join(timeout=2)
+            if proc.is_alive():
+                proc.terminate()
+        self._slots.clear()
+        for shm in self._shms:
+            shm.close()
+            shm.unlink()
+        self._shms.clear()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    # ベンチマーク: 16本の os.pipe() を疑似ポートとし、ワーカー数を変えて集計スループットを測る
+    # (fd を子プロセスに引き継ぐため fork が使える POSIX 環境のみ)
+    LINE = b"123456,0.123456,-0.654321,9.806650\n"
+    BLOCK = LINE * 200
+    N_PORTS = 16
+    DURATION = 3.0
+
+    def writer(fds, stop):
+        for fd in fds:
+            os.set_blocking(fd, False)
+        while not stop.is_set():
+            for fd in fds:
+                try:
+                    os.write(fd, BLOCK)
+                except BlockingIOError:
+                    pass
+
+    print(f"cpu_count={os.cpu_count()}, {N_PORTS} ports")
+    print("workers  samples/s")
+    for workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+        pipes = [os.pipe() for _ in range(N_PORTS)]
+        stop = mp.Event()
+        w = mp.Process(target=writer, args=([wfd for _, wfd in pipes], stop), daemon=True)
+        w.start()
+        specs = [{"fd": r, "name": f"port{i}"} for i, (r, _) in enumerate(pipes)]
+        total = 0
+        with ProcessIngest(specs, workers=workers) as ingest:
+            t0 = time.perf_counter()
+            while time.perf_counter() - t0 < DURATION:
+                item = ingest.get(timeout=0.5)
+                if item is not None:
+                    total += len(item[1])
+        stop.set()
+        w.join()
+        for r, wfd in pipes:
+            os.close(r)
+            os.close(wfd)
+        print(f"{workers:7d}  {total / DURATION:10.0f}")
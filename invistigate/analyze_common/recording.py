@@ -0,0 +1,236 @@
+"""VL53L1X 記録用のバイナリ列形式 (.vlrec) と memmap リーダー
+
+log.csv は開くたびに全行を pd.read_csv し直す必要があるため、
+センサーごと・列ごとの固定幅バイナリファイルに分けて記録する。
+
+    log.vlrec/
+        header.json     形式・列の dtype・センサーIDの一覧 (s0, s1, ... の順)
+        index.bin       書き込んだブロックごとの INDEX_DTYPE レコード
+        s0.time.bin     ホストの受信時刻 time.time() [s]  <f8
+        s0.ms.bin       デバイスの ms                     <i8
+        s0.dist.bin     距離 [mm] (タイムアウトは NaN)     <f4
+        s1.time.bin ...
+
+列ファイルはブロック単位で追記するだけなので、記録中に落ちても
+index.bin に載っている行までは読める (行数は index から数える)。
+Recording は各列を np.memmap で開くので、数GBの記録でもすぐ開け、
+プロットした範囲のページだけが読み込まれる。
+
+既存の log.csv (timestamp,sensor_id,ms,distance) は
+`python -m analyze_common.recording log.csv` で変換できる。
+"""
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+FORMAT = 'vlrec'
+VERSION = 1
+COLUMNS = {'time': '<f8', 'ms': '<i8', 'dist': '<f4'}
+INDEX_DTYPE = np.dtype([
+    ('sensor', '<u2'),  # header.json の sensors の位置
+    ('row', '<u8'),  # ブロック先頭の行番号 (センサーごと)
+    ('rows', '<u4'),
+    ('ms_first', '<i8'),
+    ('ms_last', '<i8'),
+    ('time_first', '<f8'),
+    ('time_last', '<f8'),
+])
+BLOCK_ROWS = 4096
+FLUSH_INTERVAL = 1.0  # [s] これより長く溜まったらブロックが小さくても書き出す
+CSV_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _column_path(path, sensor, name):
+    return os.path.join(path, f"s{sensor}.{name}.bin")
+
+
+class RecordingWriter:
+    """センサーごとに行を溜め、BLOCK_ROWS 行ずつ (または FLUSH_INTERVAL ごとに) 列ファイルへ追記する"""
+
+    def __init__(self, path, block_rows=BLOCK_ROWS, flush_interval=FLUSH_INTERVAL):
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.endswith('.bin') or name in ('header.json', 'lod.json'):  # 古い記録のピラミッド (lod) も消す
+                os.remove(os.path.join(path, name))
+        self.path = path
+        self.block_rows = block_rows
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        self.sensors = []  # センサーID (文字列) の一覧。位置がファイル名の s{n}
+        self.rows = []  # センサーごとの書き込み済み行数
+        self._files = []
+        self._pending = []  # センサーごとの未書き込みの (time, ms, dist)
+        self._slot = {}
+        self._index = open(os.path.join(path, 'index.bin'), 'ab')
+        self._write_header()
+
+    def _write_header(self):
+        header = {'format': FORMAT, 'version': VERSION, 'columns': COLUMNS, 'sensors': self.sensors}
+        tmp = os.path.join(self.path, 'header.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(header, f)
+        os.replace(tmp, os.path.join(self.path, 'header.json'))
+
+    def _add_sensor(self, sensor_id):
+        n = len(self.sensors)
+        self._slot[sensor_id] = n
+        self.sensors.append(sensor_id)
+        self.rows.append(0)
+        self._pending.append([])
+        self._files.append({name: open(_column_path(self.path, n, name), 'ab') for name in COLUMNS})
+        self._write_header()
+        return n
+
+    def writerows(self, rows):
+        """log.csv と同じ並びの (time.time(), sensor_id, ms, distance) を追加する (distance は 'NULL'/None 可)"""
+        for t, sensor_id, ms, dist in rows:
+            n = self._slot.get(sensor_id)
+            if n is None:
+                n = self._add_sensor(sensor_id)
+            pending = self._pending[n]
+            pending.append((t, ms, math.nan if dist is None or dist == 'NULL' else float(dist)))
+            if len(pending) >= self.block_rows:
+                self._write_pending(n)
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def append_columns(self, sensor_id, t, ms, dist):
+        """1センサー分の列 (同じ長さの配列) をまとめて追記する"""
+        n = self._slot.get(sensor_id)
+        if n is None:
+            n = self._add_sensor(sensor_id)
+        self._write_pending(n)
+        for start in range(0, len(ms), self.block_rows):
+            end = start + self.block_rows
+            self._write_block(n, t[start:end], ms[start:end], dist[start:end])
+
+    def _write_pending(self, n):
+        pending = self._pending[n]
+        if pending:
+            t, ms, dist = zip(*pending)
+            self._pending[n] = []
+            self._write_block(n, t, ms, dist)
+
+    def _write_block(self, n, t, ms, dist):
+        cols = {
+            'time': np.asarray(t, dtype=COLUMNS['time']),
+            'ms': np.asarray(ms, dtype=COLUMNS['ms']),
+            'dist': np.asarray(dist, dtype=COLUMNS['dist']),
+        }
+        for name, values in cols.items():
+            self._files[n][name].write(values.tobytes())
+        entry = np.array([(n, self.rows[n], len(cols['ms']), cols['ms'][0], cols['ms'][-1],
+                           cols['time'][0], cols['time'][-1])], dtype=INDEX_DTYPE)
+        # 列を書いてから index に載せる (index にある行は必ず列ファイルにある)
+        for f in self._files[n].values():
+            f.flush()
+        self._index.write(entry.tobytes())
+        self._index.flush()
+        self.rows[n] += len(cols['ms'])
+
+    def flush(self):
+        for n in range(len(self.sensors)):
+            self._write_pending(n)
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        for files in self._files:
+            for f in files.values():
+                f.close()
+        self._index.close()
+        self._write_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Recording:
+    """.vlrec を開き、センサーごとの列を np.memmap で返す"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'header.json'), encoding='utf-8') as f:
+            header = json.load(f)
+        if header.get('format') != FORMAT:
+            raise ValueError(f"{path} is not a {FORMAT} recording")
+        self.columns = header['columns']
+        self.sensors = header['sensors']
+        self.index = np.fromfile(os.path.join(path, 'index.bin'), dtype=INDEX_DTYPE)
+        counts = np.bincount(self.index['sensor'], weights=self.index['rows'], minlength=len(self.sensors))
+        self.rows = {sid: int(c) for sid, c in zip(self.sensors, counts)}
+        self._slot = {sid: n for n, sid in enumerate(self.sensors)}
+        self._maps = {}
+
+    def __len__(self):
+        return sum(self.rows.values())
+
+    def column(self, sensor_id, name):
+        """センサー sensor_id の列 name ('time', 'ms', 'dist') を読み取り専用の memmap で返す"""
+        key = (sensor_id, name)
+        if key not in self._maps:
+            n = self._slot[sensor_id]
+            rows = self.rows[sensor_id]
+            if rows == 0:
+                self._maps[key] = np.empty(0, dtype=self.columns[name])
+            else:
+                self._maps[key] = np.memmap(_column_path(self.path, n, name), dtype=self.columns[name],
+                                            mode='r', shape=(rows,))
+        return self._maps[key]
+
+    def sensor(self, sensor_id):
+        """(time, ms, dist) の memmap を返す"""
+        return tuple(self.column(sensor_id, name) for name in COLUMNS)
+
+    def ms_range(self, sensor_id, ms_start, ms_end):
+        """ms_start <= ms < ms_end の行の slice (ms はセンサーごとに昇順の前提)"""
+        ms = self.column(sensor_id, 'ms')
+        return slice(int(np.searchsorted(ms, ms_start)), int(np.searchsorted(ms, ms_end)))
+
+
+def csv_time_to_epoch(stamps, fmt=CSV_TIME_FORMAT):
+    """log.csv の timestamp 列 (ローカル時刻の文字列) を time.time() と同じ秒に変換する
+
+    同じ秒の文字列が並ぶので、変換は重複を除いた値にだけ行う。
+    """
+    uniques, inverse = np.unique(np.asarray(stamps, dtype=str), return_inverse=True)
+    epoch = np.array([time.mktime(time.strptime(s, fmt)) for s in uniques], dtype=np.float64)
+    return epoch[inverse]
+
+
+def convert_csv(csv_path, out_path, chunksize=1_000_000):
+    """log.csv (timestamp,sensor_id,ms,distance) を .vlrec に変換し、行数を返す"""
+    import pandas as pd
+
+    total = 0
+    with RecordingWriter(out_path) as writer:
+        reader = pd.read_csv(csv_path, encoding='utf-8', dtype={'sensor_id': str}, chunksize=chunksize)
+        for chunk in reader:
+            t = csv_time_to_epoch(chunk['timestamp'].to_numpy())
+            ms = chunk['ms'].to_numpy()
+            dist = pd.to_numeric(chunk['distance'], errors='coerce').to_numpy()  # NULL は NaN
+            sid = chunk['sensor_id'].to_numpy()
+            for sensor_id in pd.unique(sid):
+                mask = sid == sensor_id
+                writer.append_columns(sensor_id, t[mask], ms[mask], dist[mask])
+            total += len(chunk)
+    return total
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="log.csv を .vlrec 形式に変換する")
+    parser.add_argument('csv', help="変換元の log.csv")
+    parser.add_argument('out', nargs='?', help="出力先 (省略時は拡張子を .vlrec にしたパス)")
+    args = parser.parse_args()
+    out = args.out or os.path.splitext(args.csv)[0] + '.vlrec'
+    start = time.perf_counter()
+    rows = convert_csv(args.csv, out)
+    print(f"{args.csv} -> {out}: {rows} rows in {time.perf_counter() - start:.2f} s")
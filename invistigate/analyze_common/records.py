@@ -0,0 +1,186 @@
+"""analyze 系スクリプト共通のサンプル型と履歴バッファ
+
+1サンプルは __slots__ 付きのクラス (dict や文字列のタプルより小さく、属性名で読める)。
+長時間の履歴は SampleHistory に入れる。列ごとの array('d') のリングバッファなので
+1サンプルあたり 8バイト x 列数 で保持でき、数分ぶんのデータも溜められる。
+"""
+import math
+from array import array
+
+import numpy as np
+
+
+class ImuSample:
+    """BNO08x の milisec,x,y,z (加速度など3軸の値)"""
+    __slots__ = ('milisec', 'x', 'y', 'z')
+    FIELDS = __slots__
+
+    def __init__(self, milisec, x, y, z):
+        self.milisec = milisec
+        self.x = x
+        self.y = y
+        self.z = z
+
+    @classmethod
+    def from_parts(cls, parts):
+        """'milisec,x,y,z' を split(',') したものから作る (不正なら ValueError)"""
+        if len(parts) != 4:
+            raise ValueError(f"expected 4 fields, got {len(parts)}")
+        return cls(*map(float, parts))
+
+    def __iter__(self):
+        return iter((self.milisec, self.x, self.y, self.z))
+
+    def __repr__(self):
+        return f"ImuSample(milisec={self.milisec}, x={self.x}, y={self.y}, z={self.z})"
+
+
+class QuatSample:
+    """回転ベクトル (クォータニオン i, j, k, real) とタイムスタンプ"""
+    __slots__ = ('timestamp', 'i', 'j', 'k', 'real')
+    FIELDS = __slots__
+
+    def __init__(self, timestamp, i, j, k, real):
+        self.timestamp = timestamp
+        self.i = i
+        self.j = j
+        self.k = k
+        self.real = real
+
+    def __iter__(self):
+        return iter((self.timestamp, self.i, self.j, self.k, self.real))
+
+    def __repr__(self):
+        return f"QuatSample(timestamp={self.timestamp}, i={self.i}, j={self.j}, k={self.k}, real={self.real})"
+
+
+class RangeSample:
+    """VL53L1X の id,ms,dist。タイムアウト (NULL) のときは dist が None"""
+    __slots__ = ('sensor_id', 'ms', 'dist')
+    FIELDS = ('ms', 'dist')  # 履歴に保存する数値列
+
+    def __init__(self, sensor_id, ms, dist):
+        self.sensor_id = sensor_id
+        self.ms = ms
+        self.dist = dist
+
+    @classmethod
+    def from_parts(cls, parts):
+        """'id,ms,dist|NULL' を split(',') したものから作る (不正なら ValueError)"""
+        if len(parts) != 3:
+            raise ValueError(f"expected 3 fields, got {len(parts)}")
+        sensor_id, ms, dist = parts
+        return cls(sensor_id, int(ms), None if dist == 'NULL' else float(dist))
+
+    @property
+    def timeout(self):
+        return self.dist is None
+
+    def __iter__(self):
+        # 履歴用の数値列 (タイムアウトは NaN)
+        return iter((self.ms, math.nan if self.dist is None else self.dist))
+
+    def __repr__(self):
+        return f"RangeSample(sensor_id={self.sensor_id!r}, ms={self.ms}, dist={self.dist})"
+
+
+class SampleHistory:
+    """固定長の履歴 (列ごとの array('d') によるリングバッファ)"""
+
+    def __init__(self, fields, capacity):
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self._data = array('d', bytes(8 * capacity * len(self.fields)))
+        self._view = np.frombuffer(self._data, dtype=np.float64).reshape(capacity, len(self.fields))
+        self._pos = 0  # 次に書き込む行
+        self._count = 0
+
+    @classmethod
+    def for_type(cls, sample_type, capacity):
+        """ImuSample などのサンプル型に合わせた列で作る"""
+        return cls(sample_type.FIELDS, capacity)
+
+    def __len__(self):
+        return self._count
+
+    def append(self, sample):
+        """サンプル (ImuSample など、または数値のタプル) を1つ追加する"""
+        ncol = len(self.fields)
+        base = self._pos * ncol
+        self._data[base:base + ncol] = array('d', sample)
+        self._pos = (self._pos + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def extend(self, values):
+        """(n, 列数) の配列をまとめて追加する"""
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) >= self.capacity:
+            values = values[-self.capacity:]
+        n = len(values)
+        first = min(n, self.capacity - self._pos)
+        self._view[self._pos:self._pos + first] = values[:first]
+        self._view[:n - first] = values[first:]
+        self._pos = (self._pos + n) % self.capacity
+        self._count = min(self._count + n, self.capacity)
+
+    def values(self):
+        """古い順に並べた (n, 列数) 配列 (コピー)"""
+        if self._count < self.capacity:
+            return self._view[:self._count].copy()
+        return np.concatenate((self._view[self._pos:], self._view[:self._pos]))
+
+    def column(self, name):
+        """列 name を古い順に並べた配列 (コピー)"""
+        col = self.fields.index(name)
+        if self._count < self.capacity:
+            return self._view[:self._count, col].copy()
+        return np.concatenate((self._view[self._pos:, col], self._view[:self._pos, col]))
+
+    def latest(self):
+        """最新の行 (数値のタプル)。空なら None"""
+        if self._count == 0:
+            return None
+        return tuple(self._view[(self._pos - 1) % self.capacity].tolist())
+
+    def nbytes(self):
+        return self._view.nbytes
+
+
+if __name__ == "__main__":
+    import tracemalloc
+
+    # 1サンプルあたりのメモリ: dict / 文字列タプル / __slots__ / 履歴バッファ
+    N = 100_000
+
+    def measure(make):
+        tracemalloc.start()
+        kept = make()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del kept
+        return current / N
+
+    dict_bytes = measure(lambda: [{'name': 'BNO08x_1', 'milisec': float(i), 'x': 0.1 * i, 'y': 0.2 * i, 'z': 0.3 * i}
+                                  for i in range(N)])
+    tuple_bytes = measure(lambda: [(str(i), str(i % 1300)) for i in range(N)])
+    slots_bytes = measure(lambda: [ImuSample(float(i), 0.1 * i, 0.2 * i, 0.3 * i) for i in range(N)])
+
+    def fill_history():
+        h = SampleHistory.for_type(ImuSample, N)
+        for i in range(N):
+            h.append((float(i), 0.1 * i, 0.2 * i, 0.3 * i))
+        return h
+
+    history_bytes = measure(fill_history)
+    print(f"dict per IMU sample      : {dict_bytes:6.1f} bytes")
+    print(f"(ms, dist) string tuple  : {tuple_bytes:6.1f} bytes")
+    print(f"ImuSample (__slots__)    : {slots_bytes:6.1f} bytes")
+    print(f"SampleHistory (IMU)      : {history_bytes:6.1f} bytes")
+
+    h = SampleHistory.for_type(RangeSample, 5)
+    for i in range(7):
+        h.append(RangeSample('0', i, None if i == 3 else 100 + i))
+    assert h.column('ms').tolist() == [2, 3, 4, 5, 6]
+    assert math.isnan(h.column('dist')[1])
+    h.extend(np.array([[7, 107], [8, 108]]))
+    assert h.column('ms').tolist() == [4, 5, 6, 7, 8] and h.latest() == (8.0, 108.0)
@@ -0,0 +1,250 @@
+"""ヘッダー付き固定長フレームの切り出し (リングバッファ)
+
+受信データは事前確保した bytearray に ser.readinto() で直接書き込み、
+フレームは memoryview のスライスとして返す。従来の
+`buffer += ser.read(...)` / `buffer = buffer[pos:]` のような
+バッファ全体のコピーは発生しない。
+
+バッファ末尾に空きがなくなったときだけ、未処理の端数 (通常は1フレーム未満)
+を先頭へ移す (ラップアラウンドの代わり)。フレームが途中で折り返さないので
+1フレームは必ず連続した memoryview で参照できる。
+"""
+
+HEADER = b'\xAA\x55'
+FRAME_LEN = 2 + 14 * 4 + 2  # HEADER(2) + 14 floats(56) + CRC16(2) = 60バイト
+
+
+class RingFramer:
+    def __init__(self, header=HEADER, frame_len=FRAME_LEN, capacity=64 * 1024, check=None):
+        """check: フレーム(memoryview)を受け取り True/False を返す関数 (CRC検証など)
+
+        False のフレームはヘッダーの誤検出とみなし、1バイト進めて再同期する。
+        """
+        if capacity < 2 * frame_len:
+            raise ValueError("capacity must be at least 2 * frame_len")
+        self.header = header
+        self.frame_len = frame_len
+        self.check = check
+        self.buf = bytearray(capacity)
+        self.view = memoryview(self.buf)
+        self.start = 0  # 未処理データの先頭
+        self.end = 0  # 次の書き込み位置
+        self.frames_ok = 0
+        self.frames_bad = 0
+        self.bytes_skipped = 0  # ヘッダー探索で読み捨てたバイト数
+
+    def __len__(self):
+        return self.end - self.start
+
+    def _writable(self, want):
+        """書き込み可能な領域を memoryview で返す (必要なら端数を先頭へ移す)"""
+        capacity = len(self.buf)
+        if capacity - self.end < want and self.start > 0:
+            n = self.end - self.start
+            if n <= self.start:
+                # 移動元と移動先が重ならないのでそのままコピーできる
+                self.buf[:n] = self.view[self.start:self.end]
+            else:
+                self.buf[:n] = bytes(self.view[self.start:self.end])
+            self.start = 0
+            self.end = n
+        return self.view[self.end:min(capacity, self.end + want)]
+
+    def fill(self, ser):
+        """ser.readinto() で受信済みデータをバッファへ直接読み込む"""
+        target = self._writable(max(ser.in_waiting, 1))
+        n = ser.readinto(target) or 0
+        self.end += n
+        return n
+
+    def feed(self, data):
+        """bytes 等を追加する (リプレイや検証用)。容量を超える分は複数回に分けて呼ぶこと"""
+        n = len(data)
+        target = self._writable(n)
+        if len(target) < n:
+            raise BufferError(f"framer buffer full ({len(self)} bytes pending)")
+        target[:n] = data
+        self.end += n
+
+    def frames(self):
+        """揃ったフレームを memoryview で順に返す
+
+        返した memoryview は次の fill()/feed() で上書きされるため、
+        保持する場合は bytes() でコピーすること。
+        """
+        buf = self.buf
+        header = self.header
+        frame_len = self.frame_len
+        check = self.check
+        while True:
+            pos = buf.find(header, self.start, self.end)
+            if pos == -1:
+                # ヘッダーの1バイト目だけが末尾にある可能性を残して読み捨てる
+                keep = len(header) - 1
+                new_start = max(self.start, self.end - keep)
+                self.bytes_skipped += new_start - self.start
+                self.start = new_start
+                return
+            self.bytes_skipped += pos - self.start
+            self.start = pos
+            if self.end - pos < frame_len:
+                # フレーム全体が揃うまで待つ
+                return
+            frame = self.view[pos:pos + frame_len]
+            if check is not None and not check(frame):
+                self.frames_bad += 1
+                self.start = pos + 1
+                continue
+            self.start = pos + frame_len
+            self.frames_ok += 1
+            yield frame
+
+    def runs(self):
+        """ヘッダーが frame_len 間隔で連続している区間を1つの memoryview で返す
+
+        まとめてデコード (bno_frames.decode_frames など) するためのもので、
+        区間内のCRC検証はデコーダ側で一括して行う。区間に入れるフレームは
+        次の frame_len 先にもヘッダーがあるもの (フレームの切れ目が確かめられたもの) だけで、
+        途中切れのフレームはその先がヘッダーにならないので区間がそこで切れる。
+        区間の先頭のフレームで切れ目を確かめられないもの (ヘッダーの誤検出・途中切れ・次がまだ届いていない) は
+            check あり  frames() と同じく check を1つだけかけ、False なら1バイト進めて再同期する
+            check なし  次のフレームが届くまで待つ。届いてもヘッダーでなければそのフレームだけを
+                        区間として返し (CRC はデコーダで判定)、1バイト先から再同期する
+        どちらでも途中切れのフレームに重なった次のフレームは frames() と同じく拾い直せる。
+        check なしでは最後のフレームは次のフレームが届くまで返さない。
+        """
+        buf = self.buf
+        header = self.header
+        hlen = len(header)
+        frame_len = self.frame_len
+        check = self.check
+        while True:
+            pos = buf.find(header, self.start, self.end)
+            if pos == -1:
+                keep = hlen - 1
+                new_start = max(self.start, self.end - keep)
+                self.bytes_skipped += new_start - self.start
+                self.start = new_start
+                return
+            self.bytes_skipped += pos - self.start
+            self.start = pos
+            if self.end - pos < frame_len:
+                return
+            stop = pos + frame_len
+            if not (stop + hlen <= self.end and buf[stop:stop + hlen] == header):
+                frame = self.view[pos:stop]
+                if check is None:
+                    if stop + hlen > self.end:
+                        return  # 切れ目を確かめられるまで待つ
+                    self.start = pos + 1
+                    yield frame
+                    continue
+                if not check(frame):
+                    self.frames_bad += 1
+                    self.start = pos + 1
+                    continue
+            # stop のフレームは、その次の切れ目にもヘッダーがあるときだけ区間に入れる
+            while (stop + frame_len + hlen <= self.end and buf[stop:stop + hlen] == header
+                   and buf[stop + frame_len:stop + frame_len + hlen] == header):
+                stop += frame_len
+            self.start = stop
+            self.frames_ok += (stop - pos) // frame_len
+            yield self.view[pos:stop]
+
+
+if __name__ == "__main__":
+    # ストレステスト: ゴミを挟んだ連続フレームを任意の位置で分割して流し込む
+    import random
+    import struct
+    import time
+
+    from analyze_common.crc16 import crc16_ccitt
+
+    rng = random.Random(1234)
+
+    def make_frame(i):
+        payload = struct.pack('<14f', *[float(i + k) for k in range(14)])
+        return HEADER + payload + struct.pack('<H', crc16_ccitt(payload))
+
+    def crc_ok(frame):
+        return crc16_ccitt(frame[2:-2]) == frame[-2] | (frame[-1] << 8)
+
+    class FakeSerial:
+        """readinto() をランダムな長さで返す疑似シリアルポート"""
+        def __init__(self, data):
+            self.data = memoryview(data)
+            self.pos = 0
+
+        @property
+        def in_waiting(self):
+            return min(rng.randint(0, 4096), len(self.data) - self.pos)
+
+        def readinto(self, b):
+            n = min(len(b), len(self.data) - self.pos)
+            b[:n] = self.data[self.pos:self.pos + n]
+            self.pos += n
+            return n
+
+    stream = bytearray()
+    expected = []
+    i = 0
+    while len(stream) < 8 * 1024 * 1024:
+        r = rng.random()
+        if r < 0.05:
+            # ゴミ (偽ヘッダーを含むこともある)
+            garbage = bytes(rng.getrandbits(8) for _ in range(rng.randint(1, 80)))
+            stream += garbage + (HEADER if r < 0.01 else b'')
+        elif r < 0.07:
+            # 途中で切れたフレーム
+            stream += make_frame(-1)[:rng.randint(1, FRAME_LEN - 1)]
+        else:
+            stream += make_frame(i)
+            expected.append(i)
+            i += 1
+
+    framer = RingFramer(check=crc_ok)
+    ser = FakeSerial(bytes(stream))
+    got = []
+    t0 = time.perf_counter()
+    while ser.pos < len(stream):
+        framer.fill(ser)
+        for frame in framer.frames():
+            got.append(int(struct.unpack_from('<f', frame, 2)[0]))
+    elapsed = time.perf_counter() - t0
+
+    # 切れ端と重なったフレームもCRC不一致→1バイト再同期で拾い直せる (偶然のCRC一致分だけ許容)
+    missing = set(expected) - set(got)
+    assert set(got) <= set(expected), "decoded a frame that was never sent"
+    assert got == sorted(got), "frames out of order"
+    assert len(missing) <= len(expected) * 0.03, f"too many frames lost: {len(missing)}"
+    print(f"{len(stream) / 1e6:.1f} MB, {len(got)}/{len(expected)} frames, "
+          f"{framer.frames_bad} bad, {framer.bytes_skipped} bytes skipped, "
+          f"{len(stream) / elapsed / 1e6:.1f} MB/s")
+
+    # runs() + 一括デコードでも同じフレーム列が得られること
+    from analyze_common.bno_frames import decode_frames
+
+    framer = RingFramer(check=crc_ok)
+    ser = FakeSerial(bytes(stream))
+    got_runs = []
+    while ser.pos < len(stream):
+        framer.fill(ser)
+        for run in framer.runs():
+            frames, _ = decode_frames(run)
+            got_runs.extend(frames['timestamp'].astype(int).tolist())
+    # 途中切れフレームに重なった正常フレームも frames() と同じく拾い直せる
+    assert got_runs == got, f"runs() lost {len(got) - len(got_runs)} frames"
+    print(f"runs(): {len(got_runs)}/{len(got)} frames, same as frames()")
+
+    # check なし (CRC はデコーダだけで判定): 最後に残る1フレームを除いて同じ
+    framer = RingFramer()
+    ser = FakeSerial(bytes(stream))
+    got_nocheck = []
+    while ser.pos < len(stream):
+        framer.fill(ser)
+        for run in framer.runs():
+            frames, _ = decode_frames(run)
+            got_nocheck.extend(frames['timestamp'].astype(int).tolist())
+    assert got_nocheck == got[:len(got_nocheck)] and len(got) - len(got_nocheck) <= 1, \
+        f"runs() without check lost {len(got) - len(got_nocheck)} frames"
+    print(f"runs() without check: {len(got_nocheck)}/{len(got)} frames")
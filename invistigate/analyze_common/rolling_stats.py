@@ -0,0 +1,216 @@
+"""直近 N サンプル / T 秒の平均・分散・最小・最大を1サンプル O(1) で更新する窓
+
+TUI の表示は最新の値と1秒ごとの受信数だけで、ノイズの大きさを見るには
+履歴 (SampleHistory) を毎回読み直して平均や標準偏差を計算する必要があった。
+deprecated/serial_console_TUI_angle_average.py の移動平均も、角度を出すたびに deque を sum() していた。
+
+RollingStats は確保済みの NumPy のリングバッファに窓の中のサンプルを持ち、
+    平均・分散  窓に入る値・出る値で合計と2乗和を足し引きする
+                (桁落ちを避けるため基準値を引いた値で持ち、capacity 回ごとに合計を取り直す)
+    最小・最大  単調な deque (窓の中で、後から来た値に抜かれない候補だけを残す)
+で更新するので、窓の長さによらず1サンプルの追加も値の参照も定数時間。
+
+NaN (タイムアウト) は窓に入れない。窓は「直近 capacity 個の有効な値」で、
+window_ms を渡すとさらに最新の ms から window_ms 以内 ((ms - window_ms, ms]) の値に絞る。
+
+    stats = RollingStats(250, window_ms=1000)
+    stats.push(sample.ms, sample.dist)
+    stats.mean, stats.std, stats.min, stats.max
+
+    python -m analyze_common.rolling_stats --rows 200000 --window 250
+"""
+import collections
+import math
+
+import numpy as np
+
+
+class RollingStats:
+    """1系列分の窓。capacity: 窓に入れる最大のサンプル数、window_ms: 窓の時間幅 [ms] (省略時は数だけ)"""
+
+    def __init__(self, capacity, window_ms=None):
+        if capacity < 1:
+            raise ValueError(f"capacity must be >= 1, got {capacity}")
+        self.capacity = capacity
+        self.window_ms = window_ms
+        self._ms = np.zeros(capacity)
+        self._val = np.zeros(capacity)
+        self.clear()
+
+    def clear(self):
+        """窓を空にする"""
+        self._seq = 0  # 次に入れるサンプルの通し番号 (バッファの位置は seq % capacity)
+        self._count = 0
+        self._shift = 0.0  # 合計・2乗和はこの値を引いて持つ
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self._since_resum = 0
+        self._min = collections.deque()  # (通し番号, 値) の単調増加列
+        self._max = collections.deque()  # (通し番号, 値) の単調減少列
+
+    def __len__(self):
+        return self._count
+
+    def _drop_oldest(self):
+        oldest = self._seq - self._count
+        d = self._val[oldest % self.capacity] - self._shift
+        self._sum -= d
+        self._sumsq -= d * d
+        self._count -= 1
+        if self._min[0][0] == oldest:
+            self._min.popleft()
+        if self._max[0][0] == oldest:
+            self._max.popleft()
+
+    def _resum(self):
+        """丸め誤差がたまらないよう、窓の中の値から合計・2乗和を取り直す (capacity 回に1回なので償却 O(1))"""
+        values = self.values()
+        self._shift = float(values.mean()) if len(values) else 0.0
+        d = values - self._shift
+        self._sum = float(d.sum())
+        self._sumsq = float(d @ d)
+        self._since_resum = 0
+
+    def push(self, ms, value):
+        """サンプルを1つ入れる。ms が戻ったら窓を空にしてから入れる
+
+        value が None / NaN なら窓には入れず、window_ms より古いサンプルを落とすだけ。
+        """
+        if value is None or value != value:
+            self.expire(ms)
+            return
+        if self._count and ms < self._ms[(self._seq - 1) % self.capacity]:
+            self.clear()
+        if self._count == self.capacity:
+            self._drop_oldest()
+        if self._count == 0:
+            self._shift = value
+        pos = self._seq % self.capacity
+        self._ms[pos] = ms
+        self._val[pos] = value
+        d = value - self._shift
+        self._sum += d
+        self._sumsq += d * d
+        self._count += 1
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((self._seq, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((self._seq, value))
+        self._seq += 1
+        if self.window_ms is not None:
+            self.expire(ms)
+        self._since_resum += 1
+        if self._since_resum >= self.capacity:
+            self._resum()
+
+    def extend(self, ms, values):
+        """(n,) の ms と値をまとめて入れる"""
+        for m, v in zip(np.asarray(ms, dtype=np.float64).tolist(), np.asarray(values, dtype=np.float64).tolist()):
+            self.push(m, v)
+
+    def expire(self, now_ms):
+        """window_ms より古くなったサンプルを落とす (新しいサンプルが来ないときの表示更新用)"""
+        if self.window_ms is None:
+            return
+        while self._count and now_ms - self._ms[(self._seq - self._count) % self.capacity] >= self.window_ms:
+            self._drop_oldest()
+
+    @property
+    def mean(self):
+        return self._shift + self._sum / self._count if self._count else math.nan
+
+    @property
+    def var(self):
+        """分散 (ddof=0)"""
+        if not self._count:
+            return math.nan
+        m = self._sum / self._count
+        return max(self._sumsq / self._count - m * m, 0.0)
+
+    @property
+    def std(self):
+        return math.sqrt(self.var)
+
+    @property
+    def min(self):
+        return self._min[0][1] if self._count else math.nan
+
+    @property
+    def max(self):
+        return self._max[0][1] if self._count else math.nan
+
+    def summary(self):
+        """(サンプル数, 平均, 標準偏差, 最小, 最大)"""
+        return self._count, self.mean, self.std, self.min, self.max
+
+    def values(self):
+        """窓の中の値を古い順に並べた配列 (コピー)"""
+        start = (self._seq - self._count) % self.capacity
+        idx = (start + np.arange(self._count)) % self.capacity
+        return self._val[idx]
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="1サンプルごとに履歴を読み直して統計を出す場合と比べる")
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--window', type=int, default=250, help="窓のサンプル数 (50 Hz で5秒)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    ms = np.cumsum(20 + rng.integers(-2, 3, args.rows)).astype(np.float64)
+    dist = 480 + 30 * np.sin(ms / 3000) + rng.normal(0, 2, args.rows)
+    dist[rng.random(args.rows) < 0.01] = np.nan
+    rows = list(zip(ms.tolist(), dist.tolist()))
+
+    # 変更前の方法: 受信するたびに履歴の直近 window 個を読み直して統計を出す
+    from analyze_common.records import SampleHistory
+
+    history = SampleHistory(('ms', 'dist'), args.window)
+    start = time.perf_counter()
+    for m, v in rows:
+        if v == v:
+            history.append((m, v))
+        x = history.column('dist')
+        if len(x):
+            ref_last = (len(x), x.mean(), x.std(), x.min(), x.max())
+    rescan = time.perf_counter() - start
+
+    stats = RollingStats(args.window)
+    start = time.perf_counter()
+    for m, v in rows:
+        stats.push(m, v)
+        stats.summary()
+    rolling = time.perf_counter() - start
+    assert np.allclose(stats.summary(), ref_last)
+
+    # 窓ごとの値を pandas の rolling と比べる (数の窓と時間の窓)
+    import pandas as pd
+
+    valid = ~np.isnan(dist)
+    s = pd.Series(dist[valid])
+    ref = {'mean': s.rolling(args.window, min_periods=1).mean(), 'std': s.rolling(args.window, min_periods=1).std(ddof=0),
+           'min': s.rolling(args.window, min_periods=1).min(), 'max': s.rolling(args.window, min_periods=1).max()}
+    window_ms = args.window * 20 / 5
+    st = pd.Series(dist[valid], index=pd.to_datetime(ms[valid], unit='ms'))
+    ref_t = {'mean': st.rolling(f'{window_ms:.0f}ms').mean(), 'std': st.rolling(f'{window_ms:.0f}ms').std(ddof=0),
+             'min': st.rolling(f'{window_ms:.0f}ms').min(), 'max': st.rolling(f'{window_ms:.0f}ms').max()}
+    for name, (r, kw) in {'count': (ref, {}), 'time': (ref_t, {'window_ms': window_ms})}.items():
+        stats = RollingStats(args.window, **kw)
+        got = {k: [] for k in r}
+        for m, v in zip(ms[valid].tolist(), dist[valid].tolist()):
+            stats.push(m, v)
+            for k in got:
+                got[k].append(getattr(stats, k))
+        for k in got:
+            assert np.allclose(got[k], r[k].to_numpy(), atol=1e-9), (name, k)
+
+    n = len(rows)
+    print(f"{n} samples, window {args.window} samples")
+    print(f"rescan history per sample: {rescan:.2f} s ({n / rescan / 1e3:.0f} k samples/s)")
+    print(f"RollingStats             : {rolling:.2f} s ({n / rolling / 1e3:.0f} k samples/s), "
+          f"{rescan / rolling:.1f}x faster, same as pandas rolling (count and {window_ms:.0f} ms windows)")
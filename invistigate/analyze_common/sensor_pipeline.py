@@ -0,0 +1,248 @@
+"""距離記録のセンサーごとの解析 (サンプリング周波数・ローパス・スペクトル)
+
+graph_viewer は時系列の図とスペクトルの図のそれぞれで、センサーごとに
+DataFrame の抽出・並べ替え・diff().mean()・butter+filtfilt をやり直していた。
+ここでは記録を1回の並べ替えでセンサーごとに分け、SensorAnalysis が
+周期・周波数・フィルタ後の系列・スペクトルを初めて使うときに1回だけ計算して持つ。
+フィルタの設計は (order, cutoff, fs) ごとに lowpass_design() が覚えておく。
+
+    from analyze_common.sensor_pipeline import load_sensors, analyze
+    results = analyze(load_sensors(base_dir), cutoff=0.2, order=1)
+    results['0'].freq, results['0'].filtered, results['0'].spectrum
+
+resample=True にすると、先に resample.resample_sensors() で全センサーを
+共通の均一な格子 (ms の揺らぎを除き、欠測は NaN) に揃えてから計算する。
+"""
+import functools
+import os
+import warnings
+
+import numpy as np
+from numpy.fft import rfft, rfftfreq
+from scipy.signal import butter, filtfilt
+
+
+@functools.lru_cache(maxsize=None)
+def lowpass_design(order, cutoff, fs):
+    """butter のローパス係数 (b, a)。同じ (order, cutoff, fs) は設計し直さない"""
+    nyq = 0.5 * fs
+    normal_cutoff = min(cutoff / nyq, 0.99)  # 正常化カットオフは1未満
+    return butter(order, normal_cutoff, btype='low', analog=False)
+
+
+def lowpass_sos(order, cutoff, fs):
+    """lowpass_design() と同じ設計の2次セクション (sosfilt / sosfiltfilt 用)"""
+    from analyze_common.filter_bank import butter_sos
+
+    return butter_sos(order, cutoff, fs)
+
+
+def lowpass_filter(data, cutoff, fs, order=2):
+    b, a = lowpass_design(order, float(cutoff), float(fs))
+    return filtfilt(b, a, data)
+
+
+def hold_gaps(data):
+    """NaN を直前の有効な値で埋める (先頭の NaN は最初の有効な値)
+
+    chunked_filter (hold_nan=True) と filter_bank.SosFilterBank と同じ欠測の扱い。
+    """
+    data = np.asarray(data, dtype=float)
+    gaps = np.isnan(data)
+    if gaps.all():
+        raise ValueError("no valid samples")
+    if not gaps.any():
+        return data
+    idx = np.where(gaps, 0, np.arange(1, len(data) + 1))
+    np.maximum.accumulate(idx, out=idx)
+    return np.concatenate(([data[np.argmin(gaps)]], data))[idx]
+
+
+def lowpass_filter_gaps(data, cutoff, fs, order=2):
+    """NaN (タイムアウト・欠測) を hold_gaps() で埋めてから lowpass_filter し、結果の同じ位置を NaN に戻す"""
+    gaps = np.isnan(np.asarray(data, dtype=float))
+    filtered = lowpass_filter(hold_gaps(data), cutoff, fs, order)
+    filtered[gaps] = np.nan
+    return filtered
+
+
+def group_sensors(sensor_id, ms, distance):
+    """行ごとの配列をセンサーIDごとの ms 順の (ms, distance) に分ける (並べ替えは1回)"""
+    sensor_id = np.asarray(sensor_id)
+    ms = np.asarray(ms)
+    distance = np.asarray(distance, dtype=float)
+    order = np.argsort(sensor_id, kind='stable')  # センサー内は記録順のまま
+    keys, starts = np.unique(sensor_id[order], return_index=True)
+    sensors = {}
+    for sid, idx in zip(keys.tolist(), np.split(order, starts[1:])):
+        sms = ms[idx]
+        if np.any(sms[1:] < sms[:-1]):  # 記録順が ms 順でなければ並べ直す
+            idx = idx[np.argsort(sms, kind='stable')]
+            sms = ms[idx]
+        sensors[sid] = (sms, distance[idx])
+    return sensors
+
+
+# 記録の形式と、更新時刻を見るファイル (log.vlrec はディレクトリなので追記される index.bin)
+RECORDING_SOURCES = (('log.vlrec', 'index.bin'), ('log.vlz', None), ('log.csv', None))
+
+
+def find_recording(base_dir):
+    """base_dir の記録のうち最後に書かれたものを (名前, パス, 更新時刻) で返す
+
+    serial_console_csv_save の RECORD_FORMAT を変えると前の形式の記録が残るので、
+    形式の優先順ではなく更新時刻で選ぶ (同じ時刻なら log.vlrec > log.vlz > log.csv)。
+    他の形式の記録も残っていれば、どれを使ったかを warnings で知らせる。
+    """
+    found = []
+    for rank, (name, marker) in enumerate(RECORDING_SOURCES):
+        path = os.path.join(base_dir, name)
+        probe = os.path.join(path, marker) if marker else path
+        if os.path.isfile(probe):
+            found.append((os.path.getmtime(probe), -rank, name, path))
+    if not found:
+        raise FileNotFoundError(f"no recording ({', '.join(n for n, _ in RECORDING_SOURCES)}) in {base_dir}")
+    mtime, _, name, path = max(found)
+    if len(found) > 1:
+        others = ', '.join(n for _, _, n, _ in found if n != name)
+        warnings.warn(f"{base_dir}: using the newest recording {name} (older: {others})", stacklevel=2)
+    return name, path, mtime
+
+
+def load_sensors(base_dir):
+    """センサーIDごとの (ms, distance) 配列の dict を返す
+
+    find_recording() で選んだ最新の記録を読む (log.vlrec は memmap で開き、log.vlz は展開する)。
+    """
+    from analyze_common.recording import Recording
+    from analyze_common.varint_codec import read_vlz
+
+    name, path, _ = find_recording(base_dir)
+    if name == 'log.vlrec':
+        rec = Recording(path)
+        return {sid: (rec.column(sid, 'ms'), rec.column(sid, 'dist')) for sid in rec.sensors}
+    if name == 'log.vlz':
+        return {sid: (ms, dist) for sid, (t, ms, dist) in read_vlz(path).items()}
+    import pandas as pd
+
+    df = pd.read_csv(path, encoding='utf-8', usecols=["sensor_id", "ms", "distance"])
+    return group_sensors(df['sensor_id'].to_numpy(), df['ms'].to_numpy(), df['distance'].to_numpy(dtype=float))
+
+
+class SensorAnalysis:
+    """1センサー分の解析。各値は初めて参照したときに計算し、以後は同じものを返す"""
+
+    def __init__(self, sensor_id, ms, distance, cutoff, order):
+        self.sensor_id = sensor_id
+        self.ms = ms
+        self.distance = distance
+        self.cutoff_hz = cutoff
+        self.order = order
+
+    @functools.cached_property
+    def raw(self):
+        return np.asarray(self.distance, dtype=float)
+
+    @functools.cached_property
+    def mean_delta(self):
+        """平均のサンプリング周期 [ms] (2点未満なら 0)"""
+        return float(np.diff(self.ms).mean()) if len(self.ms) > 1 else 0.0
+
+    @functools.cached_property
+    def freq(self):
+        """平均のサンプリング周波数 [Hz]"""
+        return 1000.0 / self.mean_delta if self.mean_delta > 0 else 0
+
+    @functools.cached_property
+    def cutoff(self):
+        return min(self.cutoff_hz, self.freq / 2)  # ユーザー指定 or ナイキスト未満
+
+    @functools.cached_property
+    def filtered(self):
+        """ローパス後の系列 (フィルタをかけられないときは None)
+
+        NaN (タイムアウト・欠測) は lowpass_filter_gaps() と同じく扱う。
+        """
+        if len(self.ms) < 2:
+            return None
+        try:
+            return lowpass_filter_gaps(self.raw, self.cutoff, self.freq, order=self.order)
+        except Exception:
+            return None
+
+    @functools.cached_property
+    def spectrum(self):
+        """(周波数, フィルタ前の振幅, フィルタ後の振幅 or None)。周波数が出せなければ None
+
+        NaN (タイムアウト・欠測) があると rfft 全体が NaN になるので、hold_gaps() で埋めてから計算する。
+        """
+        if self.freq <= 0 or np.isnan(self.raw).all():
+            return None
+        xf = rfftfreq(len(self.raw), d=self.mean_delta / 1000.0)
+        raw = hold_gaps(self.raw)
+        yf_raw = abs(rfft(raw - raw.mean()))
+        filtered = self.filtered
+        if filtered is not None:
+            filtered = hold_gaps(filtered)
+        yf_filt = abs(rfft(filtered - filtered.mean())) if filtered is not None else None
+        return xf, yf_raw, yf_filt
+
+
+def analyze(sensors, cutoff, order, resample=False):
+    """load_sensors() の dict からセンサーIDごとの SensorAnalysis を作る"""
+    if resample:
+        from analyze_common.resample import resample_sensors
+
+        grid, values = resample_sensors(sensors, common=False)
+        sensors = {sid: (grid, values[sid]) for sid in values}
+    return {sid: SensorAnalysis(sid, ms, distance, cutoff, order) for sid, (ms, distance) in sensors.items()}
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="graph_viewer の解析部分の時間を、変更前の処理と比べる")
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--sensors', type=int, default=2)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    n = args.rows // args.sensors
+    ms = np.cumsum(20 + rng.integers(-1, 2, n))
+    df = pd.DataFrame({
+        'sensor_id': np.tile(np.arange(args.sensors), n),
+        'ms': np.repeat(ms, args.sensors),
+        'distance': 480 + 30 * np.sin(np.repeat(ms, args.sensors) / 5000) + rng.normal(0, 2, n * args.sensors),
+    })
+    print(f"{len(df)} rows, {args.sensors} sensors")
+
+    # 変更前: 図ごとにセンサーを抽出・並べ替えし、周期・フィルタ・FFT を計算し直す
+    start = time.perf_counter()
+    for _ in range(2):
+        for sid in df['sensor_id'].unique():
+            sdf = df[df['sensor_id'] == sid].sort_values('ms')
+            mean_delta = sdf['ms'].diff().mean()
+            freq = 1000.0 / mean_delta
+            cutoff = min(0.2, freq / 2)
+            b, a = butter(1, min(cutoff / (0.5 * freq), 0.99), btype='low')
+            filtered = filtfilt(b, a, sdf['distance'].to_numpy())
+            if _:
+                raw = hold_gaps(sdf['distance'].to_numpy())
+                abs(rfft(raw - raw.mean()))
+                abs(rfft(filtered - filtered.mean()))
+    old = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sensors = group_sensors(df['sensor_id'].to_numpy(), df['ms'].to_numpy(), df['distance'].to_numpy())
+    grouped = time.perf_counter() - start
+    results = analyze(sensors, 0.2, 1)
+    for r in results.values():
+        r.filtered
+    for r in results.values():
+        r.spectrum
+    new = time.perf_counter() - start
+    print(f"before  : {old:.2f} s")
+    print(f"pipeline: {new:.2f} s (grouping {grouped:.2f} s), {old / new:.1f}x faster")
@@ -0,0 +1,258 @@
+"""分割ローテーションする記録と、時刻から読み出し位置を引く索引
+
+長時間の連続記録を1つの log.csv に書き続けると、一部の時間帯を見るだけでも
+全体を読む必要がある。SessionLogger はサイズか時間で区切ったセグメント
+(log_00000.csv, log_00001.csv, ...) に書き、書き込んだブロックごとに
+
+    index.csv: segment,offset,length,rows,time_first,time_last,ms_first,ms_last
+
+を追記する (offset/length はセグメント内のバイト位置、time はホストの time.time()、
+ms はデバイスの ms)。SessionLog は索引から該当するブロックだけを読み出す。
+
+既存の log.csv には build_index() で同じ形式の索引 (log.index.csv) を作れる。
+
+    python -m analyze_common.session_log index log.csv
+    python -m analyze_common.session_log show session/ --sensor 1 \\
+        --start "2025-06-12 10:32:00" --end "2025-06-12 10:35:00"
+"""
+import csv
+import io
+import os
+import time
+
+import numpy as np
+
+from analyze_common.csv_logger import FILE_BUFFER, TIME_FORMAT, CsvLogger
+from analyze_common.recording import csv_time_to_epoch
+
+INDEX_NAME = 'index.csv'
+INDEX_SUFFIX = '.index.csv'  # build_index() の索引ファイル名 (log.csv → log.index.csv)
+SEGMENT_NAME = 'log_{:05d}.csv'
+INDEX_FIELDS = ['segment', 'offset', 'length', 'rows', 'time_first', 'time_last', 'ms_first', 'ms_last']
+SEGMENT_BYTES = 256 << 20  # セグメントの最大サイズ [bytes]
+SEGMENT_SECONDS = 3600  # セグメントの最大時間 [s]
+INDEX_BLOCK_ROWS = 4096  # build_index() の1ブロックの行数
+READ_CHUNK = 8 << 20
+
+
+class SessionLogger(CsvLogger):
+    """CsvLogger と同じ行を受け取り、ディレクトリ内のセグメントに分けて書く
+
+    ms_column: デバイスの ms が入っている列 (索引に範囲を載せる)
+    """
+
+    def __init__(self, directory, header=None, ms_column=2, segment_bytes=SEGMENT_BYTES,
+                 segment_seconds=SEGMENT_SECONDS, **kwargs):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.ms_column = ms_column
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.segment = -1
+        self._index_file = open(os.path.join(directory, INDEX_NAME), 'w', newline='', encoding='utf-8')
+        self._index = csv.writer(self._index_file)
+        self._index.writerow(INDEX_FIELDS)
+        self._index_file.flush()
+        self._text = io.StringIO()
+        super().__init__(None, header, **kwargs)
+
+    def _open_file(self):
+        """次のセグメントを開く (見出し行も書く)"""
+        self.segment += 1
+        self.segment_name = SEGMENT_NAME.format(self.segment)
+        self.file = open(os.path.join(self.directory, self.segment_name), 'wb', buffering=FILE_BUFFER)
+        self.offset = 0
+        self.segment_started = time.time()
+        self.writer = csv.writer(self._text)
+        if self.header is not None:
+            self.writer.writerow(self.header)
+            self._write_text()
+
+    def _write_text(self):
+        data = self._text.getvalue().encode('utf-8')
+        self._text.seek(0)
+        self._text.truncate()
+        self.file.write(data)
+        self.offset += len(data)
+        return len(data)
+
+    def _write_rows(self, rows):
+        # 溜まっていた行が多くても、索引とセグメントの区切りは block_rows 行ごとにする
+        for start in range(0, len(rows), self.block_rows):
+            self._write_block(rows[start:start + self.block_rows])
+
+    def _write_block(self, rows):
+        if self.offset >= self.segment_bytes or time.time() - self.segment_started >= self.segment_seconds:
+            self.file.close()
+            self._open_file()
+        times = [r[0] for r in rows]
+        ms = [r[self.ms_column] for r in rows]
+        offset = self.offset
+        super()._write_rows(rows)
+        length = self._write_text()
+        self._index.writerow([self.segment_name, offset, length, len(rows),
+                              f"{min(times):.3f}", f"{max(times):.3f}", min(ms), max(ms)])
+
+    def _flush(self):
+        # 索引はデータを書いた後に flush する (索引にあるブロックはファイルにある)
+        super()._flush()
+        self._index_file.flush()
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._index_file.close()
+
+
+def build_index(csv_path, index_path=None, block_rows=INDEX_BLOCK_ROWS, ms_column=2):
+    """既存の log.csv (1行目は見出し、先頭列は TIME_FORMAT の時刻) の索引を作り、パスを返す"""
+    import pandas as pd
+
+    if index_path is None:
+        index_path = os.path.splitext(csv_path)[0] + INDEX_SUFFIX
+    segment = os.path.relpath(csv_path, os.path.dirname(os.path.abspath(index_path)))
+    with open(csv_path, 'rb') as f, open(index_path, 'w', newline='', encoding='utf-8') as out:
+        index = csv.writer(out)
+        index.writerow(INDEX_FIELDS)
+        pos = len(f.readline())  # 見出し行
+        carry = b''
+        while True:
+            data = f.read(READ_CHUNK)
+            buf = carry + data
+            if not buf:
+                break
+            cut = buf.rfind(b'\n') + 1 if data else len(buf)
+            if cut == 0:
+                carry = buf
+                continue
+            body, carry = buf[:cut], buf[cut:]
+            ends = np.flatnonzero(np.frombuffer(body, dtype=np.uint8) == ord('\n')) + 1
+            if not len(ends) or ends[-1] != len(body):
+                ends = np.append(ends, len(body))  # 最後の行に改行がない
+            starts = np.concatenate(([0], ends[:-1]))
+            chunk = pd.read_csv(io.BytesIO(body), header=None, usecols=[0, ms_column], names=None)
+            t = csv_time_to_epoch(chunk[0].to_numpy())
+            ms = chunk[ms_column].to_numpy()
+            first = np.arange(0, len(ends), block_rows)
+            last = np.minimum(first + block_rows, len(ends)) - 1
+            for i, j, t_min, t_max, ms_min, ms_max in zip(
+                    first, last, np.minimum.reduceat(t, first), np.maximum.reduceat(t, first),
+                    np.minimum.reduceat(ms, first), np.maximum.reduceat(ms, first)):
+                index.writerow([segment, pos + starts[i], ends[j] - starts[i], j - i + 1,
+                                f"{t_min:.3f}", f"{t_max:.3f}", ms_min, ms_max])
+            pos += len(body)
+    return index_path
+
+
+class SessionLog:
+    """索引 (SessionLogger のディレクトリ、または build_index() の索引ファイル) から範囲を読み出す"""
+
+    def __init__(self, path):
+        import pandas as pd
+
+        index_path = os.path.join(path, INDEX_NAME) if os.path.isdir(path) else path
+        self.base = os.path.dirname(os.path.abspath(index_path))
+        try:
+            self.index = pd.read_csv(index_path, encoding='utf-8')
+        except pd.errors.EmptyDataError:
+            self.index = pd.DataFrame(columns=INDEX_FIELDS)  # 見出し行もまだ書かれていない索引
+        if len(self.index):
+            first = os.path.join(self.base, self.index['segment'].iloc[0])
+        elif index_path.endswith(INDEX_SUFFIX):
+            first = index_path[:-len(INDEX_SUFFIX)] + '.csv'  # 見出し行だけの log.csv の索引
+        else:
+            first = os.path.join(self.base, SEGMENT_NAME.format(0))  # まだブロックを書いていないセッション
+        try:
+            with open(first, encoding='utf-8') as f:
+                self.columns = next(csv.reader(f))
+        except (FileNotFoundError, StopIteration):
+            raise ValueError(f"{index_path} has no blocks and {first} has no header yet") from None
+
+    def blocks(self, t_start=None, t_end=None, ms_start=None, ms_end=None):
+        """範囲に重なるブロックの索引行"""
+        idx = self.index
+        mask = np.ones(len(idx), dtype=bool)
+        if t_start is not None:
+            mask &= idx['time_last'].to_numpy() >= t_start
+        if t_end is not None:
+            mask &= idx['time_first'].to_numpy() < t_end
+        if ms_start is not None:
+            mask &= idx['ms_last'].to_numpy() >= ms_start
+        if ms_end is not None:
+            mask &= idx['ms_first'].to_numpy() < ms_end
+        return idx[mask]
+
+    def read(self, t_start=None, t_end=None, ms_start=None, ms_end=None, sensor_id=None):
+        """範囲内の行を DataFrame で返す (時刻は time.time() の秒、または TIME_FORMAT の文字列)"""
+        import pandas as pd
+
+        t_start, t_end = (parse_time(t) for t in (t_start, t_end))
+        frames = []
+        blocks = self.blocks(t_start, t_end, ms_start, ms_end)
+        # 同じセグメントで連続するブロックは1回で読む
+        for segment, group in blocks.groupby('segment', sort=False):
+            with open(os.path.join(self.base, segment), 'rb') as f:
+                offsets = group['offset'].to_numpy()
+                ends = offsets + group['length'].to_numpy()
+                split = np.flatnonzero(offsets[1:] != ends[:-1]) + 1
+                for run in np.split(np.arange(len(group)), split):
+                    f.seek(offsets[run[0]])
+                    data = f.read(ends[run[-1]] - offsets[run[0]])
+                    frames.append(pd.read_csv(io.BytesIO(data), header=None, names=self.columns,
+                                              dtype={self.columns[1]: str}))
+        if not frames:
+            return pd.DataFrame(columns=self.columns)
+        df = pd.concat(frames, ignore_index=True)
+        mask = np.ones(len(df), dtype=bool)
+        if t_start is not None or t_end is not None:
+            t = csv_time_to_epoch(df[self.columns[0]].to_numpy())
+            if t_start is not None:
+                mask &= t >= np.floor(t_start)  # CSV の時刻は秒単位
+            if t_end is not None:
+                mask &= t < t_end
+        ms = df[self.columns[2]].to_numpy()
+        if ms_start is not None:
+            mask &= ms >= ms_start
+        if ms_end is not None:
+            mask &= ms < ms_end
+        if sensor_id is not None:
+            mask &= df[self.columns[1]].to_numpy() == str(sensor_id)
+        return df[mask].reset_index(drop=True)
+
+
+def parse_time(t):
+    """TIME_FORMAT の文字列 (ローカル時刻) を time.time() の秒にする。数値と None はそのまま"""
+    if isinstance(t, str):
+        return time.mktime(time.strptime(t, TIME_FORMAT))
+    return t
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="分割記録の索引作成と範囲読み出し")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_index = sub.add_parser('index', help="既存の log.csv の索引を作る")
+    p_index.add_argument('csv')
+    p_index.add_argument('--block-rows', type=int, default=INDEX_BLOCK_ROWS)
+    p_show = sub.add_parser('show', help="範囲の行を CSV で出力する")
+    p_show.add_argument('path', help="SessionLogger のディレクトリ、または索引ファイル")
+    p_show.add_argument('--sensor')
+    p_show.add_argument('--start', help=f"開始時刻 ({TIME_FORMAT.replace('%', '%%')})")
+    p_show.add_argument('--end', help="終了時刻")
+    p_show.add_argument('--ms-start', type=int)
+    p_show.add_argument('--ms-end', type=int)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == 'index':
+        path = build_index(args.csv, block_rows=args.block_rows)
+        print(f"{path}: {time.perf_counter() - start:.2f} s")
+    else:
+        import sys
+
+        log = SessionLog(args.path)
+        df = log.read(args.start, args.end, args.ms_start, args.ms_end, args.sensor)
+        df.to_csv(sys.stdout, index=False, na_rep='NULL')
+        print(f"{len(df)} rows in {time.perf_counter() - start:.3f} s", file=sys.stderr)
@@ -0,0 +1,327 @@
+"""VL53L1X / BNO085 ファームウェアの擬似デバイス (pty)
+
+実機の代わりに pty を作り、ファームウェアと同じ形式でデータを流す。
+レート・センサー数・ノイズ・タイムアウト・データ破損の割合を変えられるので、
+実機より速いレートでホスト側のスクリプトに負荷をかけられる。
+
+    vl53       `short,20000,20\\n` などのコマンドに OK を返し、`id,ms,dist|NULL` を流す
+    bno-csv    `milisec,x,y,z` (serial_console_*.py / TUI_*.py)
+    bno-frames \\xAA\\x55 + <14f + CRC16 の60バイトフレーム (code6.py → SC_Bin.py)
+    bno-head   "BINARY COM" のあと HEAD + <Bffff + 合計チェックサムの25バイトフレーム
+               (double_2_BIN01.py → SC_BIN01.py)
+
+    python -m analyze_common.simulator vl53 --link COM6 --sensors 2 --timeout-rate 0.01
+    python -m analyze_common.simulator bno-frames --link COM3 --rate 2000 --corrupt-rate 0.01
+
+--link は capture.py と同じく pty へのシンボリックリンクを作る (PORT = 'COM6' のまま使える)。
+ホストがポートを開いている間だけ送り、読まずにバッファが一杯になった分は
+実機と同じく捨てて dropped_bytes に数える。
+"""
+import errno
+import os
+import time
+
+import numpy as np
+
+from analyze_common.bno_frames import FRAME_DTYPE, HEADER_U16
+from analyze_common.crc16 import crc16_ccitt_batch
+
+TICK = 0.002  # 送信ループの間隔 [s]
+MAX_BURST = 0.1  # 遅れたときに1回でまとめて送る上限 [s 分]
+CONNECT_DELAY = 0.2  # ホストがポートを開いてから送り始めるまで [s]
+
+# SC_BIN01.py が読む形式 ('<4sBffffI'、チェックサムは先頭21バイトの合計)
+HEAD_DTYPE = np.dtype([
+    ('header', 'S4'),
+    ('sensor_id', 'u1'),
+    ('timestamp', '<f4'),
+    ('accel', '<f4', (3,)),
+    ('checksum', '<u4'),
+])
+assert HEAD_DTYPE.itemsize == 25
+
+
+class PtyDevice:
+    """pty のマスター側。generate(n) で n サンプル分のバイト列を作るサブクラスを rate [Hz] で流す"""
+
+    record_len = 1  # 破損率をバイト単位に換算するための1レコードの長さ
+
+    def __init__(self, rate=100.0, noise=1.0, corrupt_rate=0.0, link=None, seed=None):
+        import tty
+
+        self.rate = rate
+        self.noise = noise
+        self.corrupt_rate = corrupt_rate
+        self.rng = np.random.default_rng(seed)
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.slave_name = os.ttyname(slave)
+        # スレーブは閉じておく (ホストが開いているかをマスターの read の EIO で判定する)
+        os.close(slave)
+        os.set_blocking(self.master, False)
+        self.link = link
+        if link:
+            if os.path.islink(link):
+                os.remove(link)
+            os.symlink(self.slave_name, link)
+        self.samples = 0
+        self.sent_bytes = 0
+        self.dropped_bytes = 0
+        self.dropped_samples = 0  # ホストがポートを開いていない間に捨てたサンプル
+        self.streaming = True
+        self.connected = False
+        self.started = time.monotonic()
+        self._connected_at = None
+        self._host = b''
+
+    def millis(self):
+        """起動からの ms (ファームウェアの millis() 相当)"""
+        return int((time.monotonic() - self.started) * 1000)
+
+    def write(self, data):
+        """書けた分だけ書き、残りは捨てる (ホストが読まずに pty のバッファが一杯のとき)"""
+        try:
+            n = os.write(self.master, data)
+        except BlockingIOError:
+            n = 0
+        self.sent_bytes += n
+        self.dropped_bytes += len(data) - n
+
+    def corrupt(self, data):
+        """corrupt_rate (1レコードあたりの確率) でバイトを壊す"""
+        if self.corrupt_rate <= 0 or not data:
+            return data
+        n = self.rng.binomial(len(data), min(1.0, self.corrupt_rate / self.record_len))
+        if not n:
+            return data
+        buf = np.frombuffer(data, dtype=np.uint8).copy()
+        pos = self.rng.integers(0, len(buf), n)
+        buf[pos] ^= self.rng.integers(1, 256, n, dtype=np.uint8)
+        return buf.tobytes()
+
+    def on_line(self, line):
+        """ホストから1行届いたときの処理 (サブクラスで上書き)"""
+
+    def on_connect(self):
+        """ホストがポートを開いたときの処理 (サブクラスで上書き)"""
+
+    def _poll_host(self, now):
+        """ホストの接続状態を確認し、届いた行を処理する"""
+        try:
+            data = os.read(self.master, 4096)
+        except BlockingIOError:
+            data = b''
+        except OSError as e:
+            if e.errno != errno.EIO:
+                raise
+            # スレーブを誰も開いていない
+            self.connected = False
+            self._connected_at = None
+            return
+        if not self.connected:
+            self.connected = True
+            self._connected_at = now
+        if not data:
+            return
+        self._host += data
+        *lines, self._host = self._host.split(b'\n')
+        for line in lines:
+            self.on_line(line.strip().decode(errors='ignore'))
+
+    def generate(self, n):
+        raise NotImplementedError
+
+    def start_stream(self):
+        self.streaming = True
+        self._stream_start = time.monotonic()
+        self._stream_sent = 0
+
+    def ready(self):
+        """ホストがポートを開いて CONNECT_DELAY 経ったか (開いた直後は pyserial が受信バッファを捨てる)"""
+        return self.connected and time.monotonic() - self._connected_at >= CONNECT_DELAY
+
+    def run(self, duration=None):
+        if self.streaming:
+            self.start_stream()
+        start = time.monotonic()
+        announced = False
+        while duration is None or time.monotonic() - start < duration:
+            time.sleep(TICK)
+            now = time.monotonic()
+            self._poll_host(now)
+            if not self.connected:
+                announced = False
+            elif not announced and self.ready():
+                announced = True
+                self.on_connect()
+            if not self.streaming:
+                continue
+            due = int((now - self._stream_start) * self.rate) - self._stream_sent
+            if due <= 0:
+                continue
+            if announced:
+                n = min(due, max(1, int(self.rate * MAX_BURST)))
+                self.write(self.corrupt(self.generate(n)))
+                self.samples += n
+            else:
+                self.dropped_samples += due
+            self._stream_sent += due  # 送りきれなかった分は追いかけない (実機と同じく間引かれる)
+
+    def close(self):
+        if self.link and os.path.islink(self.link):
+            os.remove(self.link)
+        os.close(self.master)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _times(self, n):
+        """n サンプル分のデバイス時刻 [ms] (直近のサンプルほど新しい)"""
+        now = self.millis()
+        return now - (np.arange(n)[::-1] * (1000.0 / self.rate)).astype(np.int64)
+
+
+class Vl53Simulator(PtyDevice):
+    """VL53L1X (main.cpp): モード設定コマンドに OK を返し、`id,ms,dist|NULL` を流す
+
+    rate を指定しなければ、コマンドの測定間隔 (3番目の値 [ms]) からレートを決める。
+    """
+
+    record_len = 12
+
+    def __init__(self, sensors=2, base_mm=400.0, timeout_rate=0.0, rate=None, wait_command=True, **kwargs):
+        super().__init__(rate=rate or 50.0, **kwargs)
+        self.sensors = sensors
+        self.base_mm = base_mm
+        self.timeout_rate = timeout_rate
+        self.fixed_rate = rate is not None
+        self.streaming = not wait_command
+
+    def on_line(self, line):
+        parts = line.split(',')
+        if len(parts) == 3 and parts[0] in ('short', 'medium', 'long'):
+            try:
+                interval = int(parts[2])
+            except ValueError:
+                return
+            if not self.fixed_rate and interval > 0:
+                self.rate = 1000.0 / interval
+            self.write(b"OK\n")
+            self.start_stream()
+
+    def generate(self, n):
+        ms = np.repeat(self._times(n), self.sensors)
+        ids = np.tile(np.arange(self.sensors), n)
+        # センサーごとに少しずつ違う距離がゆっくり揺れる + ノイズ
+        dist = self.base_mm + 10 * ids + 20 * np.sin(ms / 1000.0) + self.rng.normal(0, self.noise, len(ms))
+        timeout = self.rng.random(len(ms)) < self.timeout_rate
+        lines = [
+            f"{i},{m},NULL\n" if t else f"{i},{m},{d:.0f}\n"
+            for i, m, d, t in zip(ids.tolist(), ms.tolist(), dist.tolist(), timeout.tolist())
+        ]
+        return ''.join(lines).encode()
+
+
+class BnoCsvSimulator(PtyDevice):
+    """BNO085 の `milisec,x,y,z` 行"""
+
+    record_len = 36
+
+    def generate(self, n):
+        ms = self._times(n)
+        xyz = self.rng.normal(0, self.noise * 0.01, (n, 3)) + (0.0, 0.0, 9.80665)
+        return ''.join(
+            f"{m},{x:.6f},{y:.6f},{z:.6f}\r\n" for m, (x, y, z) in zip(ms.tolist(), xyz.tolist())
+        ).encode()
+
+
+class BnoFrameSimulator(PtyDevice):
+    """code6.py の \\xAA\\x55 + <14f (time, accel, gyro, mag, quat) + CRC16 フレーム"""
+
+    record_len = FRAME_DTYPE.itemsize
+
+    def generate(self, n):
+        frames = np.zeros(n, dtype=FRAME_DTYPE)
+        frames['header'] = HEADER_U16
+        frames['timestamp'] = self._times(n) / 1000.0
+        frames['accel'] = self.rng.normal(0, self.noise * 0.01, (n, 3)) + (0.0, 0.0, 9.80665)
+        frames['gyro'] = self.rng.normal(0, self.noise * 0.001, (n, 3))
+        frames['mag'] = self.rng.normal(0, self.noise * 0.1, (n, 3)) + (20.0, 0.0, -40.0)
+        frames['quat'] = (0.0, 0.0, 0.0, 1.0)
+        payload = frames.view(np.uint8).reshape(n, -1)[:, 2:-2]
+        frames['crc'] = crc16_ccitt_batch(payload)
+        return frames.tobytes()
+
+
+class BnoHeadSimulator(PtyDevice):
+    """double_2_BIN01.py の HEAD フレーム (センサーID 1, 2, ...)。最初に "BINARY COM" 行を送る"""
+
+    record_len = HEAD_DTYPE.itemsize
+
+    def __init__(self, sensors=2, **kwargs):
+        super().__init__(**kwargs)
+        self.sensors = sensors
+
+    def on_connect(self):
+        self.write(b"[INFO] Sensors initialized successfully.\r\nBINARY COM\r\n")
+
+    def generate(self, n):
+        frames = np.zeros(n * self.sensors, dtype=HEAD_DTYPE)
+        frames['header'] = b'HEAD'
+        frames['sensor_id'] = np.tile(np.arange(1, self.sensors + 1), n)
+        frames['timestamp'] = np.repeat(self._times(n), self.sensors)
+        frames['accel'] = self.rng.normal(0, self.noise * 0.01, (len(frames), 3)) + (0.0, 0.0, 9.80665)
+        raw = frames.view(np.uint8).reshape(len(frames), -1)
+        frames['checksum'] = raw[:, :-4].sum(axis=1, dtype=np.uint32)
+        return frames.tobytes()
+
+
+DEVICES = {
+    'vl53': Vl53Simulator,
+    'bno-csv': BnoCsvSimulator,
+    'bno-frames': BnoFrameSimulator,
+    'bno-head': BnoHeadSimulator,
+}
+
+
+if __name__ == "__main__":
+    import argparse
+    import signal
+    import sys
+
+    parser = argparse.ArgumentParser(description="VL53L1X / BNO085 の擬似デバイス (pty)")
+    parser.add_argument('device', choices=DEVICES)
+    parser.add_argument('--link', help="pty へのシンボリックリンクを作るパス (例: COM6)")
+    parser.add_argument('--rate', type=float, help="サンプリングレート [Hz] (vl53 は省略時コマンドの間隔から)")
+    parser.add_argument('--sensors', type=int, default=2, help="センサー数 (vl53, bno-head)")
+    parser.add_argument('--noise', type=float, default=1.0, help="ノイズの大きさ (vl53 は mm の標準偏差)")
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help="vl53 の NULL 行の割合")
+    parser.add_argument('--corrupt-rate', type=float, default=0.0, help="1レコードあたりのデータ破損の確率")
+    parser.add_argument('--no-wait', action='store_true', help="vl53 でコマンドを待たずに流し始める")
+    parser.add_argument('--duration', type=float)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    kwargs = dict(noise=args.noise, corrupt_rate=args.corrupt_rate, link=args.link, seed=args.seed)
+    if args.device == 'vl53':
+        device = Vl53Simulator(args.sensors, timeout_rate=args.timeout_rate, rate=args.rate,
+                               wait_command=not args.no_wait, **kwargs)
+    elif args.device == 'bno-head':
+        device = BnoHeadSimulator(args.sensors, rate=args.rate or 100.0, **kwargs)
+    else:
+        device = DEVICES[args.device](rate=args.rate or 100.0, **kwargs)
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # kill でもリンクを消して終わる
+    with device:
+        print(f"{device.slave_name}" + (f" ({args.link})" if args.link else "") + f" で {args.device} を開始します。Ctrl+Cで終了します。")
+        start = time.monotonic()
+        try:
+            device.run(args.duration)
+        except KeyboardInterrupt:
+            pass
+        elapsed = time.monotonic() - start
+        print(f"{device.samples} samples ({device.samples / elapsed:.0f}/s), "
+              f"{device.sent_bytes} bytes sent, {device.dropped_bytes} bytes dropped")
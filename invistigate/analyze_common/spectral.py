@@ -0,0 +1,221 @@
+"""全センサーまとめての Welch PSD / STFT と、記録ごとのキャッシュ
+
+graph_viewer のスペクトルはセンサーごとに全長の rfft を1回ずつ計算していたため、
+長い記録ではノイズの多いスペクトルになり、メモリも全長分の複素数配列が要る。
+ここでは全チャンネル (センサー、フィルタ前後) の系列を nperseg 点の区間に切り、
+区間を行とする行列に積んで窓掛け・rfft を1回で計算する。
+行列は BATCH_SEGMENTS 行ずつ作るので、使うメモリは記録の長さによらない。
+NaN (タイムアウト) を含む区間は平均から除く。
+
+結果は scipy.signal.welch (window='hann', detrend='constant', scaling='density') と同じ。
+recording_psd() は結果を記録と同じディレクトリの log.psd.npz に保存し、
+記録と設定が同じなら次回はそれを読む (キャッシュは VL53L1X_I2C_CPP_test の .gitignore で除外)。
+
+    python -m analyze_common.spectral --rows 10000000
+"""
+import json
+import os
+
+import numpy as np
+from numpy.fft import rfft, rfftfreq
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import get_window
+
+NPERSEG = 256
+BATCH_SEGMENTS = 4096  # 一度に rfft する区間数
+CACHE_NAME = 'log.psd.npz'
+
+
+def _segments(x, nperseg, step):
+    """x を step ずつずらした nperseg 点の区間 (コピーしないビュー)"""
+    return sliding_window_view(np.asarray(x), nperseg)[::step]
+
+
+def _batches(channels, nperseg, step, batch_segments):
+    """各チャンネルの区間を batch_segments 行ずつの行列にまとめ、(行列, 各行のチャンネル番号) を返す"""
+    rows, owners, size = [], [], 0
+    for ch, x in enumerate(channels):
+        segs = _segments(x, nperseg, step)
+        pos = 0
+        while pos < len(segs):
+            part = segs[pos:pos + batch_segments - size]
+            rows.append(part)
+            owners.append(np.full(len(part), ch))
+            size += len(part)
+            pos += len(part)
+            if size == batch_segments:
+                yield np.concatenate(rows).astype(np.float64), np.concatenate(owners)
+                rows, owners, size = [], [], 0
+    if rows:
+        yield np.concatenate(rows).astype(np.float64), np.concatenate(owners)
+
+
+def _spectra(matrix, window, detrend=True):
+    """各行に (detrend なら平均を引いてから) 窓を掛け、rfft した複素スペクトル"""
+    if detrend:
+        matrix -= matrix.mean(axis=1, keepdims=True)
+    matrix *= window
+    return rfft(matrix, axis=1)
+
+
+def _group_by_nperseg(channels, nperseg):
+    """nperseg より短いチャンネルは全長を1区間にする (scipy.signal.welch と同じ)"""
+    groups = {}
+    for name, (x, fs) in channels.items():
+        groups.setdefault(min(nperseg, len(x)), []).append(name)
+    return groups
+
+
+def welch_batch(channels, nperseg=NPERSEG, noverlap=None, batch_segments=BATCH_SEGMENTS):
+    """channels: 名前 → (系列, サンプリング周波数 [Hz]) の dict
+
+    名前 → (周波数, PSD [単位^2/Hz], 使った区間数) の dict を返す。
+    使える区間がないチャンネルの PSD は NaN。
+    """
+    result = {}
+    for n, names in _group_by_nperseg(channels, nperseg).items():
+        if n < 2:
+            continue
+        step = n - (n // 2 if noverlap is None else min(noverlap, n - 1))
+        window = get_window('hann', n)
+        power = np.zeros((len(names), n // 2 + 1))
+        counts = np.zeros(len(names), dtype=np.int64)
+        xs = [channels[name][0] for name in names]
+        for matrix, owner in _batches(xs, n, step, batch_segments):
+            valid = ~np.isnan(matrix).any(axis=1)
+            owner = owner[valid]
+            spec = np.abs(_spectra(matrix[valid], window)) ** 2
+            for i in np.unique(owner):  # 1つの行列に入るチャンネルは数個
+                power[i] += spec[owner == i].sum(axis=0)
+            counts += np.bincount(owner, minlength=len(names))
+        # 片側スペクトルなので DC と (偶数長の) ナイキスト以外を2倍する
+        power[:, 1:(n + 1) // 2] *= 2
+        for i, name in enumerate(names):
+            fs = channels[name][1]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                psd = power[i] / counts[i] / (fs * (window ** 2).sum())
+            result[name] = (rfftfreq(n, 1 / fs), psd, int(counts[i]))
+    return result
+
+
+def stft_batch(channels, nperseg=NPERSEG, noverlap=None):
+    """名前 → (周波数, 区間の中心時刻 [s], 複素スペクトル (周波数 x 区間)) の dict
+
+    scipy.signal.stft(..., boundary=None, padded=False) と同じく、両端のパディングはせず区間に収まる部分だけを使う。
+    NaN を含む区間の列は NaN になる。
+    """
+    result = {}
+    for n, names in _group_by_nperseg(channels, nperseg).items():
+        if n < 2:
+            continue
+        step = n - (n // 2 if noverlap is None else min(noverlap, n - 1))
+        window = get_window('hann', n)
+        xs = [channels[name][0] for name in names]
+        parts = {i: [] for i in range(len(names))}
+        for matrix, owner in _batches(xs, n, step, BATCH_SEGMENTS):
+            spec = _spectra(matrix, window, detrend=False) / window.sum()
+            for i in np.unique(owner):
+                parts[i].append(spec[owner == i])
+        for i, name in enumerate(names):
+            fs = channels[name][1]
+            spec = np.concatenate(parts[i]).T
+            t = (np.arange(spec.shape[1]) * step + n / 2) / fs
+            result[name] = (rfftfreq(n, 1 / fs), t, spec)
+    return result
+
+
+def _source_signature(base_dir):
+    """load_sensors() が読む記録のパス・サイズ・更新時刻 (変わったらキャッシュを作り直す)"""
+    from analyze_common.sensor_pipeline import RECORDING_SOURCES, find_recording
+
+    try:
+        name, path, _ = find_recording(base_dir)
+    except FileNotFoundError:
+        return None
+    marker = dict(RECORDING_SOURCES)[name]
+    st = os.stat(os.path.join(path, marker) if marker else path)
+    return [name, st.st_size, st.st_mtime_ns]
+
+
+def recording_psd(base_dir, nperseg=NPERSEG, noverlap=None, cutoff=None, order=1, resample=False, results=None):
+    """記録のセンサーごとの Welch PSD を ('raw'|'lpf', センサーID) → (周波数, PSD) の dict で返す
+
+    cutoff を渡すと sensor_pipeline のローパス後の系列 ('lpf') も同じ行列で計算する。
+    resample は analyze() と同じ。results (同じ設定の analyze() の結果) を渡せば読み込み・フィルタをやり直さない。
+    """
+    key = json.dumps({'source': _source_signature(base_dir), 'nperseg': nperseg, 'noverlap': noverlap,
+                      'cutoff': cutoff, 'order': order, 'resample': resample})
+    cache_path = os.path.join(base_dir, CACHE_NAME)
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cache:
+            if str(cache['key']) == key:
+                names = json.loads(str(cache['names']))
+                return {tuple(name): (cache[f'f{i}'], cache[f'psd{i}']) for i, name in enumerate(names)}
+
+    from analyze_common.sensor_pipeline import analyze, load_sensors
+
+    if results is None:
+        results = analyze(load_sensors(base_dir), cutoff if cutoff is not None else 0, order, resample)
+    channels = {}
+    for sid, r in results.items():
+        if r.freq > 0:
+            channels[('raw', sid)] = (r.raw, r.freq)
+            if cutoff is not None and r.filtered is not None:
+                channels[('lpf', sid)] = (r.filtered, r.freq)
+    psd = {name: (f, p) for name, (f, p, _) in welch_batch(channels, nperseg, noverlap).items()}
+    names = list(psd)
+    arrays = {}
+    for i, name in enumerate(names):
+        arrays[f'f{i}'], arrays[f'psd{i}'] = psd[name]
+    np.savez(cache_path, key=key, names=json.dumps([list(name) for name in names]), **arrays)
+    return psd
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    import tracemalloc
+
+    from scipy.signal import welch
+
+    parser = argparse.ArgumentParser(description="全センサーまとめての Welch PSD を scipy / 全長 rfft と比べる")
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--sensors', type=int, default=4)
+    parser.add_argument('--nperseg', type=int, default=NPERSEG)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    n = args.rows // args.sensors
+    fs = 26.5
+    t = np.arange(n) / fs
+    channels = {}
+    for sid in range(args.sensors):
+        x = 480 + 5 * np.sin(2 * np.pi * (1 + sid) * t) + rng.normal(0, 2, n)
+        x[rng.random(n) < 1e-5] = np.nan
+        channels[sid] = (x, fs)
+    print(f"{args.rows} rows, {args.sensors} sensors, nperseg={args.nperseg}")
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    psd = welch_batch(channels, args.nperseg)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    for sid, (x, _) in channels.items():
+        raw = np.nan_to_num(x, nan=480)
+        abs(rfft(raw - raw.mean()))
+    fft_time = time.perf_counter() - start
+    fft_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    err = 0.0
+    for sid, (x, _) in channels.items():
+        f, ref = welch(np.nan_to_num(x, nan=480), fs, nperseg=args.nperseg)
+        err = max(err, float(np.max(np.abs(psd[sid][1] - ref) / ref.max())))
+    ref_time = time.perf_counter() - start
+    print(f"welch_batch         : {elapsed:.2f} s, peak {peak / 1e6:.1f} MB")
+    print(f"full-length rfft    : {fft_time:.2f} s, peak {fft_peak / 1e6:.1f} MB")
+    print(f"scipy welch per ch. : {ref_time:.2f} s, max relative diff {err:.1e} (NaN segments: "
+          f"{sum(n // (args.nperseg // 2) - 1 - v[2] for v in psd.values())} skipped)")
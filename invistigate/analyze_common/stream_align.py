@@ -0,0 +1,194 @@
+"""受信中の複数センサーを共通のデバイス時刻に揃える (待ち時間の上限つき)
+
+TUI はどれか1つのセンサーが届くたびに、そのセンサーの値と他のセンサーの最新の値で角度を出していた。
+他のセンサーの値は数十ms 古いことがあり、どれだけずれていたかも残らない。
+StreamAligner はセンサーごとに受信したサンプルを少しだけ持っておき、
+resample と同じ period [ms] の格子の時刻 (k * period) ごとに全センサーの値を線形補間して出す。
+
+格子点 t は、全センサーが t 以降のサンプルまで届いた時点で出す。
+届かないセンサーがあっても、いずれかのセンサーの ms が t + max_wait を過ぎたら待たずに出す
+(そのセンサーの値は NaN)。止まったセンサーがあっても遅れは max_wait で頭打ちになる。
+センサーの ms は同じマイコンの時計なので、待ち時間もデバイスの ms で測る。
+
+格子は最初の poll() の時点 (keys を渡したときは、そのセンサーが全員1つ以上届いた時点) で、
+届いているセンサーの最初のサンプルのうち最も遅いものから始める。それより前のサンプルは
+最初の格子点の補間にだけ使い、それより前の格子点は出さない。keys のセンサーがそろわなくても、
+最初のサンプルから max_wait を過ぎたら届いているセンサーだけで始める (遅れは max_wait まで)。
+keys を渡さないと、後から現れたセンサーはその時点から加わり、それまでの格子点では NaN になる。
+
+各格子点の skew は、補間に使った各センサーの最も近いサンプルの ms の開き (最大 - 最小)。
+angle.angles_asof() の skew (組にした2つの値の ms の差) と同じ意味で、センサーの数は問わない。
+
+    aligner = StreamAligner(20, max_wait=60, keys=['0', '1'])
+    aligner.push(sample.sensor_id, sample.ms, sample.dist)
+    grid, values, skew = aligner.poll()   # values: センサーID → 格子点ごとの値
+
+    python -m analyze_common.stream_align --rows 100000 --sensors 3
+"""
+import math
+
+import numpy as np
+
+from analyze_common.resample import MAX_GAP_PERIODS, interp_masked
+
+
+class StreamAligner:
+    """センサーごとの受信バッファと、次に出す格子点
+
+    keys: 格子を始める前にそろうのを待つセンサーID。それ以外のセンサーも最初に push() されたときに加わる。
+    """
+
+    def __init__(self, period, max_wait, max_gap=None, keys=()):
+        self.period = period
+        self.max_wait = max_wait
+        self.max_gap = period * MAX_GAP_PERIODS if max_gap is None else max_gap
+        self.expected = tuple(keys)
+        self.keys = list(self.expected)
+        self._ms = {}
+        self._val = {}
+        self.reset()
+
+    def reset(self):
+        """バッファを捨てて最初からやり直す (センサーの一覧は残す)"""
+        for key in self.keys:
+            self._ms[key] = []
+            self._val[key] = []
+        self._next = None  # 次に出す格子点の番号
+        self.newest = -math.inf  # 受信した最新の ms (全センサー)
+        self.late = 0  # 全センサーがそろう前に max_wait で出した格子点の数
+
+    def push(self, key, ms, value):
+        """サンプルを1つ入れる (value が None ならタイムアウトとして NaN)。ms が戻ったら reset() する"""
+        if key not in self._ms:
+            self.keys.append(key)
+            self._ms[key] = []
+            self._val[key] = []
+        buf = self._ms[key]
+        if buf and ms < buf[-1]:
+            self.reset()
+            buf = self._ms[key]
+        buf.append(ms)
+        self._val[key].append(math.nan if value is None else value)
+        self.newest = max(self.newest, ms)
+
+    def _empty(self):
+        return np.empty(0), {key: np.empty(0) for key in self.keys}, np.empty(0)
+
+    def poll(self, flush=False):
+        """出せるようになった格子点を (格子の ms, センサーID → 値, skew [ms]) で返す
+
+        flush=True なら待たずに最新の ms までの格子点を出す (記録の終わりなど)。
+        """
+        if self._next is None:
+            firsts = [buf[0] for buf in self._ms.values() if buf]
+            if not firsts:
+                return self._empty()
+            waiting = any(not self._ms[key] for key in self.expected)
+            if waiting and not flush and self.newest - min(firsts) < self.max_wait:
+                return self._empty()
+            self._next = math.ceil(max(firsts) / self.period)
+        covered = min((buf[-1] if buf else -math.inf) for buf in self._ms.values())
+        limit = self.newest if flush else max(covered, self.newest - self.max_wait)
+        last = math.floor(limit / self.period)
+        if last < self._next:
+            return self._empty()
+        grid = np.arange(self._next, last + 1, dtype=np.float64) * self.period
+        values = {}
+        nearest = np.full((len(grid), len(self.keys)), np.nan)
+        for col, key in enumerate(self.keys):
+            ms = np.asarray(self._ms[key], dtype=np.float64)
+            out = interp_masked(ms, self._val[key], grid, self.max_gap)
+            values[key] = out
+            if len(ms):
+                # 補間に使った両側のサンプルのうち近い方の ms
+                right = np.clip(np.searchsorted(ms, grid), 0, len(ms) - 1)
+                left = np.maximum(right - 1, 0)
+                near = np.where(np.abs(grid - ms[left]) <= np.abs(ms[right] - grid), ms[left], ms[right])
+                nearest[:, col] = np.where(np.isnan(out), np.nan, near)
+                # 次の格子点の左側になる最後のサンプルから後ろだけ残す
+                keep = max(int(np.searchsorted(ms, grid[-1], side='right')) - 1, 0)
+                del self._ms[key][:keep], self._val[key][:keep]
+        valid = ~np.isnan(nearest)
+        pairs = valid.sum(axis=1) >= 2
+        skew = np.full(len(grid), np.nan)
+        if pairs.any():
+            both = nearest[pairs]
+            skew[pairs] = (np.max(np.where(valid[pairs], both, -np.inf), axis=1)
+                           - np.min(np.where(valid[pairs], both, np.inf), axis=1))
+        self.late += int(np.count_nonzero(grid > covered))
+        self._next = last + 1
+        return grid, values, skew
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from analyze_common.resample import resample_sensors
+
+    parser = argparse.ArgumentParser(description="受信順に流したときの整列結果・遅れ・skew を記録全体の再サンプリングと比べる")
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--sensors', type=int, default=3)
+    parser.add_argument('--period', type=float, default=20)
+    parser.add_argument('--max-wait', type=float, default=60, help="待ち時間の上限 [ms]")
+    parser.add_argument('--block', type=int, default=4, help="1回の受信で届く行数")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    n = args.rows // args.sensors
+    t = np.arange(n) * args.period
+    sensors = {}
+    rows = []
+    for k in range(args.sensors):
+        sid = str(k)
+        ms = (t + 7 * k + rng.integers(-2, 3, n)).astype(np.int64)  # センサーごとに数ms ずれて届く
+        keep = rng.random(n) >= 0.001
+        if k == args.sensors - 1:
+            keep[n // 2:n // 2 + 50] = False  # 1秒止まるセンサー
+        ms = ms[keep]
+        dist = 480 + 10 * k + 30 * np.sin(ms / 3000) + rng.normal(0, 2, len(ms))
+        dist[rng.random(len(ms)) < 0.005] = np.nan
+        sensors[sid] = (ms, dist)
+        rows += [(sid, m, d) for m, d in zip(ms.tolist(), dist.tolist())]
+    rows.sort(key=lambda r: (r[1], r[0]))  # 受信順 = ms 順
+
+    aligner = StreamAligner(args.period, args.max_wait, keys=list(sensors))
+    grids, parts, skews, latency = [], [], [], 0.0
+    start = time.perf_counter()
+    for i in range(0, len(rows), args.block):
+        for sid, m, d in rows[i:i + args.block]:
+            aligner.push(sid, m, d)
+        grid, values, skew = aligner.poll()
+        if len(grid):
+            latency = max(latency, aligner.newest - grid[0])
+            grids.append(grid)
+            parts.append(values)
+            skews.append(skew)
+    grid, values, skew = aligner.poll(flush=True)
+    grids.append(grid)
+    parts.append(values)
+    skews.append(skew)
+    elapsed = time.perf_counter() - start
+    grid = np.concatenate(grids)
+    skew = np.concatenate(skews)
+
+    # 記録全体を補間した値と同じ (止まったセンサーは max_gap を超えるので、どちらでも NaN)
+    ref_grid, ref = resample_sensors(sensors, args.period, common=False)
+    start_idx = int(np.searchsorted(ref_grid, grid[0]))
+    assert np.array_equal(ref_grid[start_idx:start_idx + len(grid)], grid)
+    for sid in sensors:
+        got = np.concatenate([p[sid] for p in parts])
+        want = ref[sid][start_idx:start_idx + len(grid)]
+        assert np.allclose(got, want, equal_nan=True)
+
+    print(f"{len(rows)} rows, {args.sensors} sensors, period {args.period:.0f} ms, max_wait {args.max_wait:.0f} ms")
+    print(f"StreamAligner: {elapsed:.2f} s ({len(rows) / elapsed / 1e3:.0f} k rows/s), {len(grid)} aligned points, "
+          f"same values as resample_sensors()")
+    print(f"latency (device ms, including the {args.block}-row receive block) max {latency:.0f} ms, "
+          f"{aligner.late} points emitted by max_wait")
+    print(f"skew median {np.nanmedian(skew):.0f} ms, max {np.nanmax(skew):.0f} ms")
+    if args.sensors >= 2:
+        from analyze_common.angle import angles_asof
+
+        _, _, asof_skew = angles_asof(sensors, ids=['0', '1'])
+        print(f"(angle TUI pairing of sensors 0/1: skew median {np.median(asof_skew):.0f} ms, max {asof_skew.max():.0f} ms)")
@@ -0,0 +1,184 @@
+"""CSV テキスト行のまとめ読み・一括パース
+
+readline() で1行ずつ読んで split(',') と float() を繰り返す代わりに、
+受信済みのバイト列をまとめて読み (read(in_waiting))、行の端数は次回に持ち越し、
+数値行はまとめて np.fromstring で変換する。
+
+`NULL` を含む行 (VL53L1X のタイムアウト) や `[` で始まる行
+(MANY2040 の `[SP]` ステータス行)、列数の合わない行は数値化せず
+サイドチャネル (文字列のリスト) として返す。
+"""
+import re
+import warnings
+
+import numpy as np
+
+SIDE_MARKERS = (b'NULL', b'[')
+
+
+def _to_floats(text, expected):
+    """カンマ/改行区切りの数値列を変換する。途中で変換できなければ None"""
+    with warnings.catch_warnings():
+        # 変換できない文字があると途中で止まり DeprecationWarning を出すので、件数で判定する
+        warnings.simplefilter('ignore', DeprecationWarning)
+        try:
+            values = np.fromstring(text, dtype=np.float64, sep=',')
+        except ValueError:
+            return None
+    return values if values.size == expected else None
+
+
+def _commas_per_line(body, nlines):
+    """改行で区切った各行のカンマの数 (行ごとに split せず、バイト列全体をまとめて数える)"""
+    buf = np.frombuffer(body, dtype=np.uint8)
+    newlines = np.flatnonzero(buf == ord('\n'))
+    commas = np.flatnonzero(buf == ord(','))
+    return np.bincount(np.searchsorted(newlines, commas), minlength=nlines)
+
+
+class LineParser:
+    """受信バイト列を流し込み、(数値行の (n, ncols) 配列, サイドチャネルの行) を返す"""
+
+    def __init__(self, ncols, side_markers=SIDE_MARKERS):
+        self.ncols = ncols
+        self.side_markers = side_markers
+        # マーカーを含む行を (改行ごと) まとめて取り出す正規表現
+        self._side_re = re.compile(
+            rb'^[^\n]*(?:' + b'|'.join(re.escape(m) for m in side_markers) + rb')[^\n]*(?:\n|$)', re.M)
+        self.carry = b''
+        self.lines = 0
+        self.side_lines = 0
+
+    def feed(self, data):
+        chunk = self.carry + data if self.carry else data
+        cut = chunk.rfind(b'\n')
+        if cut < 0:
+            self.carry = chunk
+            return np.empty((0, self.ncols)), []
+        body = chunk[:cut]
+        self.carry = chunk[cut + 1:]
+        nlines = body.count(b'\n') + 1
+        self.lines += nlines
+        side = []
+        if any(m in body for m in self.side_markers):
+            # サイドチャネルの行を正規表現でまとめて抜き出す
+            side = [line.strip().decode(errors='ignore') for line in self._side_re.findall(body)]
+            body = self._side_re.sub(b'', body).rstrip(b'\n')
+            nlines = body.count(b'\n') + 1 if body else 0
+        # 残りがすべて列数の合う数値行なら1回で変換する (合計の件数だけでは、
+        # 列の多い行と少ない行が隣り合うと行をまたいで並び直されてしまうので、行ごとのカンマ数も見る)
+        values = None
+        if nlines and (_commas_per_line(body, nlines) == self.ncols - 1).all():
+            values = _to_floats(body.replace(b'\n', b','), nlines * self.ncols)
+        if values is None:
+            values, more = self._feed_mixed(body)
+            side.extend(more)
+        self.side_lines += len(side)
+        return values.reshape(-1, self.ncols), side
+
+    def _feed_mixed(self, body):
+        """列数の合わない行や空行が混ざっている場合: 行を振り分けてから数値行だけまとめて変換"""
+        numeric = []
+        side = []
+        sep_count = self.ncols - 1
+        for line in body.split(b'\n'):
+            line = line.strip()
+            if not line:
+                continue
+            if line.count(b',') != sep_count or any(m in line for m in self.side_markers):
+                side.append(line.decode(errors='ignore'))
+            else:
+                numeric.append(line)
+        values = _to_floats(b','.join(numeric), len(numeric) * self.ncols)
+        if values is None:
+            # 数値に変換できない行が混ざっている: 1行ずつ確認する
+            rows = []
+            for line in numeric:
+                try:
+                    rows.append([float(p) for p in line.split(b',')])
+                except ValueError:
+                    side.append(line.decode(errors='ignore'))
+            values = np.array(rows, dtype=np.float64)
+        return values, side
+
+
+class ChunkedReader:
+    """シリアルポートから受信済みのデータをまとめて読み、LineParser に通す"""
+
+    def __init__(self, ser, ncols, side_markers=SIDE_MARKERS):
+        self.ser = ser
+        self.parser = LineParser(ncols, side_markers)
+
+    def read(self):
+        """(数値行の (n, ncols) 配列, サイドチャネルの行) を返す。何もなければ空"""
+        return self.parser.feed(self.ser.read(self.ser.in_waiting or 1))
+
+
+if __name__ == "__main__":
+    import io
+    import time
+
+    class FakeSerial(io.RawIOBase):
+        """pyserial と同じく io.RawIOBase を継承した疑似ポート (readline() は1バイトずつ読む)"""
+        def __init__(self, data):
+            self.data = data
+            self.pos = 0
+
+        def readable(self):
+            return True
+
+        @property
+        def in_waiting(self):
+            return min(4096, len(self.data) - self.pos)
+
+        def readinto(self, b):
+            n = min(len(b), len(self.data) - self.pos)
+            b[:n] = self.data[self.pos:self.pos + n]
+            self.pos += n
+            return n
+
+    # 1行あたりのコスト: readline() + split + float と、まとめ読み + 一括パースの比較
+    N = 50_000
+    imu = b''.join(f"{1000 + i},{0.001 * i:.6f},-0.654321,9.806650\r\n".encode() for i in range(N))
+    imu += b"1,2,3,4,5\r\n6,7,8\r\n"  # 列数は合計で合うが行ごとには合わない (数値行に並び直さない)
+    vl53 = b''.join(
+        (f"{i % 2},{5000 + 20 * (i // 2)},NULL\r\n" if i % 500 == 0 else
+         f"{i % 2},{5000 + 20 * (i // 2)},{400 + i % 50}\r\n").encode()
+        for i in range(N)
+    ) + b"[SP]BNO08x Reinitialized!\r\n"
+
+    def per_line(ser, ncols):
+        values = []
+        side = []
+        while ser.pos < len(ser.data):
+            line = ser.readline().decode(errors='ignore').strip()
+            if not line:
+                continue
+            parts = line.split(',')
+            if len(parts) == ncols and 'NULL' not in parts:
+                try:
+                    values.append(tuple(map(float, parts)))
+                    continue
+                except ValueError:
+                    pass
+            side.append(line)
+        return values, side
+
+    for label, data, ncols in (("milisec,x,y,z", imu, 4), ("id,ms,dist|NULL", vl53, 3)):
+        n_lines = data.count(b'\n')
+        t0 = time.perf_counter()
+        ref_values, ref_side = per_line(FakeSerial(data), ncols)
+        t_line = time.perf_counter() - t0
+
+        ser = FakeSerial(data)
+        reader = ChunkedReader(ser, ncols)
+        t0 = time.perf_counter()
+        out = []
+        while ser.pos < len(data):
+            out.append(reader.read())
+        t_bulk = time.perf_counter() - t0
+        values = np.concatenate([v for v, _ in out])
+        side = [s for _, ss in out for s in ss]
+        assert np.array_equal(values, np.array(ref_values)) and side == ref_side
+        print(f"{label:16s}: readline {t_line / n_lines * 1e9:6.0f} ns/line, "
+              f"chunked {t_bulk / n_lines * 1e9:5.0f} ns/line ({t_line / t_bulk:.0f}x), side={len(side)}")
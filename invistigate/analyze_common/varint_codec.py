@@ -0,0 +1,301 @@
+"""差分 + zigzag varint + ブロック圧縮による記録形式 (.vlz)
+
+log.csv は1行あたり約30〜40バイトのテキストだが、VL53L1X の距離は16bit、
+デバイスの ms はほぼ一定間隔 (SENSOR_CMD_INTERVAL) で増えるだけなので、
+センサーごとに前の値との差分を取り、zigzag (符号を下位ビットへ) + varint
+(7bit ずつ、続きがあれば最上位ビットを立てる) で詰めると多くの値が1バイトになる。
+それをブロックごとに zlib か lzma で圧縮する。
+
+ファイルは MAGIC のあとにブロックを並べたもの:
+
+    <B 圧縮方式> <H センサーIDの長さ> センサーID <I 行数> <I 圧縮後の長さ> 圧縮データ
+
+圧縮データを展開すると <III> (各列の varint 列のバイト数) に続いて
+time (ホスト時刻 [ms])・ms・dist (0 はタイムアウト、それ以外は距離+1) の
+差分の varint 列が並ぶ。各ブロックの最初の差分は 0 からの値なので、ブロック単位で独立して読める。
+エンコード・デコードともに NumPy でまとめて処理する (1値ずつの Python ループはない)。
+
+    python -m analyze_common.varint_codec encode log.csv            # log.vlz を作る
+    python -m analyze_common.varint_codec bench log.csv             # サイズと読み込み時間の比較
+"""
+import lzma
+import math
+import struct
+import time
+import zlib
+
+import numpy as np
+
+MAGIC = b'VLZ1'
+BLOCK_HEAD = struct.Struct('<BH')
+BLOCK_SIZES = struct.Struct('<II')
+STREAM_SIZES = struct.Struct('<III')
+METHODS = {'none': 0, 'zlib': 1, 'lzma': 2}
+BLOCK_ROWS = 65536
+FLUSH_INTERVAL = 1.0  # [s]
+
+
+def zigzag_encode(values):
+    """int64 → uint64 (0, -1, 1, -2, ... を 0, 1, 2, 3, ... に)"""
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def zigzag_decode(values):
+    values = np.asarray(values, dtype=np.uint64)
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+
+def varint_encode(values):
+    """uint64 配列を varint のバイト列にする"""
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b''
+    # 各値のバイト数 (7bit ごと、最低1バイト)
+    lengths = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for k in range(int(lengths.max())):
+        mask = lengths > k
+        byte = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        byte |= np.where(lengths[mask] > k + 1, np.uint64(0x80), np.uint64(0))
+        out[starts[mask] + k] = byte
+    return out.tobytes()
+
+
+def varint_decode(data):
+    """varint のバイト列を uint64 配列にする"""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(buf < 0x80)  # 各値の最後のバイト
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts + 1
+    values = np.zeros(len(ends), dtype=np.uint64)
+    for k in range(int(lengths.max()) if len(lengths) else 0):
+        mask = lengths > k
+        values[mask] |= (buf[starts[mask] + k] & 0x7F).astype(np.uint64) << np.uint64(7 * k)
+    return values
+
+
+def _compress(data, method):
+    if method == METHODS['zlib']:
+        return zlib.compress(data, 6)
+    if method == METHODS['lzma']:
+        return lzma.compress(data, preset=6)
+    return data
+
+
+def _decompress(data, method):
+    if method == METHODS['zlib']:
+        return zlib.decompress(data)
+    if method == METHODS['lzma']:
+        return lzma.decompress(data)
+    return data
+
+
+def encode_block(t, ms, dist, method=METHODS['zlib']):
+    """1センサー分の列を圧縮データにする (t: time.time() の秒、dist: NaN はタイムアウト)"""
+    t_ms = np.round(np.asarray(t, dtype=np.float64) * 1000).astype(np.int64)
+    dist = np.asarray(dist, dtype=np.float64)
+    dist_code = np.where(np.isnan(dist), 0, np.round(np.nan_to_num(dist)) + 1).astype(np.int64)
+    streams = [
+        varint_encode(zigzag_encode(np.diff(col, prepend=0)))
+        for col in (t_ms, np.asarray(ms, dtype=np.int64), dist_code)
+    ]
+    return _compress(STREAM_SIZES.pack(*map(len, streams)) + b''.join(streams), method)
+
+
+class VlzWriter:
+    """RecordingWriter / CsvLogger と同じ行を受け取り、センサーごとにブロックにまとめて書く"""
+
+    def __init__(self, path, method='zlib', block_rows=BLOCK_ROWS, flush_interval=FLUSH_INTERVAL):
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.method = METHODS[method]
+        self.block_rows = block_rows
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._last_flush = time.monotonic()
+        self.rows = 0
+
+    def writerows(self, rows):
+        """(time.time(), sensor_id, ms, distance) の行を追加する (distance は 'NULL'/None 可)"""
+        for t, sensor_id, ms, dist in rows:
+            pending = self._pending.setdefault(sensor_id, [])
+            pending.append((t, ms, math.nan if dist is None or dist == 'NULL' else float(dist)))
+            if len(pending) >= self.block_rows:
+                self._write_pending(sensor_id)
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def append_columns(self, sensor_id, t, ms, dist):
+        self._write_pending(sensor_id)
+        for start in range(0, len(ms), self.block_rows):
+            end = start + self.block_rows
+            self._write_block(sensor_id, t[start:end], ms[start:end], dist[start:end])
+
+    def _write_pending(self, sensor_id):
+        pending = self._pending.pop(sensor_id, None)
+        if pending:
+            self._write_block(sensor_id, *zip(*pending))
+
+    def _write_block(self, sensor_id, t, ms, dist):
+        payload = encode_block(t, ms, dist, self.method)
+        sid = str(sensor_id).encode()
+        self.file.write(BLOCK_HEAD.pack(self.method, len(sid)) + sid
+                        + BLOCK_SIZES.pack(len(ms), len(payload)) + payload)
+        self.rows += len(ms)
+
+    def flush(self):
+        for sensor_id in list(self._pending):
+            self._write_pending(sensor_id)
+        self.file.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _blocks(data):
+    """(センサーID, 行数, 展開したデータ) を順に返す"""
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a vlz file")
+    pos = len(MAGIC)
+    while pos + BLOCK_HEAD.size <= len(data):
+        method, sid_len = BLOCK_HEAD.unpack_from(data, pos)
+        pos += BLOCK_HEAD.size
+        sensor_id = data[pos:pos + sid_len].decode()
+        pos += sid_len
+        rows, size = BLOCK_SIZES.unpack_from(data, pos)
+        pos += BLOCK_SIZES.size
+        if pos + size > len(data):
+            return  # 書き込み途中で止まった末尾
+        yield sensor_id, rows, _decompress(data[pos:pos + size], method)
+        pos += size
+
+
+def _cumsum_blocks(deltas, rows):
+    """ブロックごとに 0 から始まる累積和"""
+    total = np.cumsum(deltas)
+    starts = np.cumsum(rows) - rows
+    base = np.where(starts > 0, total[np.maximum(starts - 1, 0)], 0)
+    return total - np.repeat(base, rows)
+
+
+def read_vlz(path):
+    """センサーIDごとの (time [s], ms, dist [mm], タイムアウトは NaN) の dict を返す"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    streams = {}
+    for sensor_id, rows, raw in _blocks(data):
+        sizes = STREAM_SIZES.unpack_from(raw)
+        cols = streams.setdefault(sensor_id, ([], [], [], []))
+        pos = STREAM_SIZES.size
+        for col, size in zip(cols, sizes):
+            col.append(raw[pos:pos + size])
+            pos += size
+        cols[3].append(rows)
+    result = {}
+    for sensor_id, (t_parts, ms_parts, dist_parts, rows) in streams.items():
+        rows = np.array(rows, dtype=np.int64)
+        # センサーごとに全ブロックの varint 列をつなげて1回でデコードする
+        t_ms, ms, dist_code = (
+            _cumsum_blocks(zigzag_decode(varint_decode(b''.join(parts))), rows)
+            for parts in (t_parts, ms_parts, dist_parts)
+        )
+        dist = np.where(dist_code == 0, np.nan, dist_code - 1).astype(np.float32)
+        result[sensor_id] = (t_ms / 1000.0, ms, dist)
+    return result
+
+
+def convert_csv(csv_path, out_path, method='zlib', chunksize=1_000_000):
+    """log.csv (timestamp,sensor_id,ms,distance) を .vlz に変換し、行数を返す"""
+    import pandas as pd
+
+    from analyze_common.recording import csv_time_to_epoch
+
+    total = 0
+    with VlzWriter(out_path, method) as writer:
+        for chunk in pd.read_csv(csv_path, encoding='utf-8', dtype={'sensor_id': str}, chunksize=chunksize):
+            t = csv_time_to_epoch(chunk['timestamp'].to_numpy())
+            ms = chunk['ms'].to_numpy()
+            dist = pd.to_numeric(chunk['distance'], errors='coerce').to_numpy()
+            sid = chunk['sensor_id'].to_numpy()
+            for sensor_id in pd.unique(sid):
+                mask = sid == sensor_id
+                writer.append_columns(sensor_id, t[mask], ms[mask], dist[mask])
+            total += len(chunk)
+    return total
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="log.csv と .vlz の変換・比較")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_enc = sub.add_parser('encode', help="log.csv を .vlz に変換する")
+    p_enc.add_argument('csv')
+    p_enc.add_argument('out', nargs='?')
+    p_enc.add_argument('--method', choices=METHODS, default='zlib')
+    p_bench = sub.add_parser('bench', help="CSV と .vlz のサイズ・読み込み時間を比べる (省略時は合成データ)")
+    p_bench.add_argument('csv', nargs='?')
+    p_bench.add_argument('--rows', type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    if args.command == 'encode':
+        out = args.out or os.path.splitext(args.csv)[0] + '.vlz'
+        rows = convert_csv(args.csv, out, args.method)
+        print(f"{args.csv} -> {out}: {rows} rows, {os.path.getsize(args.csv)} -> {os.path.getsize(out)} bytes")
+    else:
+        import pandas as pd
+
+        with tempfile.TemporaryDirectory() as d:
+            csv_path = args.csv
+            if csv_path is None:
+                # 50Hz x 2センサーの記録を模した合成データ (ms のジッタ・距離のノイズ・タイムアウトあり)
+                from analyze_common.csv_logger import CsvLogger
+
+                rng = np.random.default_rng(0)
+                n = args.rows // 2
+                ms = 5000 + np.cumsum(20 + rng.integers(-1, 2, n))
+                csv_path = os.path.join(d, 'log.csv')
+                with CsvLogger(csv_path, ["timestamp", "sensor_id", "ms", "distance"]) as logger:
+                    for sid, base in (('0', 480), ('1', 490)):
+                        dist = np.round(base + 30 * np.sin(ms / 5000) + rng.normal(0, 2, n)).astype(int)
+                        timeout = rng.random(n) < 0.005
+                        logger.writerows(
+                            (1.75e9 + m / 1000, sid, m, 'NULL' if to else dv)
+                            for m, dv, to in zip(ms.tolist(), dist.tolist(), timeout.tolist())
+                        )
+            start = time.perf_counter()
+            df = pd.read_csv(csv_path, encoding='utf-8', usecols=["sensor_id", "ms", "distance"])
+            csv_time = time.perf_counter() - start
+            csv_size = os.path.getsize(csv_path)
+            print(f"csv : {csv_size / 1e6:8.2f} MB, pd.read_csv {csv_time:.2f} s ({len(df)} rows)")
+            for method in ('zlib', 'lzma'):
+                out = os.path.join(d, f'log.{method}.vlz')
+                start = time.perf_counter()
+                convert_csv(csv_path, out, method)
+                enc_time = time.perf_counter() - start
+                start = time.perf_counter()
+                sensors = read_vlz(out)
+                dec_time = time.perf_counter() - start
+                for sid, (t, ms, dist) in sensors.items():
+                    sdf = df[df['sensor_id'].astype(str) == sid]
+                    assert np.array_equal(sdf['ms'].to_numpy(), ms)
+                    assert np.array_equal(sdf['distance'].to_numpy(), dist, equal_nan=True)
+                size = os.path.getsize(out)
+                print(f"{method:4s}: {size / 1e6:8.2f} MB ({csv_size / size:4.1f}x smaller), "
+                      f"read_vlz {dec_time:.2f} s ({csv_time / dec_time:.1f}x faster), encode {enc_time:.2f} s")
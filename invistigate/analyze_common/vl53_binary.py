@@ -0,0 +1,187 @@
+"""VL53L1X バイナリ出力 (WIP_main_bin.cpp_) の受信
+
+レコードは区切りなしの7バイト: uint32 ms, uint16 dist, uint8 timeout (リトルエンディアン)。
+ヘッダーがないため、ms が単調増加し間隔が妥当 (0〜max_gap_ms) で timeout が 0/1 の
+レコードが SYNC_RECORDS 個続く位置を探して同期をとる。途中でずれた場合は
+そこまでを確定して再同期する。デコードはバッファ単位で NumPy の列として行う。
+"""
+import numpy as np
+
+from analyze_common.records import RangeSample
+from analyze_common.text_parse import ChunkedReader
+
+RECORD_DTYPE = np.dtype([('ms', '<u4'), ('dist', '<u2'), ('timeout', 'u1')])
+RECORD_LEN = RECORD_DTYPE.itemsize  # 7バイト
+SYNC_RECORDS = 8  # 同期確定に必要な連続した妥当レコード数
+MAX_GAP_MS = 1000  # 連続レコードの ms 間隔の上限
+
+
+def _plausible_pairs(recs, max_gap_ms):
+    """recs[i] -> recs[i+1] が妥当かどうかの bool 配列 (長さ len(recs)-1)"""
+    d = np.diff(recs['ms'].astype(np.int64))
+    flags_ok = recs['timeout'] <= 1
+    return (d >= 0) & (d <= max_gap_ms) & flags_ok[:-1] & flags_ok[1:]
+
+
+def find_sync(buf, sync_records=SYNC_RECORDS, max_gap_ms=MAX_GAP_MS):
+    """妥当なレコードが sync_records 個続く最初のバイト位置を返す (見つからなければ None)"""
+    best = None
+    for offset in range(RECORD_LEN):
+        count = (len(buf) - offset) // RECORD_LEN
+        if count < sync_records:
+            continue
+        recs = np.frombuffer(buf, dtype=RECORD_DTYPE, count=count, offset=offset)
+        ok = _plausible_pairs(recs, max_gap_ms).astype(np.int32)
+        # ok の連続 (sync_records-1) 個がすべて True になる窓を探す
+        window = np.convolve(ok, np.ones(sync_records - 1, dtype=np.int32), mode='valid')
+        hits = np.flatnonzero(window == sync_records - 1)
+        if len(hits):
+            pos = offset + int(hits[0]) * RECORD_LEN
+            if best is None or pos < best:
+                best = pos
+    return best
+
+
+class Vl53BinaryReceiver:
+    """受信バイト列を流し込むと、同期済みのレコードを構造化配列で返す"""
+
+    def __init__(self, sync_records=SYNC_RECORDS, max_gap_ms=MAX_GAP_MS):
+        self.sync_records = sync_records
+        self.max_gap_ms = max_gap_ms
+        self.buf = bytearray()
+        self.locked = False
+        self.last_ms = None
+        self.resyncs = 0
+        self.bytes_skipped = 0
+
+    def _skip(self, n):
+        self.bytes_skipped += n
+        del self.buf[:n]
+
+    def feed(self, data):
+        """data を追加し、新たに確定したレコード (RECORD_DTYPE の配列) を返す"""
+        self.buf += data
+        out = []
+        while True:
+            if not self.locked:
+                pos = find_sync(self.buf, self.sync_records, self.max_gap_ms)
+                if pos is None:
+                    # 次回の探索に必要な分だけ残す
+                    keep = self.sync_records * RECORD_LEN + RECORD_LEN - 1
+                    if len(self.buf) > keep:
+                        self._skip(len(self.buf) - keep)
+                    break
+                self._skip(pos)
+                self.locked = True
+                self.last_ms = None
+            count = len(self.buf) // RECORD_LEN
+            if count == 0:
+                break
+            recs = np.frombuffer(self.buf, dtype=RECORD_DTYPE, count=count)
+            ok = _plausible_pairs(recs, self.max_gap_ms)
+            if self.last_ms is not None:
+                d = int(recs['ms'][0]) - self.last_ms
+                first_ok = 0 <= d <= self.max_gap_ms and recs['timeout'][0] <= 1
+            else:
+                first_ok = recs['timeout'][0] <= 1
+            if not first_ok:
+                good = 0
+            else:
+                bad = np.flatnonzero(~ok)
+                good = count if len(bad) == 0 else int(bad[0]) + 1
+            if good:
+                # コピーしてから bytearray を縮める (frombuffer のビューが残っていると縮められない)
+                out.append(recs[:good].copy())
+                self.last_ms = int(recs['ms'][good - 1])
+            del recs
+            del self.buf[:good * RECORD_LEN]
+            if good == count:
+                break
+            # ずれを検出: 1バイト進めて再同期
+            self.locked = False
+            self.resyncs += 1
+            self._skip(1)
+        if not out:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        return out[0] if len(out) == 1 else np.concatenate(out)
+
+
+def decode_buffer(buf, **kwargs):
+    """保存済みのバイナリ全体をまとめてデコードする"""
+    return Vl53BinaryReceiver(**kwargs).feed(buf)
+
+
+def records_to_samples(recs, sensor_id='0'):
+    """レコード配列を RangeSample のリストにする (timeout のときは dist=None)"""
+    return [
+        RangeSample(sensor_id, ms, None if timeout else float(dist))
+        for ms, dist, timeout in zip(recs['ms'].tolist(), recs['dist'].tolist(), recs['timeout'].tolist())
+    ]
+
+
+def text_to_samples(values, side):
+    """LineParser の結果 (id,ms,dist の数値行と、NULL を含むサイドチャネル行) を RangeSample にする
+
+    タイムアウト行はサイドチャネルに分かれて届くので、ms 順に並べ直して返す。
+    """
+    samples = [RangeSample(str(int(sid)), int(ms), dist) for sid, ms, dist in values.tolist()]
+    if side:
+        for line in side:
+            try:
+                samples.append(RangeSample.from_parts(line.split(',')))
+            except ValueError:
+                pass  # 起動メッセージ・タイムアウト通知などの文字列行
+        samples.sort(key=lambda s: s.ms)
+    return samples
+
+
+def make_sample_reader(ser, mode='text', sensor_id='0'):
+    """受信済みのデータをまとめて読み、RangeSample のリストを返す関数を作る
+
+    mode='text'  : 従来の `id,ms,dist|NULL` 行 (text_parse.ChunkedReader で一括パース)
+    mode='binary': WIP_main_bin.cpp_ の7バイトレコード (sensor_id は固定)
+    """
+    if mode == 'text':
+        reader = ChunkedReader(ser, 3)
+
+        def read_samples():
+            return text_to_samples(*reader.read())
+    elif mode == 'binary':
+        receiver = Vl53BinaryReceiver()
+
+        def read_samples():
+            return records_to_samples(receiver.feed(ser.read(ser.in_waiting or 1)), sensor_id)
+    else:
+        raise ValueError(f"unknown link mode: {mode!r}")
+    return read_samples
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    rng = random.Random(0)
+    n = 200_000
+    ms = np.cumsum(np.array([rng.randint(19, 22) for _ in range(n)], dtype=np.int64)) + 5000
+    recs = np.zeros(n, dtype=RECORD_DTYPE)
+    recs['ms'] = ms
+    recs['dist'] = [rng.randint(40, 1300) for _ in range(n)]
+    recs['timeout'] = [1 if rng.random() < 0.01 else 0 for _ in range(n)]
+    # 先頭にテキスト (起動メッセージ)、途中に欠落バイトを入れる
+    stream = bytearray(b"Adafruit VL53L1X Example\r\nOK\r\n")
+    raw = recs.tobytes()
+    for i in range(0, len(raw), RECORD_LEN * 5000):
+        chunk = raw[i:i + RECORD_LEN * 5000]
+        stream += chunk[:-3] if i else chunk  # 各ブロック末尾の3バイトを落とす
+
+    receiver = Vl53BinaryReceiver()
+    got = []
+    t0 = time.perf_counter()
+    for i in range(0, len(stream), 4096):
+        got.append(receiver.feed(bytes(stream[i:i + 4096])))
+    elapsed = time.perf_counter() - t0
+    got = np.concatenate(got)
+    assert np.all(np.diff(got['ms'].astype(np.int64)) >= 0)
+    assert set(got['ms'].tolist()) <= set(ms.tolist())
+    print(f"{len(got)}/{n} records, {receiver.resyncs} resyncs, "
+          f"{len(stream) / elapsed / 1e6:.1f} MB/s")
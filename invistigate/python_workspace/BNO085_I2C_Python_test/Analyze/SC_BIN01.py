@@ -3,6 +3,7 @@ import serial.tools.list_ports
 import threading
 import struct
 import time # 追加 (オプション)
+import os
 
 # 利用可能なCOMポートを表示
 ports = list(serial.tools.list_ports.comports())
@@ -11,7 +12,7 @@ for p in ports:
     print(p.device)
 
 # COMポートとボーレートを設定
-PORT = 'COM3'  # 必要に応じて変更
+PORT = os.environ.get('SERIAL_PORT', 'COM3')  # 必要に応じて変更（環境変数 SERIAL_PORT で上書き。capture の再生 pty 用）
 BAUD = 115200
 
 try:
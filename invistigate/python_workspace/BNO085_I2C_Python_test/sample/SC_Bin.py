@@ -2,20 +2,15 @@
 import serial
 import serial.tools.list_ports
 import threading
-import struct # 追加: バイナリデータ処理のため
+import numpy as np
 
-# CRC16-CCITT (0x1021, 初期値0xFFFF)
-def crc16_ccitt(data: bytes, poly=0x1021, init=0xFFFF) -> int:
-    crc = init
-    for b in data:
-        crc ^= b << 8
-        for _ in range(8):
-            if crc & 0x8000:
-                crc = (crc << 1) ^ poly
-            else:
-                crc <<= 1
-            crc &= 0xFFFF
-    return crc
+import os
+import sys
+
+# 共通モジュール(analyze_common)を読み込むためのパス設定
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+from analyze_common.ring_framer import FRAME_LEN, RingFramer
+from analyze_common.bno_frames import decode_frames, to_table
 
 # 利用可能なCOMポートを表示して選択する
 def select_com_port():
@@ -40,8 +35,8 @@ def select_com_port():
         print("数字を入力してください。")
         return None
 
-# ポート選択
-PORT = select_com_port()
+# ポート選択（環境変数 SERIAL_PORT があればそれを使う。comports() に出ない capture の再生 pty 用）
+PORT = os.environ.get('SERIAL_PORT') or select_com_port()
 if not PORT:
     print("有効なCOMポートが選択されていません。プログラムを終了します。")
     exit()
@@ -53,41 +48,19 @@ ser = serial.Serial(PORT, BAUD, timeout=1)
 HEADER = b'\xAA\x55'  # 2バイトの開始シンボル
 
 def read_serial():
-    expected_data_length = 2 + 14 * 4 + 2  # HEADER(2) + 14 floats(56) + CRC16(2) = 60バイト
-    buffer = b''
+    # HEADER(2) + 14 floats(56) + CRC16(2) = 60バイトのフレームをリングバッファで切り出す
+    # CRC は decode_frames がまとめて検証する (フレームごとの check は渡さない)
+    framer = RingFramer(HEADER, FRAME_LEN)
     while True:
-        buffer += ser.read(ser.in_waiting or 1)
-        while True:
-            header_pos = buffer.find(HEADER)
-            if header_pos == -1:
-                # HEADERが見つからなければバッファを短く保つ
-                buffer = buffer[-1:]
-                break
-            if len(buffer) < header_pos + expected_data_length:
-                # パケット全体が揃うまで待つ
-                break
-            packet = buffer[header_pos:header_pos+expected_data_length]
-            buffer = buffer[header_pos+expected_data_length:]
-            data = packet[2:-2]
-            recv_crc_bytes = packet[-2:]
-            recv_crc = struct.unpack('<H', recv_crc_bytes)[0]
-            calc_crc = crc16_ccitt(data)
-            if recv_crc != calc_crc:
-                print(f"[ERROR] CRC mismatch! Received: {recv_crc:04X}, Calculated: {calc_crc:04X}")
-                continue
+        framer.fill(ser)
+        for run in framer.runs():
             try:
-                unpacked_data = struct.unpack("<14f", data)
-                timestamp = unpacked_data[0]
-                accel = unpacked_data[1:4]
-                gyro = unpacked_data[4:7]
-                mag = unpacked_data[7:10]
-                quat = unpacked_data[10:14]
-                print(f"{timestamp:.3f}", end=",")
-                print(f"{accel[0]:.3f},{accel[1]:.3f},{accel[2]:.3f}", end=",")
-                print(f"{gyro[0]:.3f},{gyro[1]:.3f},{gyro[2]:.3f}", end=",")
-                print(f"{mag[0]:.3f},{mag[1]:.3f},{mag[2]:.3f},{quat[0]:.3f},{quat[1]:.3f},{quat[2]:.3f},{quat[3]:.3f}")
-            except struct.error as e:
-                print(f"[ERROR] Failed to unpack data: {e}")
+                # 連続したフレームをまとめてデコード (CRC不一致は除外される)
+                frames, dropped = decode_frames(run)
+                if dropped:
+                    print(f"[ERROR] CRC mismatch in {dropped} frame(s)")
+                # timestamp, accel, gyro, mag, quat の14列をCSVとして一度に出力
+                np.savetxt(sys.stdout, to_table(frames), fmt='%.3f', delimiter=',')
             except Exception as e:
                 print(f"[ERROR] Unexpected error processing data: {e}")
 